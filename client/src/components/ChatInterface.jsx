@@ -31,7 +31,7 @@ export default function ChatInterface() {
   const chatEndRef = useRef(null);
 
   const { isListening, browserSupport, handleMicClick } = useSpeech((transcript) => setInput(transcript));
-  const { submitChat, isLoading, streamingResponse, promptsRemaining, maxPrompts } = useChat(jwt, activeConversationId, messages);
+  const { submitChat, isLoading, streamingResponse, promptsRemaining, maxPrompts } = useChat(jwt, activeConversationId);
   const isSendDisabled = isLoading || (promptsRemaining !== null && promptsRemaining <= 0);
 
   useEffect(() => {
@@ -3,7 +3,7 @@ import { useDispatch } from "react-redux"
 import { addMessage, setConversationId, fetchConversations } from "../redux/convoSlice"
 import { apiFetch } from "../utils/apiClient"
 
-export function useChat(jwt, activeConversationId, messages) {
+export function useChat(jwt, activeConversationId) {
   const dispatch = useDispatch()
   const [isLoading, setIsLoading] = useState(false)
   const [streamingResponse, setStreamingResponse] = useState("")
@@ -40,6 +40,50 @@ export function useChat(jwt, activeConversationId, messages) {
     };
   }, []);
 
+  // follows the ingestion progress stream, reconnecting when the server closes it on its time cap;
+  // resolves false if it ends without a verdict so the caller can poll
+  const waitForIngestion = async (conversationId, signal) => {
+    while (!signal.aborted) {
+      const verdict = await followIngestionStream(conversationId, signal)
+      if (verdict !== "reconnect") return verdict
+    }
+    return false
+  }
+
+  const followIngestionStream = async (conversationId, signal) => {
+    const res = await apiFetch(`/api/documents/progress?conversationId=${conversationId}`, { signal })
+    if (!res.ok || !res.body) return false
+
+    const reader = res.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ""
+
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) return false
+
+      buffer += decoder.decode(value, { stream: true })
+      const lines = buffer.split("\n")
+      buffer = lines.pop()
+
+      for (const line of lines) {
+        if (!line.trim()) continue
+        let data
+        try {
+          data = JSON.parse(line)
+        } catch (e) {
+          console.error("Parse error:", e)
+          continue
+        }
+        if (data.type === "snapshot" || data.type === "done") {
+          if (data.failed > 0) throw new Error("Backend failed to process document.")
+          if (data.ready) return true
+          if (data.type === "done") return data.reconnect ? "reconnect" : false
+        }
+      }
+    }
+  }
+
   const submitChat = async (input, files, callbacks) => {
     if (promptsRemaining !== null && promptsRemaining <= 0) {
       dispatch(addMessage({ type: "bot", content: "Daily prompt limit reached." }));
@@ -74,7 +118,7 @@ export function useChat(jwt, activeConversationId, messages) {
         if (!uploadRes.ok) throw new Error("File upload failed");
         targetConversationId = (await uploadRes.json()).conversationId;
 
-        let isReady = false;
+        let isReady = await waitForIngestion(targetConversationId, signal)
         while (!isReady) {
           await new Promise(r => setTimeout(r, 2000))
           if(signal.aborted) return
@@ -92,7 +136,6 @@ export function useChat(jwt, activeConversationId, messages) {
       const chatFormData = new FormData()
       chatFormData.append("prompt", input)
       chatFormData.append("conversationId", targetConversationId || "null")
-      chatFormData.append("history", JSON.stringify(messages.slice(-10)))
 
       const chatRes = await apiFetch(`/api/prompt/text-file`, { method: "POST", body: chatFormData, signal })
       if (!chatRes.ok) throw new Error("Chat request failed")
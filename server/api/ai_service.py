@@ -1,9 +1,11 @@
 import google.generativeai as genai
-from langchain_google_genai import ChatGoogleGenerativeAI
+from .llm_clients import get_chat_model, RAG_TEMPERATURE, FALLBACK_TEMPERATURE
+from .history import format_history
 import json
 import logging
 from datetime import datetime
 from appwrite.id import ID
+from appwrite.exception import AppwriteException
 from appwrite.permission import Permission
 from appwrite.role import Role
 
@@ -13,10 +15,7 @@ def generate_rag_response(user_question, context_documents, history):
     """Generate RAG response using context documents"""
     context = "\n\n".join([doc.page_content for doc in context_documents])
     
-    history_str_prompt = ""
-    for message in history:
-        role = "User" if message.get('type') == 'user' else "bot"
-        history_str_prompt += f"{role}: {message.get('content')}\n"
+    history_str_prompt = format_history(history)
     
     rag_prompt = f"""
 You are an expert RAG assistant that answers questions based on the provided documents and previous conversation.
@@ -36,15 +35,12 @@ Question:
 Answer:
 """
     
-    model = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0.3)
+    model = get_chat_model(temperature=RAG_TEMPERATURE)
     return model.stream(rag_prompt)
 
 def generate_fallback_response(user_question, history):
     """Generate fallback response using general knowledge"""
-    history_str_prompt = ""
-    for message in history:
-        role = "User" if message.get('type') == 'user' else "bot"
-        history_str_prompt += f"{role}: {message.get('content')}\n"
+    history_str_prompt = format_history(history)
     
     fallback_prompt = f"""
 Previous conversation:
@@ -56,24 +52,28 @@ Question:
 Answer:
 """
     
-    model = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0.7)
+    model = get_chat_model(temperature=FALLBACK_TEMPERATURE)
     return model.stream(fallback_prompt)
 
-def save_message_to_db(databases, db_id, msg_collection_id, conversation_id, sender_type, content):
-    """Save message to Appwrite database"""
-    databases.create_document(
-        db_id, 
-        msg_collection_id, 
-        ID.unique(),
-        {
-            'conversationId': conversation_id,
-            'senderType': sender_type,
-            'content': content,
-            'timestamp': datetime.now().isoformat()
-        },
-        permissions=[
-            Permission.read(Role.user(sender_type)),
-            Permission.update(Role.user(sender_type)),
-            Permission.delete(Role.user(sender_type)),
-        ] if sender_type != 'bot' else None
-    )
\ No newline at end of file
+def save_message_to_db(databases, db_id, msg_collection_id, conversation_id, sender_type, content, message_id=None):
+    """Save message to Appwrite database. With a message_id a retried save is a no-op."""
+    try:
+        databases.create_document(
+            db_id, 
+            msg_collection_id, 
+            message_id or ID.unique(),
+            {
+                'conversationId': conversation_id,
+                'senderType': sender_type,
+                'content': content,
+                'timestamp': datetime.now().isoformat()
+            },
+            permissions=[
+                Permission.read(Role.user(sender_type)),
+                Permission.update(Role.user(sender_type)),
+                Permission.delete(Role.user(sender_type)),
+            ] if sender_type != 'bot' else None
+        )
+    except AppwriteException as exc:
+        if not (message_id and exc.code == 409):
+            raise
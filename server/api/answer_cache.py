@@ -0,0 +1,133 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+
+def scope_key(file_hashes, history=()):
+    """Key for the set of documents an answer was generated from (in any order) and the
+    conversation it followed. A follow-up like "why?" only matches the same history."""
+    digest = hashlib.sha256("\n".join(sorted(set(file_hashes))).encode())
+    for message in history:
+        digest.update(f"\0{message.get('type')}\0{message.get('content')}".encode())
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("user_id", "conversation_id", "scope", "file_hashes", "vector", "events", "expires_at")
+
+    def __init__(self, user_id, conversation_id, file_hashes, history, vector, events, expires_at):
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.file_hashes = frozenset(file_hashes)
+        self.scope = scope_key(file_hashes, history)
+        self.vector = vector
+        self.events = events
+        self.expires_at = expires_at
+
+
+class AnswerCache:
+    """Finished chat answers, matched by query-embedding similarity within one user's document set.
+
+    Entries are scoped to (user, set of ready file hashes, prior conversation): uploading or
+    pruning a document changes the scope, so an answer is never replayed against a different
+    document set even in a process that missed the explicit invalidation, and a follow-up
+    question is never answered from a different conversation's context.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_SIMILARITY, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # entry id -> _Entry, least recently used first
+        self._by_scope = {}  # (user id, scope key) -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._by_scope.get((entry.user_id, entry.scope))
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_scope[(entry.user_id, entry.scope)]
+
+    def lookup(self, user_id, file_hashes, history, vector):
+        """Cached chat events for the closest earlier question at or above the threshold, or None"""
+        now = time.time()
+        best_id, best_score = None, self.threshold
+        with self._lock:
+            for entry_id in list(self._by_scope.get((user_id, scope_key(file_hashes, history)), ())):
+                entry = self._entries[entry_id]
+                if entry.expires_at <= now:
+                    self._drop(entry_id)
+                    continue
+                score = float(np.dot(entry.vector, vector))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                return None
+            self._entries.move_to_end(best_id)
+            return list(self._entries[best_id].events)
+
+    def store(self, user_id, conversation_id, file_hashes, history, vector, events):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            entry = _Entry(
+                user_id, conversation_id, file_hashes, history, vector, list(events), time.time() + self.ttl
+            )
+            self._entries[entry_id] = entry
+            self._by_scope.setdefault((user_id, entry.scope), set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, conversation_id=None, file_hash=None):
+        """Drop answers from a conversation and/or answers that drew on a document"""
+        with self._lock:
+            stale = [
+                entry_id for entry_id, entry in self._entries.items()
+                if (conversation_id is not None and entry.conversation_id == conversation_id)
+                or (file_hash is not None and file_hash in entry.file_hashes)
+            ]
+            for entry_id in stale:
+                self._drop(entry_id)
+        if stale:
+            logger.info(f"Invalidated {len(stale)} cached answers")
+
+
+_cache = AnswerCache()
+
+
+def embed_prompt(user_prompt):
+    """Unit-length query embedding used as the cache key"""
+    from .vector_store import get_embedding_function
+    vector = np.asarray(get_embedding_function().embed_query(user_prompt), dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def lookup_answer(user_id, file_hashes, history, vector):
+    if not ANSWER_CACHE_ENABLED or not file_hashes or vector is None:
+        return None
+    return _cache.lookup(user_id, file_hashes, history, vector)
+
+
+def store_answer(user_id, conversation_id, file_hashes, history, vector, events):
+    if not ANSWER_CACHE_ENABLED or not file_hashes or vector is None:
+        return
+    _cache.store(user_id, conversation_id, file_hashes, history, vector, events)
+
+
+def invalidate_answers(conversation_id=None, file_hash=None):
+    _cache.invalidate(conversation_id=conversation_id, file_hash=file_hash)
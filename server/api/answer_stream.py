@@ -0,0 +1,162 @@
+import os
+import queue
+import logging
+import threading
+
+from .ai_service import generate_rag_response, generate_fallback_response
+
+logger = logging.getLogger(__name__)
+
+REFUSAL = "Answer is not available in the context"
+FALLBACK_PREFIX = "No indexed documents found. Response from Gemini:\n"
+
+# opt-in: catch the refusal from its first tokens and race the fallback when retrieval looks weak
+SPECULATIVE_FALLBACK = os.getenv("SPECULATIVE_FALLBACK", "false").lower() in ("1", "true", "yes")
+# best retrieval similarity below which the fallback is started alongside the RAG answer
+WEAK_RETRIEVAL_SCORE = float(os.getenv("WEAK_RETRIEVAL_SCORE", "0.6"))
+
+_DONE = object()
+
+
+class BackgroundStream:
+    """Consume a model stream on a daemon thread so it can run while another one is being read"""
+
+    def __init__(self, make_stream):
+        self._queue = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(make_stream,), name="speculative-fallback", daemon=True)
+        self._thread.start()
+
+    def _run(self, make_stream):
+        stream = None
+        try:
+            stream = make_stream()
+            for chunk in stream:
+                if self._cancelled.is_set():
+                    break
+                if chunk.content:
+                    self._queue.put(chunk.content)
+        except Exception as exc:
+            self._queue.put(exc)
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            self._queue.put(_DONE)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def _normalized(text):
+    return text.lstrip(" \n\t\"'*`").lower()
+
+
+def _refusal_state(text):
+    """'refusal' once the text opens with the refusal, 'pending' while it still might, else 'answer'"""
+    norm = _normalized(text)
+    target = REFUSAL.lower()
+    if norm.startswith(target):
+        return "refusal"
+    if target.startswith(norm):
+        return "pending"
+    return "answer"
+
+
+def _best_score(context_documents):
+    scores = [doc.metadata.get("score") for doc in context_documents]
+    scores = [s for s in scores if s is not None]
+    return max(scores) if scores else None
+
+
+def _fallback_events(user_prompt, history, speculative=None):
+    yield "fallback_start", FALLBACK_PREFIX
+    chunks = speculative if speculative is not None else (
+        chunk.content for chunk in generate_fallback_response(user_prompt, history)
+    )
+    for content in chunks:
+        if content:
+            yield "fallback_chunk", content
+
+
+def _sequential_events(user_prompt, context_documents, history):
+    rag_buffer = ""
+    if context_documents:
+        for chunk in generate_rag_response(user_prompt, context_documents, history):
+            if chunk.content:
+                rag_buffer += chunk.content
+                yield "rag_chunk", chunk.content
+    else:
+        rag_buffer = REFUSAL
+
+    if REFUSAL in rag_buffer:
+        yield from _fallback_events(user_prompt, history)
+
+
+def _speculative_events(user_prompt, context_documents, history):
+    if not context_documents:
+        yield from _fallback_events(user_prompt, history)
+        return
+
+    speculative = None
+    best = _best_score(context_documents)
+    if best is not None and best < WEAK_RETRIEVAL_SCORE:
+        logger.info(f"Weak retrieval (best score {best:.3f}), starting fallback speculatively")
+        speculative = BackgroundStream(lambda: generate_fallback_response(user_prompt, history))
+
+    try:
+        rag_stream = generate_rag_response(user_prompt, context_documents, history)
+        rag_buffer = ""
+        held = ""
+        state = "pending"
+        try:
+            for chunk in rag_stream:
+                if not chunk.content:
+                    continue
+                rag_buffer += chunk.content
+                if state == "answer":
+                    yield "rag_chunk", chunk.content
+                    continue
+                held += chunk.content
+                state = _refusal_state(held)
+                if state == "refusal":
+                    break
+                if state == "answer":
+                    if speculative is not None:
+                        speculative.cancel()
+                        speculative = None
+                    yield "rag_chunk", held
+        finally:
+            if hasattr(rag_stream, "close"):
+                # stops reading the RAG answer once it turned out to be the refusal
+                rag_stream.close()
+
+        if state == "pending" and held:
+            # the whole answer was a prefix of the refusal, e.g. "Answer"
+            yield "rag_chunk", held
+
+        if state == "refusal" or REFUSAL in rag_buffer:
+            yield from _fallback_events(user_prompt, history, speculative)
+        elif speculative is not None:
+            speculative.cancel()
+
+    except BaseException:
+        # error or client disconnect: don't leave the speculative generation running
+        if speculative is not None:
+            speculative.cancel()
+        raise
+
+def stream_answer(user_prompt, context_documents, history):
+    """(event type, content) pairs for the chat stream: RAG chunks, or the fallback when the
+    documents don't hold the answer"""
+    if SPECULATIVE_FALLBACK:
+        return _speculative_events(user_prompt, context_documents, history)
+    return _sequential_events(user_prompt, context_documents, history)
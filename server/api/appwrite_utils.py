@@ -1,7 +1,11 @@
+from collections import OrderedDict
 from datetime import datetime
-from appwrite.id import ID
+from appwrite.exception import AppwriteException
 from appwrite.query import Query
 import logging
+import os
+import sqlite3
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -32,31 +36,121 @@ def rel_id(value):
     return None
 
 
+class _SharedIdStore:
+    """Tiny SQLite key/value file so worker processes on one host share resolved ids"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS user_docs (auth_id TEXT PRIMARY KEY, doc_id TEXT NOT NULL)")
+        self._conn.commit()
+
+    def get(self, auth_user_id):
+        with self._lock:
+            row = self._conn.execute("SELECT doc_id FROM user_docs WHERE auth_id = ?", (auth_user_id,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, auth_user_id, doc_id):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO user_docs VALUES (?, ?)", (auth_user_id, doc_id))
+            self._conn.commit()
+
+
+USER_DOC_CACHE_MAX = int(os.getenv("USER_DOC_CACHE_MAX_ENTRIES", "4096"))
+USER_DOC_CACHE_PATH = os.getenv("USER_DOC_CACHE_PATH")
+
+_user_doc_ids = OrderedDict()  # auth user id -> Users document id; the mapping never changes
+_user_doc_lock = threading.Lock()
+_creation_locks = [threading.Lock() for _ in range(64)]
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def _get_shared_store():
+    global _shared_store
+    if USER_DOC_CACHE_PATH and _shared_store is None:
+        with _shared_store_lock:
+            if _shared_store is None:
+                _shared_store = _SharedIdStore(USER_DOC_CACHE_PATH)
+    return _shared_store
+
+
+def _remember_user_doc_id(auth_user_id, doc_id, shared=True):
+    with _user_doc_lock:
+        _user_doc_ids[auth_user_id] = doc_id
+        _user_doc_ids.move_to_end(auth_user_id)
+        while len(_user_doc_ids) > USER_DOC_CACHE_MAX:
+            _user_doc_ids.popitem(last=False)
+    store = _get_shared_store() if shared else None
+    if store:
+        try:
+            store.put(auth_user_id, doc_id)
+        except Exception as exc:
+            logger.warning("Could not write shared user id cache: %s", exc)
+
+
+def _cached_user_doc_id(auth_user_id):
+    with _user_doc_lock:
+        doc_id = _user_doc_ids.get(auth_user_id)
+        if doc_id is not None:
+            _user_doc_ids.move_to_end(auth_user_id)
+            return doc_id
+    store = _get_shared_store()
+    if store:
+        try:
+            doc_id = store.get(auth_user_id)
+        except Exception as exc:
+            logger.warning("Could not read shared user id cache: %s", exc)
+            return None
+        if doc_id:
+            _remember_user_doc_id(auth_user_id, doc_id, shared=False)
+        return doc_id
+    return None
+
+
 def get_or_create_user_document_id(databases, db_id, users_collection_id, auth_user_id, email=None):
     """documents/chunks/jobs.userId are relationships to the Users collection. That attribute must be a Users document $id, not the Appwrite Auth user id."""
     if not users_collection_id:
         return auth_user_id
 
-    try:
-        result = databases.list_documents(
-            db_id,
-            users_collection_id,
-            queries=[Query.equal("userId", auth_user_id), Query.limit(1)],
-        )
-        docs = result.get("documents", [])
-        if docs:
-            return docs[0]["$id"]
-
-        payload = {
-            "userId": auth_user_id,
-            "email": (email or "unknown@local")[:30],
-            "status": True,
-            "joined": datetime.now().isoformat(),
-        }
-        created = databases.create_document(
-            db_id, users_collection_id, ID.unique(), payload
-        )
-        return created["$id"]
-    except Exception as exc:
-        logger.error("Failed to resolve Users collection document: %s", exc)
-        return auth_user_id
+    doc_id = _cached_user_doc_id(auth_user_id)
+    if doc_id:
+        return doc_id
+
+    # one resolver per user at a time so concurrent first requests don't create duplicates
+    with _creation_locks[hash(auth_user_id) % len(_creation_locks)]:
+        doc_id = _cached_user_doc_id(auth_user_id)
+        if doc_id:
+            return doc_id
+        try:
+            result = databases.list_documents(
+                db_id,
+                users_collection_id,
+                queries=[Query.equal("userId", auth_user_id), Query.limit(1)],
+            )
+            docs = result.get("documents", [])
+            if docs:
+                doc_id = docs[0]["$id"]
+            else:
+                payload = {
+                    "userId": auth_user_id,
+                    "email": (email or "unknown@local")[:30],
+                    "status": True,
+                    "joined": datetime.now().isoformat(),
+                }
+                # the auth id as document id makes creation race-free across processes too
+                try:
+                    created = databases.create_document(
+                        db_id, users_collection_id, auth_user_id, payload
+                    )
+                    doc_id = created["$id"]
+                except AppwriteException as exc:
+                    if exc.code != 409:
+                        raise
+                    doc_id = databases.get_document(db_id, users_collection_id, auth_user_id)["$id"]
+            _remember_user_doc_id(auth_user_id, doc_id)
+            return doc_id
+        except Exception as exc:
+            logger.error("Failed to resolve Users collection document: %s", exc)
+            return auth_user_id
@@ -2,7 +2,24 @@ from functools import wraps
 from flask import request, jsonify
 from appwrite.client import Client
 from appwrite.services.account import Account
+from collections import OrderedDict
+import base64
+import hashlib
+import hmac
+import json
 import os
+import threading
+import time
+
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+AUTH_CACHE_MAX = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "2048"))
+# Only self-hosted Appwrite exposes the key JWTs are signed with; without it every new token is checked remotely
+APPWRITE_JWT_SECRET = os.getenv("APPWRITE_JWT_SECRET")
+
+_token_cache = OrderedDict()  # sha256(token) -> (expires_at, user)
+_profile_cache = OrderedDict()  # user id -> (expires_at, user), reused across a user's rotating JWTs
+_cache_lock = threading.Lock()
+
 
 def get_user_client(jwt_token):
     """Create a user-specific Appwrite client"""
@@ -12,6 +29,78 @@ def get_user_client(jwt_token):
     user_client.set_jwt(jwt_token)
     return user_client
 
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _jwt_claims(jwt_token):
+    """Unverified payload of a JWT, or None if it isn't one"""
+    try:
+        return json.loads(_b64decode(jwt_token.split(".")[1]))
+    except Exception:
+        return None
+
+
+def _signature_valid(jwt_token):
+    header, payload, signature = jwt_token.split(".")
+    if json.loads(_b64decode(header)).get("alg") != "HS256":
+        return False
+    expected = hmac.new(APPWRITE_JWT_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    return hmac.compare_digest(expected, _b64decode(signature))
+
+
+def _cache_get(cache, key, now):
+    with _cache_lock:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return dict(entry[1])
+
+
+def _cache_put(cache, key, user, expires_at):
+    with _cache_lock:
+        cache[key] = (expires_at, dict(user))
+        cache.move_to_end(key)
+        while len(cache) > AUTH_CACHE_MAX:
+            cache.popitem(last=False)
+
+
+def verify_token(jwt_token):
+    """Return the Appwrite account for a JWT, from cache when this token was verified recently"""
+    now = time.time()
+    claims = _jwt_claims(jwt_token)
+    token_exp = claims.get("exp") if claims else None
+    if token_exp is not None and token_exp <= now:
+        raise ValueError("Token expired")
+
+    digest = hashlib.sha256(jwt_token.encode()).hexdigest()
+    user = _cache_get(_token_cache, digest, now)
+    if user is not None:
+        return user
+
+    expires_at = now + AUTH_CACHE_TTL
+    if token_exp is not None:
+        expires_at = min(expires_at, token_exp)
+
+    if APPWRITE_JWT_SECRET and claims:
+        if not _signature_valid(jwt_token):
+            raise ValueError("Invalid token signature")
+        user = _cache_get(_profile_cache, claims.get("userId"), now)
+        if user is not None:
+            _cache_put(_token_cache, digest, user, expires_at)
+            return user
+
+    user = Account(get_user_client(jwt_token)).get()
+    _cache_put(_token_cache, digest, user, expires_at)
+    _cache_put(_profile_cache, user["$id"], user, now + AUTH_CACHE_TTL)
+    return user
+
+
 def auth_required(f):
     """Authentication decorator"""
     @wraps(f)
@@ -19,15 +108,12 @@ def auth_required(f):
         auth_header = request.headers.get('Authorization')
         if not auth_header:
             return jsonify({'error': 'Missing token'}), 401
-        
+
         try:
             jwt_token = auth_header.split(' ')[1]
-            user_client = get_user_client(jwt_token)
-            user_account = Account(user_client)
-            user = user_account.get()
-            kwargs['user'] = user
+            kwargs['user'] = verify_token(jwt_token)
         except Exception as e:
             return jsonify({'error': 'Invalid or expired token', 'details': str(e)}), 401
-            
+
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
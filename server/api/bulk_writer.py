@@ -0,0 +1,251 @@
+import os
+import time
+import logging
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import appwrite.client as appwrite_client
+from appwrite.client import Client
+from appwrite.services.databases import Databases
+from appwrite.id import ID
+from appwrite.query import Query
+from appwrite.exception import AppwriteException
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_WRITE_BATCH_SIZE", "100"))
+BULK_MAX_WORKERS = int(os.getenv("BULK_WRITE_MAX_WORKERS", "8"))
+BULK_RETRIES = int(os.getenv("BULK_WRITE_RETRIES", "2"))
+
+_writer = None
+_lock = threading.Lock()
+_transport_lock = threading.Lock()  # separate from _lock, which get_bulk_writer holds while building the writer
+_transport = threading.local()  # .session: the pooled session of the client making the current call
+
+
+class BulkWriteResult:
+    """Outcome of a bulk write; failed holds (record, error) pairs"""
+
+    def __init__(self):
+        self.created = []
+        self.failed = []
+
+    @property
+    def ok(self):
+        return not self.failed
+
+
+class _SessionTransport:
+    """Stands in for the requests module inside the Appwrite SDK, which opens a new connection
+    per call; calls made by a _PooledClient go through that client's session instead"""
+
+    def request(self, *args, **kwargs):
+        session = getattr(_transport, "session", None)
+        if session is None:
+            return requests.request(*args, **kwargs)
+        return session.request(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+class _PooledClient(Client):
+    """Copy of an Appwrite client that keeps up to pool_size keep-alive connections"""
+
+    def __init__(self, base, pool_size):
+        super().__init__()
+        self._endpoint = base._endpoint
+        self._self_signed = base._self_signed
+        self._global_headers = dict(base._global_headers)
+        self._session = requests.Session()
+        # API-key calls are stateless; don't let a response cookie ride along on later calls
+        self._session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def call(self, *args, **kwargs):
+        previous = getattr(_transport, "session", None)
+        _transport.session = self._session
+        try:
+            return super().call(*args, **kwargs)
+        finally:
+            _transport.session = previous
+
+
+def _pooled_databases(databases, pool_size):
+    """Databases service over a pooled copy of the given one's client; other objects are used as is"""
+    client = getattr(databases, "client", None)
+    if not isinstance(client, Client):
+        return databases
+    with _transport_lock:
+        if not isinstance(appwrite_client.requests, _SessionTransport):
+            appwrite_client.requests = _SessionTransport()
+    return Databases(_PooledClient(client, pool_size))
+
+
+def _relationships_unsupported(exc):
+    """Appwrite refuses bulk operations on collections that have relationship attributes"""
+    return exc.code == 400 and "relationship" in str(exc.message or "").lower()
+
+
+class BulkDocumentWriter:
+    """Writes (and deletes) many documents in one collection through the Appwrite SDK.
+
+    Records are grouped into batches and the batches are sent concurrently over a pool of
+    max_workers keep-alive connections. Appwrite's bulk create is tried first; collections it
+    rejects for their relationship attributes fall back to concurrent single creates, as does
+    any batch whose bulk call fails. Every record gets its $id up front, so a retry that hits
+    409 means the earlier attempt already landed.
+    """
+
+    def __init__(self, databases, max_workers=BULK_MAX_WORKERS, batch_size=BULK_BATCH_SIZE,
+                 retries=BULK_RETRIES):
+        self.max_workers = max(1, max_workers)
+        self.databases = _pooled_databases(databases, self.max_workers)
+        self.batch_size = max(1, batch_size)
+        self.retries = retries
+        self._bulk_unsupported = set()
+
+    def _mark_unsupported(self, collection_id, exc):
+        if _relationships_unsupported(exc):
+            logger.info(f"Bulk operations unavailable for collection {collection_id}, using single calls: {exc}")
+            self._bulk_unsupported.add(collection_id)
+
+    def _create_one(self, db_id, collection_id, doc_id, record):
+        try:
+            return self.databases.create_document(db_id, collection_id, doc_id, record)
+        except AppwriteException as exc:
+            if exc.code == 409:
+                # an earlier attempt already created it
+                return {"$id": doc_id}
+            raise
+
+    def _create_many(self, db_id, collection_id, batch):
+        """Try the bulk endpoint for one batch; returns False if the batch must go one by one"""
+        if collection_id in self._bulk_unsupported:
+            return False
+        try:
+            self.databases.create_documents(
+                db_id, collection_id, [{"$id": doc_id, **record} for doc_id, record in batch]
+            )
+            return True
+        except AppwriteException as exc:
+            self._mark_unsupported(collection_id, exc)
+            if collection_id not in self._bulk_unsupported:
+                logger.warning(f"Bulk create of {len(batch)} documents failed: {exc}")
+            return False
+
+    def create_documents(self, db_id, collection_id, records):
+        """Create all records, returning a BulkWriteResult. Never raises for individual failures."""
+        result = BulkWriteResult()
+        pending = [(ID.unique(), rec) for rec in records]
+        if not pending:
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bulk-writer") as pool:
+            for attempt in range(self.retries + 1):
+                batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+                bulk_results = list(pool.map(lambda b: self._try_bulk(db_id, collection_id, b), batches))
+
+                # batches the bulk endpoint didn't take (unsupported or failed) go one by one
+                singles = []
+                for batch, done in zip(batches, bulk_results):
+                    if done:
+                        result.created.extend(doc_id for doc_id, _ in batch)
+                    else:
+                        singles.extend(batch)
+
+                outcomes = list(pool.map(lambda item: self._try_one(db_id, collection_id, item), singles))
+                pending = []
+                for item, error in zip(singles, outcomes):
+                    if error is None:
+                        result.created.append(item[0])
+                    else:
+                        pending.append((item, error))
+
+                if not pending:
+                    return result
+                if attempt < self.retries:
+                    logger.warning(f"{len(pending)} document writes failed in {collection_id}, retrying")
+                    time.sleep(0.5 * (2 ** attempt))
+                    pending = [item for item, _ in pending]
+
+        result.failed = [(item[1], str(error)) for item, error in pending]
+        return result
+
+    def _try_bulk(self, db_id, collection_id, batch):
+        try:
+            return self._create_many(db_id, collection_id, batch)
+        except Exception as exc:
+            logger.warning(f"Bulk create of {len(batch)} documents failed: {exc}")
+            return False
+
+    def _try_one(self, db_id, collection_id, item):
+        doc_id, record = item
+        try:
+            self._create_one(db_id, collection_id, doc_id, record)
+            return None
+        except Exception as exc:
+            return exc
+
+    def _delete_one(self, db_id, collection_id, doc_id):
+        try:
+            self.databases.delete_document(db_id, collection_id, doc_id)
+        except AppwriteException as exc:
+            if exc.code != 404:
+                raise
+
+    def _delete_page_bulk(self, db_id, collection_id, queries):
+        """One bulk delete of up to batch_size matches; None if this page must go one by one"""
+        if collection_id in self._bulk_unsupported:
+            return None
+        try:
+            res = self.databases.delete_documents(db_id, collection_id, [*queries, Query.limit(self.batch_size)])
+        except AppwriteException as exc:
+            self._mark_unsupported(collection_id, exc)
+            if collection_id not in self._bulk_unsupported:
+                logger.warning(f"Bulk delete in {collection_id} failed, deleting one by one: {exc}")
+            return None
+        res = res if isinstance(res, dict) else {}
+        return res.get("total", len(res.get("documents", [])))
+
+    def _delete_page_single(self, db_id, collection_id, queries, pool):
+        res = self.databases.list_documents(
+            db_id, collection_id, [*queries, Query.select(["$id"]), Query.limit(self.batch_size)]
+        )
+        ids = [doc["$id"] for doc in res.get("documents", [])]
+        for _ in pool.map(lambda doc_id: self._delete_one(db_id, collection_id, doc_id), ids):
+            pass
+        return len(ids)
+
+    def delete_documents(self, db_id, collection_id, queries, on_progress=None):
+        """Delete every document matching `queries`, a batch at a time, and return how many went.
+
+        Uses Appwrite's bulk delete where the collection allows it, otherwise lists a page of ids
+        and deletes them concurrently. Safe to re-run after an interruption.
+        """
+        deleted = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bulk-deleter") as pool:
+            while True:
+                count = self._delete_page_bulk(db_id, collection_id, queries)
+                if count is None:
+                    count = self._delete_page_single(db_id, collection_id, queries, pool)
+                if not count:
+                    return deleted
+                deleted += count
+                if on_progress:
+                    on_progress(deleted)
+
+
+def get_bulk_writer():
+    global _writer
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                from app import databases
+                _writer = BulkDocumentWriter(databases)
+                logging.info("Bulk document writer initialized")
+    return _writer
@@ -0,0 +1,196 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from appwrite.id import ID
+from appwrite.query import Query
+from appwrite.exception import AppwriteException
+
+from .ai_service import save_message_to_db
+from .answer_cache import ANSWER_CACHE_ENABLED, embed_prompt
+from .message_cache import get_history, record_message
+from .appwrite_utils import get_or_create_user_document_id, rel_id, DOC_COMPLETED
+from .user_service import get_user_prompt_limit, create_conversation, update_conversation_timestamp
+from .write_queue import enqueue_write
+
+logger = logging.getLogger(__name__)
+
+PRELUDE_WORKERS = int(os.getenv("CHAT_PRELUDE_WORKERS", "16"))
+READY_CACHE_MAX_CONVERSATIONS = 5000
+
+_pool = None
+_pool_lock = threading.Lock()
+# conversation id -> whether its last ready-documents check found any; only decides whether
+# retrieval is started speculatively, the check itself still runs on every message
+_has_ready = OrderedDict()
+_has_ready_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=PRELUDE_WORKERS, thread_name_prefix="chat-prelude")
+    return _pool
+
+
+class ChatPrelude:
+    """Everything the chat stream needs before its first token"""
+
+    def __init__(self, conversation_id, prompts_remaining, max_prompts, users_doc_id=None, context_documents=None,
+                 file_hashes=None, query_vector=None, history=None, error_status=None):
+        self.conversation_id = conversation_id
+        self.prompts_remaining = prompts_remaining
+        self.max_prompts = max_prompts
+        self.users_doc_id = users_doc_id
+        self.context_documents = context_documents or []
+        self.file_hashes = file_hashes or []
+        self.query_vector = query_vector
+        self.history = history or []
+        # set when the conversation can't be used: 403 (someone else's) or 404 (missing or being deleted)
+        self.error_status = error_status
+
+    @property
+    def limit_reached(self):
+        return self.prompts_remaining <= 0
+
+
+def _ready_file_hashes(user, conversation_id):
+    """File hashes of the conversation's indexed documents; empty when none is ready"""
+    from app import databases, db_id, docs_collection_id, users_collection_id
+
+    users_doc_id = get_or_create_user_document_id(
+        databases, db_id, users_collection_id, user["$id"], user.get("email")
+    )
+    docs_ready = databases.list_documents(
+        db_id,
+        docs_collection_id,
+        queries=[
+            Query.equal("userId", users_doc_id),
+            Query.equal("conversationId", conversation_id),
+            Query.equal("status", DOC_COMPLETED),
+            Query.select(["fileHash"]),
+            Query.limit(100),
+        ],
+    )
+    return [doc["fileHash"] for doc in docs_ready.get("documents", [])]
+
+
+def _remember_ready(conversation_id, ready):
+    with _has_ready_lock:
+        _has_ready[conversation_id] = ready
+        _has_ready.move_to_end(conversation_id)
+        while len(_has_ready) > READY_CACHE_MAX_CONVERSATIONS:
+            _has_ready.popitem(last=False)
+
+
+def _conversation_access(user_id, conversation_id):
+    """None if the user may chat in the conversation, else the HTTP status to refuse with"""
+    from app import databases, db_id, conv_collection_id
+
+    try:
+        conv = databases.get_document(db_id, conv_collection_id, conversation_id)
+    except AppwriteException as e:
+        if e.code == 404:
+            return 404
+        raise
+    if rel_id(conv.get("userId")) != user_id:
+        return 403
+    if conv.get("deletedAt"):
+        return 404
+    return None
+
+
+def _history_safely(conversation_id, exclude_id):
+    try:
+        return get_history(conversation_id, exclude_id)
+    except Exception as e:
+        logger.error(f"Loading conversation history failed: {e}")
+        return []
+
+
+def _embed_prompt_safely(user_prompt):
+    try:
+        return embed_prompt(user_prompt)
+    except Exception as e:
+        logger.error(f"Prompt embedding for the answer cache failed: {e}")
+        return None
+
+
+def run_chat_prelude(user, user_prompt, conversation_id, retrieve):
+    """Run the chat route's remote calls concurrently.
+
+    The ownership check, the Users lookup, the ready-documents check, retrieval and the
+    answer-cache embedding do not depend on each other, so they start together. Retrieval and
+    the embedding are speculative: they are skipped for conversations whose last check found
+    no ready document, and started late if this check finds one. The prompt-limit update and
+    the history load wait for the ownership check, so a refused request neither uses up a
+    prompt nor sees the history, and nothing is written for it. The conversation timestamp
+    and the user message are queued as background writes. Only creating a new conversation
+    stays inline, since the stream has to report its id.
+    """
+    from app import databases, db_id, msg_collection_id, conv_collection_id, user_limits_collection_id, users_collection_id
+
+    user_id = user["$id"]
+    user_message_id = ID.unique()
+    pool = _get_pool()
+    existing = bool(conversation_id) and conversation_id != "null"
+
+    access_f = pool.submit(_conversation_access, user_id, conversation_id) if existing else None
+    users_f = pool.submit(
+        get_or_create_user_document_id, databases, db_id, users_collection_id, user_id, user.get("email")
+    )
+    ready_f = retrieval_f = embed_f = history_f = None
+    if existing:
+        ready_f = pool.submit(_ready_file_hashes, user, conversation_id)
+        with _has_ready_lock:
+            speculate = _has_ready.get(conversation_id, True)
+        if speculate:
+            retrieval_f = pool.submit(retrieve, user_prompt, user_id, conversation_id)
+            if ANSWER_CACHE_ENABLED:
+                embed_f = pool.submit(_embed_prompt_safely, user_prompt)
+        refusal = access_f.result()
+        if refusal is not None:
+            return ChatPrelude(conversation_id, None, None, error_status=refusal)
+        history_f = pool.submit(_history_safely, conversation_id, user_message_id)
+
+    prompts_remaining, max_prompts = get_user_prompt_limit(databases, db_id, user_limits_collection_id, user_id)
+    users_doc_id = users_f.result()
+    history = history_f.result() if history_f is not None else []
+    if prompts_remaining <= 0:
+        return ChatPrelude(conversation_id, prompts_remaining, max_prompts, users_doc_id)
+
+    if existing:
+        enqueue_write(conversation_id, update_conversation_timestamp, databases, db_id, conv_collection_id, conversation_id)
+    else:
+        conversation_id = create_conversation(databases, db_id, conv_collection_id, user_id, user_prompt)
+    enqueue_write(
+        conversation_id, save_message_to_db, databases, db_id, msg_collection_id, conversation_id, "user", user_prompt,
+        message_id=user_message_id,
+    )
+    record_message(conversation_id, user_message_id, "user", user_prompt)
+
+    context_documents = []
+    file_hashes = []
+    query_vector = None
+    if existing:
+        try:
+            file_hashes = ready_f.result()
+            _remember_ready(conversation_id, bool(file_hashes))
+        except Exception as e:
+            logger.error(f"Ready-documents check failed: {e}")
+        if file_hashes:
+            if retrieval_f is None:
+                retrieval_f = pool.submit(retrieve, user_prompt, user_id, conversation_id)
+                if ANSWER_CACHE_ENABLED:
+                    embed_f = pool.submit(_embed_prompt_safely, user_prompt)
+            context_documents = retrieval_f.result()
+            if embed_f is not None:
+                query_vector = embed_f.result()
+
+    return ChatPrelude(
+        conversation_id, prompts_remaining, max_prompts, users_doc_id, context_documents, file_hashes, query_vector,
+        history,
+    )
@@ -0,0 +1,186 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from appwrite.query import Query
+from appwrite.exception import AppwriteException
+
+from .bulk_writer import get_bulk_writer
+from .storage import delete_upload
+from .retention import forget_documents
+from .appwrite_utils import rel_id
+from .job_leases import LeaseLost, try_claim, release_lease
+
+logger = logging.getLogger(__name__)
+
+DELETION_WORKERS = int(os.getenv("CONVERSATION_DELETE_WORKERS", "2"))
+# finished entries are kept this long for progress polling
+PROGRESS_RETENTION_SECONDS = 3600
+PAGE_SIZE = 100
+
+_pool = None
+_pool_lock = threading.Lock()
+_progress = {}  # conversation id -> progress dict, for this process's deletions
+_progress_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=DELETION_WORKERS, thread_name_prefix="conv-delete")
+    return _pool
+
+
+def _update(conversation_id, **fields):
+    with _progress_lock:
+        _progress.setdefault(conversation_id, {}).update(fields, updatedAt=time.time())
+
+
+def mark_deleted(conversation_id):
+    """Flag the conversation so lists hide it and a restarted server finishes the job"""
+    from app import databases, db_id, conv_collection_id
+    databases.update_document(db_id, conv_collection_id, conversation_id, {"deletedAt": datetime.now().isoformat()})
+
+
+def schedule_deletion(conversation_id):
+    """Queue the background wipe unless this process is already running it"""
+    with _progress_lock:
+        current = _progress.get(conversation_id)
+        if current and current.get("status") in ("queued", "deleting"):
+            return
+        cutoff = time.time() - PROGRESS_RETENTION_SECONDS
+        for stale in [cid for cid, p in _progress.items() if p.get("updatedAt", 0) < cutoff]:
+            del _progress[stale]
+        _progress[conversation_id] = {"status": "queued", "deleted": {}, "updatedAt": time.time()}
+    _get_pool().submit(_delete_conversation, conversation_id)
+
+
+def _list_all(collection_id, queries):
+    """Every matching document, a page at a time"""
+    from app import databases, db_id
+    docs = []
+    while True:
+        page_queries = [*queries, Query.limit(PAGE_SIZE)]
+        if docs:
+            page_queries.append(Query.cursor_after(docs[-1]["$id"]))
+        page = databases.list_documents(db_id, collection_id, queries=page_queries).get("documents", [])
+        docs.extend(page)
+        if len(page) < PAGE_SIZE:
+            return docs
+
+
+def _delete_conversation(conversation_id):
+    # the lease (same mechanism as ingestion jobs) keeps other processes from running the same wipe
+    try:
+        lease = try_claim(f"del-{conversation_id}")
+    except Exception as exc:
+        logger.error(f"Could not claim deletion of conversation {conversation_id}: {exc}")
+        _update(conversation_id, status="failed", error=str(exc))
+        return
+    if lease is None:
+        logger.info(f"Conversation {conversation_id} is being wiped by another process")
+        _update(conversation_id, status="deleting", stage="elsewhere")
+        return
+    lease.start_heartbeat()
+    try:
+        _wipe_conversation(conversation_id, lease)
+    finally:
+        lease.stop_heartbeat()
+        release_lease(lease)
+
+
+def _wipe_conversation(conversation_id, lease):
+    from app import (
+        databases, db_id, conv_collection_id, msg_collection_id, docs_collection_id,
+        chunks_collection_id, jobs_collection_id,
+    )
+    from .vector_store import get_vector_store
+    from .lexical_index import get_lexical_index
+
+    _update(conversation_id, status="deleting", stage="vectors")
+    try:
+        # vectors are partitioned by owner and conversation; naming both touches a single partition
+        vector_filter = {"conversation_id": conversation_id}
+        try:
+            conv = databases.get_document(db_id, conv_collection_id, conversation_id)
+            vector_filter["user_id"] = rel_id(conv.get("userId"))
+        except AppwriteException as exc:
+            if exc.code != 404:
+                raise
+        try:
+            get_vector_store().delete(filter=vector_filter)
+        except Exception as e:
+            logger.warning(f"Failed to delete vectors for {conversation_id}: {e}")
+        get_lexical_index().drop_conversation(conversation_id)
+
+        writer = get_bulk_writer()
+        by_conversation = [Query.equal("conversationId", conversation_id)]
+        deleted = {}
+
+        def progress(name):
+            def report(count):
+                deleted[name] = count
+                _update(conversation_id, deleted=dict(deleted))
+            return report
+
+        # uploads of documents that never finished ingestion are only reachable through their records
+        _update(conversation_id, stage="uploads")
+        docs = _list_all(docs_collection_id, [*by_conversation, Query.select(["$id"])])
+        for doc in docs:
+            delete_upload(doc["$id"])
+        forget_documents([doc["$id"] for doc in docs])
+
+        for name, collection_id in (
+            ("chunks", chunks_collection_id),
+            ("jobs", jobs_collection_id),
+            ("documents", docs_collection_id),
+            ("messages", msg_collection_id),
+        ):
+            lease.check()
+            _update(conversation_id, stage=name)
+            writer.delete_documents(db_id, collection_id, by_conversation, on_progress=progress(name))
+
+        try:
+            databases.delete_document(db_id, conv_collection_id, conversation_id)
+        except AppwriteException as exc:
+            if exc.code != 404:
+                raise
+        _update(conversation_id, status="deleted", stage=None)
+        logger.info(f"Conversation {conversation_id} wiped ({deleted})")
+    except LeaseLost as lost:
+        logger.warning(f"Stopped wiping conversation {conversation_id}: {lost}")
+        _update(conversation_id, status="deleting", stage="elsewhere")
+    except Exception as exc:
+        # the deletedAt flag stays, so the next resume_pending_deletions retries
+        logger.error(f"Deleting conversation {conversation_id} failed: {exc}")
+        _update(conversation_id, status="failed", error=str(exc))
+
+
+def resume_pending_deletions():
+    """Re-queue conversations flagged for deletion whose wipe didn't finish (e.g. a crash)"""
+    def run():
+        from app import conv_collection_id
+        try:
+            # listed in full before scheduling, since finished wipes remove conversations a later page would start after
+            pending = _list_all(conv_collection_id, [Query.is_not_null("deletedAt"), Query.select(["$id"])])
+        except Exception as exc:
+            logger.warning(f"Could not look for unfinished conversation deletions: {exc}")
+            return
+        # every process does this at startup; the per-conversation lease lets only one of them run each wipe
+        for conv in pending:
+            schedule_deletion(conv["$id"])
+        if pending:
+            logger.info(f"Resuming {len(pending)} conversation deletions")
+
+    threading.Thread(target=run, name="conv-delete-resume", daemon=True).start()
+
+
+def get_deletion_progress(conversation_id):
+    """This process's progress for the conversation, or None if it isn't deleting it"""
+    with _progress_lock:
+        current = _progress.get(conversation_id)
+        return dict(current) if current else None
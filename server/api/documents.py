@@ -1,35 +1,157 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import os
-import tempfile
 import subprocess
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.schema.document import Document
-import re
 import logging
 import hashlib
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, CancelledError, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-def _run_ocrmypdf(input_path, output_path, language="eng"):
-    """Run OCR on a PDF file"""
+EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_FILE_TIMEOUT = int(os.getenv("EXTRACT_FILE_TIMEOUT", "120"))
+EXTRACT_PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "25"))
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 80
+OCR_PAGE_MIN_CHARS = int(os.getenv("OCR_PAGE_MIN_CHARS", "100"))
+# per ocrmypdf run; up to EXTRACT_MAX_WORKERS runs overlap, so by default they split the CPUs
+OCR_JOBS = int(os.getenv("OCR_JOBS", str(max(1, (os.cpu_count() or 1) // max(1, EXTRACT_MAX_WORKERS)))))
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+
+def _get_extract_pool():
+    global _extract_pool
+    if _extract_pool is None:
+        with _extract_pool_lock:
+            if _extract_pool is None:
+                _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_MAX_WORKERS)
+                logger.info(f"PDF extraction pool started with {EXTRACT_MAX_WORKERS} workers")
+    return _extract_pool
+
+
+def _reset_extract_pool(pool, terminate=False):
+    """Drop a broken pool so new work doesn't queue behind it. With terminate, kill its worker
+    processes too: a running task can't be cancelled, and a hung one would otherwise live on."""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is pool:
+            _extract_pool = None
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    if terminate:
+        for process in processes:
+            process.terminate()
+
+
+def _extract_page_range(file_path, start, end):
+    """Runs in a worker process. Returns [(page_number, text)] the same way PyPDFLoader reads pages"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    return [(i, reader.pages[i].extract_text()) for i in range(start, min(end, len(reader.pages)))]
+
+
+def _page_ranges(file_path):
+    from pypdf import PdfReader
+
+    page_count = len(PdfReader(file_path).pages)
+    step = max(1, EXTRACT_PAGES_PER_TASK)
+    return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+
+def _extract_pdfs_parallel(file_paths, retry_broken=True):
+    """Extract native text for every file in the process pool.
+
+    Large files are split into page ranges so their pages are parsed by several workers.
+    Each file gets EXTRACT_FILE_TIMEOUT seconds from submission; a file that overruns has
+    the pool's processes killed, and files that lost their workers with it are retried once
+    on a fresh pool. Returns one entry per input path, in input order: a page-ordered list
+    of Documents, or the exception that stopped extraction for that file.
+    """
+    pool = _get_extract_pool()
+    tasks = {}
+    results = {}
+    for file_path in file_paths:
+        try:
+            deadline = time.monotonic() + EXTRACT_FILE_TIMEOUT
+            tasks[file_path] = (deadline, [
+                pool.submit(_extract_page_range, file_path, start, end)
+                for start, end in _page_ranges(file_path)
+            ])
+        except Exception as e:
+            results[file_path] = e
+
+    broken = killed = False
+    lost = []  # files whose workers died under them, through no fault of their own
+    for file_path, (deadline, futures) in tasks.items():
+        pages = []
+        try:
+            for future in futures:
+                pages.extend(future.result(timeout=0 if killed else max(0, deadline - time.monotonic())))
+        except (FuturesTimeout, CancelledError, BrokenProcessPool) as e:
+            if killed:
+                lost.append(file_path)
+            elif isinstance(e, FuturesTimeout):
+                logger.error(f"Text extraction timed out after {EXTRACT_FILE_TIMEOUT}s for {file_path}")
+                results[file_path] = TimeoutError(f"extraction timed out for {file_path}")
+                _reset_extract_pool(pool, terminate=True)
+                killed = True
+            else:
+                results[file_path] = e
+                broken = True
+                lost.append(file_path)
+            continue
+        except Exception as e:
+            results[file_path] = e
+            continue
+        results[file_path] = [
+            Document(page_content=text, metadata={"source": file_path, "page": page})
+            for page, text in sorted(pages, key=lambda item: item[0])
+        ]
+
+    if broken and not killed:
+        _reset_extract_pool(pool)
+    if lost and retry_broken:
+        for file_path, result in zip(lost, _extract_pdfs_parallel(lost, retry_broken=False)):
+            results[file_path] = result
+    for file_path in lost:
+        results.setdefault(file_path, BrokenProcessPool(f"extraction workers lost for {file_path}"))
+    return [results[file_path] for file_path in file_paths]
+
+
+def _run_ocrmypdf(input_path, output_path, language="eng", timeout=None, pages=None):
+    """Run OCR on a PDF file. pages is a list of 0-based page numbers; None means every page"""
     command = [
         "ocrmypdf",
         "-l", language,
         "--output-type", "pdf",
         "--force-ocr",
-        input_path, output_path
+        "--jobs", str(OCR_JOBS),
     ]
+    if pages is not None:
+        # ocrmypdf numbers pages from 1 and passes the others through untouched
+        command += ["--pages", ",".join(str(p + 1) for p in pages)]
+    command += [input_path, output_path]
     
     logger.info(f"Attempting OCR with ocrmypdf for '{os.path.basename(input_path)}'...")
     try:
-        subprocess.run(command, check=True, capture_output=True, text=True)
+        subprocess.run(command, check=True, capture_output=True, text=True, timeout=timeout)
         logger.info(f"OCR successful for '{os.path.basename(input_path)}'")
         return True, None
     except subprocess.CalledProcessError as e:
         error_msg = f"ocrmypdf failed for '{os.path.basename(input_path)}' with exit code {e.returncode}.\nSTDOUT: {e.stdout}\nSTDERR: {e.stderr}"
         logger.error(error_msg)
         return False, error_msg
+    except subprocess.TimeoutExpired:
+        error_msg = f"ocrmypdf timed out after {timeout}s for '{os.path.basename(input_path)}'"
+        logger.error(error_msg)
+        return False, error_msg
     except FileNotFoundError:
         error_msg = "Error: 'ocrmypdf' command not found"
         logger.error(error_msg)
@@ -39,95 +161,84 @@ def _run_ocrmypdf(input_path, output_path, language="eng"):
         logger.error(error_msg)
         return False, error_msg
 
-def load_documents(file_array):
-    """Load documents from uploaded files"""
+
+def _extract_pages(file_path, page_numbers):
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    return {i: reader.pages[i].extract_text() for i in page_numbers if i < len(reader.pages)}
+
+
+def _ocr_low_text_pages(file_path, pypdf_docs, tempdir):
+    """OCR only the pages whose text layer is too thin and merge them back by page number.
+
+    pypdf_docs is the page list from native extraction, or the exception that stopped it,
+    in which case the whole file is OCR'd.
+    """
+    if isinstance(pypdf_docs, Exception):
+        logger.error(f"Native text extraction failed for {file_path}: {pypdf_docs}")
+        pypdf_docs = []
+        low_pages = None
+    else:
+        low_pages = [doc.metadata["page"] for doc in pypdf_docs if len(doc.page_content.strip()) < OCR_PAGE_MIN_CHARS]
+        if not low_pages:
+            logger.info(f"Using native PDF content for {file_path}")
+            return pypdf_docs
+        logger.info(f"{len(low_pages)}/{len(pypdf_docs)} pages of {file_path} have little or no text, running OCR on them")
+
+    ocr_output_path = os.path.join(tempdir, f"ocr_output_{os.path.basename(file_path)}")
+    ocr_successful, ocr_error_message = _run_ocrmypdf(
+        file_path, ocr_output_path, language="eng", timeout=EXTRACT_FILE_TIMEOUT, pages=low_pages
+    )
+    if not ocr_successful:
+        logger.error(f"OCR with ocrmypdf failed for {file_path}: {ocr_error_message}")
+        return pypdf_docs
+
+    try:
+        if low_pages is None:
+            from pypdf import PdfReader
+            low_pages = list(range(len(PdfReader(ocr_output_path).pages)))
+        ocr_text = _extract_pages(ocr_output_path, low_pages)
+    except Exception as ocr_load_e:
+        logger.error(f"Error loading OCR'd PDF '{ocr_output_path}': {ocr_load_e}")
+        return pypdf_docs
+
+    native_text = {doc.metadata["page"]: doc.page_content for doc in pypdf_docs}
+    replaced = 0
+    for page, text in ocr_text.items():
+        if len(text) > len(native_text.get(page, "")) * 1.1:
+            native_text[page] = text
+            replaced += 1
+    logger.info(f"OCR improved {replaced}/{len(ocr_text)} pages for {file_path}")
+
+    return [
+        Document(page_content=text, metadata={"source": file_path, "page": page})
+        for page, text in sorted(native_text.items())
+    ]
+
+
+def load_pdf_paths(file_paths, tempdir):
+    """Extract documents from PDFs already on disk; output order follows file_paths then page"""
+    native_results = _extract_pdfs_parallel(file_paths)
+
+    # OCR is a subprocess per file, so threads are enough to overlap it
+    with ThreadPoolExecutor(max_workers=max(1, EXTRACT_MAX_WORKERS), thread_name_prefix="ocr") as pool:
+        per_file = list(pool.map(
+            lambda item: _ocr_low_text_pages(item[0], item[1], tempdir),
+            zip(file_paths, native_results),
+        ))
+
     all_documents = []
-    
-    with tempfile.TemporaryDirectory() as tempdir:
-        saved_file_paths = []
-        
-        #save uploaded files
-        for i, file in enumerate(file_array):
-            if not hasattr(file, 'filename'):
-                raise ValueError("Invalid file object received")
-                
-            file_path = os.path.join(tempdir, f"uploaded_file_{i}_{file.filename}")
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            try:
-                file.save(file_path)
-                saved_file_paths.append(file_path)
-            except AttributeError:
-                logger.error("Invalid object file type recieved")
-        
-        for file_path in saved_file_paths:
-            documents_for_this_pdf = []
-            is_scanned = False
-            total_chars_pypdf = 0
-            
-            #load with pypdf 
-            try:
-                pypdf_loader = PyPDFLoader(file_path)
-                pypdf_docs = pypdf_loader.load()
-                documents_for_this_pdf.extend(pypdf_docs)
-                
-                if not pypdf_docs:
-                    logger.info(f"PyPDFLoader found no text for {file_path}, assuming scanned PDF")
-                    is_scanned = True
-                elif len(pypdf_docs) > 0 and (sum(len(doc.page_content) for doc in pypdf_docs) / len(pypdf_docs) < 500):
-                    logger.info(f"Low character density for {file_path}, assuming potential scanned PDF")
-                    is_scanned = True
-                else:
-                    logger.info(f"Loaded {file_path} as a native PDF")
-            except Exception as e:
-                logger.error(f"Error with PyPDFLoader for {file_path}: {e}")
-                is_scanned = True
-            
-            #fallback to OCR if pypdf fails
-            if is_scanned:
-                ocr_output_path = os.path.join(tempdir, f"ocr_output_{os.path.basename(file_path)}")
-                ocr_successful, ocr_error_message = _run_ocrmypdf(file_path, ocr_output_path, language="eng")
-                
-                if ocr_successful:
-                    try:
-                        ocr_loader = PyPDFLoader(ocr_output_path)
-                        ocr_docs = ocr_loader.load()
-                        total_chars_ocr = sum(len(doc.page_content) for doc in ocr_docs)
-                        total_chars_pypdf = sum(len(doc.page_content) for doc in pypdf_docs) if pypdf_docs else 0
-                        
-                        if total_chars_ocr > total_chars_pypdf * 1.1:
-                            logger.info(f"Using OCR'd content for {file_path}")
-                            all_documents.extend(ocr_docs)
-                        elif not pypdf_docs and ocr_docs:
-                            logger.info(f"OCR extracted content where pypdf found none for {file_path}")
-                            all_documents.extend(ocr_docs)
-                        elif pypdf_docs and ocr_docs and total_chars_ocr <= total_chars_pypdf * 1.1:
-                            logger.info(f"OCR did not significantly improve content for {file_path}, sticking with original pypdf content")
-                            all_documents.extend(pypdf_docs)
-                        else:
-                            if documents_for_this_pdf:
-                                all_documents.extend(documents_for_this_pdf)
-                            else:
-                                logger.info(f"No content extracted by any method for {file_path}")
-                    except Exception as ocr_load_e:
-                        logger.error(f"Error loading OCR'd PDF '{ocr_output_path}': {ocr_load_e}")
-                        if documents_for_this_pdf:
-                            all_documents.extend(documents_for_this_pdf)
-                else:
-                    logger.error(f"OCR with ocrmypdf failed for {file_path}: {ocr_error_message}")
-                    if documents_for_this_pdf:
-                        all_documents.extend(documents_for_this_pdf)
-            else:
-                all_documents.extend(documents_for_this_pdf)
-                logger.info(f"Using native PDF content for {file_path}")
-    
+    for docs in per_file:
+        all_documents.extend(docs)
     return all_documents
 
+
 def split_documents(documents: list[Document]):
     """Split documents into chunks"""
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800,
-        chunk_overlap=80,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         length_function=len,
         is_separator_regex=False,
     )
@@ -186,25 +297,3 @@ def build_chunk_records(chunks, file_hash, user_id, conversation_id, document_id
             'text': chunk_text
         })
     return records
-
-def prioritize_chunks(chunks, user_prompt):
-    """Reorder chunks based on relevance to user prompt"""
-    if not user_prompt:
-        return chunks
-    
-    def get_tokens(text):
-        return set(re.findall(r'\w+', text.lower()))
-    
-    prompt_tokens = get_tokens(user_prompt)
-    
-    if len(prompt_tokens) == 0:
-        return chunks
-    
-    scored_chunks = []
-    for chunk in chunks:
-        chunk_tokens = get_tokens(chunk.page_content)
-        score = len(prompt_tokens.intersection(chunk_tokens))
-        scored_chunks.append((score, chunk))
-    
-    scored_chunks.sort(key=lambda x: x[0], reverse=True)
-    return [item[1] for item in scored_chunks]
@@ -0,0 +1,228 @@
+import os
+import math
+import time
+import sqlite3
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+from .documents import compute_chunk_hash
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("data", "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "2048"))
+# under concurrent load, how long the first query of a batch waits for others to join it
+QUERY_BATCH_WINDOW_MS = int(os.getenv("QUERY_EMBEDDING_BATCH_WINDOW_MS", "10"))
+QUERY_BATCH_MAX = int(os.getenv("QUERY_EMBEDDING_BATCH_MAX", "64"))
+
+
+class EmbeddingCache:
+    """Float32 vectors keyed by (model, sha256 of text) in a local SQLite file.
+
+    The text hash is the same one build_chunk_records stores as chunkHash. WAL mode lets
+    several server processes share the file.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, vec BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._writes_since_trim = 0
+
+    def get_many(self, model, hashes, touch=True):
+        """Return {hash: vector} for the hashes that are cached. With touch=False the lookup is
+        read-only and leaves their last-used time (and so their eviction order) alone."""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = array("f", blob).tolist()
+            if found and touch:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(time.time(), model, h) for h in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model, items):
+        """items: iterable of (hash, vector)"""
+        now = time.time()
+        rows = [(model, h, array("f", vec).tobytes(), now) for h, vec in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+            self._writes_since_trim += len(rows)
+            if self._writes_since_trim >= 1000:
+                self._writes_since_trim = 0
+                self._trim()
+
+    def _trim(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self._conn.commit()
+            logger.info(f"Embedding cache trimmed {excess} least recently used vectors")
+
+
+def normalize_query(text):
+    return " ".join(text.split()).casefold()
+
+
+class QueryEmbeddingBatcher:
+    """Coalesces concurrent embed_query calls into one batched request.
+
+    Queries that arrive while a request is in flight go out together in the next one (up to
+    QUERY_BATCH_MAX). When the previous batch held more than one query, the next one also
+    waits up to QUERY_BATCH_WINDOW_MS for others to join; a lone query after a quiet spell is
+    sent at once, so the window adds no latency when there's nothing to batch with. Identical
+    queries waiting in a batch share one slot.
+    """
+
+    def __init__(self, embed_many, window_ms=QUERY_BATCH_WINDOW_MS, max_batch=QUERY_BATCH_MAX):
+        self.embed_many = embed_many
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending = OrderedDict()  # key -> (text, Future)
+        self._cond = threading.Condition()
+        self._last_batch_size = 0
+        self._thread = threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, text):
+        with self._cond:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = (text, Future())
+                self._cond.notify()
+            return entry[1]
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            if self._last_batch_size > 1:
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            keys = list(self._pending)[:self.max_batch]
+            self._last_batch_size = len(keys)
+            return [(key, *self._pending.pop(key)) for key in keys]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                vectors = self.embed_many([text for _, text, _ in batch])
+                for (_, _, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as exc:
+                for _, _, future in batch:
+                    future.set_exception(exc)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model"""
+
+    def __init__(self, base, model_name, cache, dimensions=None):
+        self.base = base
+        self.model_name = model_name
+        self.cache = cache
+        self.dimensions = dimensions
+        self._queries = OrderedDict()  # normalized query -> vector, least recently used first
+        self._queries_lock = threading.Lock()
+        self._batcher = QueryEmbeddingBatcher(self._embed_queries)
+        self.query_stats = {"hits": 0, "misses": 0, "batches": 0}
+
+    def embed_documents(self, texts):
+        hashes = [compute_chunk_hash(text) for text in texts]
+        try:
+            cached = self.cache.get_many(self.model_name, hashes)
+        except Exception as exc:
+            logger.warning(f"Embedding cache read failed, embedding everything: {exc}")
+            cached = {}
+
+        misses = {}
+        for h, text in zip(hashes, texts):
+            if h not in cached and h not in misses:
+                misses[h] = text
+        if misses:
+            vectors = self.base.embed_documents(list(misses.values()))
+            fresh = dict(zip(misses.keys(), vectors))
+            cached.update(fresh)
+            try:
+                self.cache.put_many(self.model_name, fresh.items())
+            except Exception as exc:
+                logger.warning(f"Embedding cache write failed: {exc}")
+        logger.info(f"Embedded {len(texts)} texts ({len(texts) - len(misses)} from cache)")
+        return [self._fit(cached[h]) for h in hashes]
+
+    def _fit(self, vector):
+        """Keep the first `dimensions` components and rescale to unit length.
+
+        gemini-embedding-001 is trained so that its leading dimensions carry most of the
+        signal, which makes a truncated prefix a usable embedding on its own. The cache
+        keeps full vectors, so changing the dimension needs no re-embedding.
+        """
+        if not self.dimensions or len(vector) <= self.dimensions:
+            return vector
+        head = vector[:self.dimensions]
+        norm = math.sqrt(sum(x * x for x in head)) or 1.0
+        return [x / norm for x in head]
+
+    def _embed_queries(self, texts):
+        self.query_stats["batches"] += 1
+        if len(texts) == 1:
+            return [self.base.embed_query(texts[0])]
+        if isinstance(self.base, GoogleGenerativeAIEmbeddings):
+            # one batchEmbedContents call, with the task type embed_query would use
+            return self.base.embed_documents(texts, task_type=self.base.task_type or "RETRIEVAL_QUERY")
+        return [self.base.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        with self._queries_lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                self.query_stats["hits"] += 1
+                return self._fit(vector)
+            self.query_stats["misses"] += 1
+
+        vector = self._batcher.submit(key, text).result()
+        with self._queries_lock:
+            self._queries[key] = vector
+            self._queries.move_to_end(key)
+            while len(self._queries) > QUERY_CACHE_MAX_ENTRIES:
+                self._queries.popitem(last=False)
+        return self._fit(vector)
@@ -0,0 +1,132 @@
+import os
+import gzip
+import json
+import time
+import logging
+import tempfile
+import threading
+from langchain.schema.document import Document
+
+from .documents import CHUNK_SIZE, CHUNK_OVERLAP
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", os.path.join("data", "extraction_cache"))
+CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# eviction goes down to this fraction of the limit, so the next few writes don't trigger another scan
+CACHE_LOW_WATER = 0.9
+# the running size only counts this process's writes; re-measure the directory this often
+CACHE_RESCAN_SECONDS = 600
+
+# entries whose chunks were cut with other splitter settings only reuse their pages
+CHUNKER_KEY = f"recursive:{CHUNK_SIZE}:{CHUNK_OVERLAP}"
+
+_lock = threading.Lock()
+_size = None  # bytes in CACHE_DIR as of the last scan, plus writes since
+_scanned_at = 0.0
+
+
+def _entry_path(file_hash):
+    return os.path.join(CACHE_DIR, file_hash[:2], f"{file_hash}.json.gz")
+
+
+def _to_rows(documents):
+    return [{"page": doc.metadata.get("page"), "text": doc.page_content} for doc in documents]
+
+
+def _to_documents(rows, source):
+    return [Document(page_content=row["text"], metadata={"source": source, "page": row["page"]}) for row in rows]
+
+
+def get_cached_extraction(file_hash, source):
+    """Return (pages, chunks) for a file hash seen before, or None. chunks is None if the splitter changed."""
+    if not file_hash:
+        return None
+    path = _entry_path(file_hash)
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            entry = json.load(fh)
+        os.utime(path)  # mtime doubles as the LRU clock
+    except FileNotFoundError:
+        return None
+    except Exception as exc:
+        logger.warning(f"Discarding unreadable extraction cache entry {file_hash}: {exc}")
+        _remove(path)
+        return None
+
+    pages = _to_documents(entry.get("pages", []), source)
+    chunks = _to_documents(entry["chunks"], source) if entry.get("chunker") == CHUNKER_KEY else None
+    return pages, chunks
+
+
+def put_cached_extraction(file_hash, pages, chunks):
+    if not file_hash:
+        return
+    path = _entry_path(file_hash)
+    entry = {"chunker": CHUNKER_KEY, "pages": _to_rows(pages), "chunks": _to_rows(chunks)}
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as fh:
+            json.dump(entry, fh)
+        written = os.stat(tmp_path).st_size
+        os.replace(tmp_path, path)
+    except Exception as exc:
+        logger.warning(f"Could not write extraction cache entry {file_hash}: {exc}")
+        if tmp_path:
+            _remove(tmp_path)
+        return
+    _grew(written - replaced)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _grew(delta):
+    """Account for a write; only walks the directory once the cache may be over its limit"""
+    global _size
+    with _lock:
+        stale = _size is None or time.time() - _scanned_at >= CACHE_RESCAN_SECONDS
+        if not stale:
+            _size += delta
+            if _size <= CACHE_MAX_BYTES:
+                return
+    _evict()
+
+
+def _evict():
+    """Measure the cache; if it is over CACHE_MAX_BYTES, drop least recently used entries down to the low-water mark"""
+    global _size, _scanned_at
+    with _lock:
+        _scanned_at = time.time()
+        entries = []
+        total = 0
+        for root, _, files in os.walk(CACHE_DIR):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        _size = total
+        if total <= CACHE_MAX_BYTES:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= CACHE_MAX_BYTES * CACHE_LOW_WATER:
+                break
+            _remove(path)
+            total -= size
+        _size = total
+        logger.info(f"Extraction cache evicted down to {total} bytes")
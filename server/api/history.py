@@ -0,0 +1,63 @@
+import os
+import re
+
+from .text_utils import estimate_tokens, CHARS_PER_TOKEN
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# most recent messages that go into the prompt word for word
+HISTORY_RECENT_MESSAGES = int(os.getenv("HISTORY_RECENT_MESSAGES", "6"))
+SUMMARY_LINE_CHARS = 200
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def _role(message):
+    return "User" if message.get("type") == "user" else "bot"
+
+
+def _summary_line(message):
+    """Extractive one-liner: the opening sentence of the message, clipped"""
+    text = " ".join(str(message.get("content") or "").split())
+    first = _SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(first) > SUMMARY_LINE_CHARS:
+        first = first[:SUMMARY_LINE_CHARS].rsplit(" ", 1)[0] + "..."
+    return f"{_role(message)}: {first}"
+
+
+def format_history(history, budget=HISTORY_TOKEN_BUDGET):
+    """Conversation text for a prompt, bounded by `budget` tokens however long the chat is.
+
+    The last HISTORY_RECENT_MESSAGES messages are kept verbatim (newest first if even they
+    don't fit); the budget left over goes to one-line summaries of the newest older messages.
+    """
+    recent = history[-HISTORY_RECENT_MESSAGES:] if HISTORY_RECENT_MESSAGES > 0 else []
+    older = history[:len(history) - len(recent)]
+
+    kept = []
+    used = 0
+    for message in reversed(recent):
+        line = f"{_role(message)}: {message.get('content')}\n"
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            if not kept:
+                # a single huge message: keep its end, which is closest to the question
+                kept.append(line[-budget * CHARS_PER_TOKEN:])
+                used = budget
+            break
+        kept.append(line)
+        used += cost
+    older = older if len(kept) == len(recent) else []
+
+    summary = []
+    for line in reversed([_summary_line(m) for m in older]):
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        summary.append(line)
+        used += cost
+
+    text = ""
+    if summary:
+        text += "Earlier messages (first sentence of each):\n" + "\n".join(reversed(summary)) + "\n\n"
+    return text + "".join(reversed(kept))
+
@@ -1,13 +1,27 @@
 import logging
+import os
+import tempfile
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from langchain.schema.document import Document
 from appwrite.query import Query
 
 from .vector_store import get_vector_store, add_documents_with_retry
-from .retention import enforce_retention_for_user
-from .appwrite_utils import ( rel_id, DOC_PROCESSING, DOC_COMPLETED, DOC_FAILED, JOB_PENDING, JOB_PROCESSING, JOB_COMPLETED, JOB_FAILED )
+from .lexical_index import get_lexical_index
+from .documents import load_pdf_paths, split_documents, calculate_chunk_ids, build_chunk_records
+from .bulk_writer import get_bulk_writer
+from .storage import fetch_upload, delete_upload
+from .extraction_cache import get_cached_extraction, put_cached_extraction
+from .retention import enforce_retention_for_user, record_ingested
+from .job_signals import begin_poll, wait_for_jobs
+from .progress import publish, publish_stage
+from .job_leases import (
+    LEASE_SECONDS, LeaseLost, leases_enabled, is_claimable, try_claim, release_lease,
+)
+from .appwrite_utils import ( rel_id, DOC_PENDING, DOC_PROCESSING, DOC_COMPLETED, DOC_FAILED, JOB_PENDING, JOB_PROCESSING, JOB_COMPLETED, JOB_FAILED )
 
 _worker_started = False
 _worker_thread = None
@@ -15,11 +29,41 @@ _worker_lock = threading.Lock()
 
 BATCH_SIZE = 16
 SLEEP_WHEN_IDLE = 5
+SAFETY_POLL_SECONDS = int(os.getenv("INGESTION_SAFETY_POLL_SECONDS", "60"))
+MAX_CHUNKS = int(os.getenv("MAX_CHUNKS_PER_DOC", "70"))
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+BATCH_CONCURRENCY = int(os.getenv("INGESTION_BATCH_CONCURRENCY", "2"))
+EMBED_MAX_INFLIGHT = int(os.getenv("EMBED_MAX_INFLIGHT", "3"))
+EMBED_BATCHES_PER_MINUTE = int(os.getenv("EMBED_BATCHES_PER_MINUTE", "0"))  # 0 = no rate cap
+# failed jobs are re-queued until they have run this many times; the upload is kept until then
+JOB_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("INGESTION_RETRY_DELAY_SECONDS", "5"))
+
+_job_pool = None
+_batch_pool = None
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+_slot_freed = threading.Event()
+# process wide caps on embedding/upsert batches, shared by every job
+_embed_slots = threading.BoundedSemaphore(max(1, EMBED_MAX_INFLIGHT))
+_rate_lock = threading.Lock()
+_next_batch_at = 0.0
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    'queue_depth': 0,
+    'jobs_completed': 0,
+    'jobs_failed': 0,
+    'batches_completed': 0,
+    'chunks_embedded': 0,
+}
+_recent_jobs = deque()  # (finished_at, chunk_count) for throughput
+THROUGHPUT_WINDOW = 300
 
 
 def start_worker_once(app):
-    """start a single ingestion worker thread. Uses appwrite db"""
-    global _worker_started, _worker_thread
+    """start the ingestion dispatcher thread and its job pool. Uses appwrite db"""
+    global _worker_started, _worker_thread, _job_pool, _batch_pool
     if _worker_started:
         return
 
@@ -27,18 +71,66 @@ def start_worker_once(app):
         if _worker_started:
             return
 
+        _job_pool = ThreadPoolExecutor(max_workers=max(1, INGESTION_WORKERS), thread_name_prefix="ingestion-job")
+        _batch_pool = ThreadPoolExecutor(
+            max_workers=max(1, INGESTION_WORKERS * BATCH_CONCURRENCY), thread_name_prefix="ingestion-batch"
+        )
+
+        def _run_job(job):
+            try:
+                with app.app_context():
+                    lease = try_claim(job['$id'])
+                    if lease is None:
+                        logging.info(f"[job:{job['$id']}] Leased by another worker, skipping")
+                        return
+                    lease.start_heartbeat()
+                    try:
+                        process_job(job, lease)
+                    finally:
+                        lease.stop_heartbeat()
+            except Exception as job_err:
+                logging.error(f"[job:{job['$id']}] Could not run job: {job_err}")
+            finally:
+                with _in_flight_lock:
+                    _in_flight.discard(job['$id'])
+                _slot_freed.set()
+
         def _run():
             with app.app_context():
-                logging.info("Ingestion worker loop starting")
-                recover_stuck_jobs()
+                logging.info(f"Ingestion worker loop starting with {INGESTION_WORKERS} job slots")
+                use_leases = leases_enabled()
+                if not use_leases:
+                    recover_stuck_jobs()
+                next_reclaim_at = 0.0
                 while True:
                     try:
-                        jobs = load_pending_jobs(limit=3)
+                        with _in_flight_lock:
+                            busy = set(_in_flight)
+                        free = INGESTION_WORKERS - len(busy)
+                        if free <= 0:
+                            # backpressure: don't pull more jobs than there are slots to run them
+                            _slot_freed.wait(SLEEP_WHEN_IDLE)
+                            _slot_freed.clear()
+                            continue
+
+                        # running jobs can still be listed as pending for a moment, so over-fetch and skip them
+                        token = begin_poll()
+                        jobs = load_pending_jobs(limit=free + len(busy))
+                        if use_leases and time.monotonic() >= next_reclaim_at:
+                            next_reclaim_at = time.monotonic() + LEASE_SECONDS
+                            jobs += load_reclaimable_jobs(limit=free)
+                        jobs = [j for j in jobs if j['$id'] not in busy][:free]
                         if not jobs:
-                            time.sleep(SLEEP_WHEN_IDLE)
+                            # uploads wake us through job_signals; the timeout is only a safety net
+                            timeout = SAFETY_POLL_SECONDS
+                            if use_leases:
+                                timeout = min(timeout, max(1, next_reclaim_at - time.monotonic()))
+                            wait_for_jobs(token, timeout)
                             continue
                         for job in jobs:
-                            process_job(job)
+                            with _in_flight_lock:
+                                _in_flight.add(job['$id'])
+                            _job_pool.submit(_run_job, job)
                     except Exception as loop_err:
                         logging.error(f"Ingestion worker loop error: {loop_err}")
                         time.sleep(2)
@@ -48,6 +140,113 @@ def start_worker_once(app):
         _worker_started = True
 
 
+def _record(**counts):
+    with _metrics_lock:
+        for key, value in counts.items():
+            _metrics[key] += value
+
+
+def _record_job_done(chunk_count, failed=False):
+    now = time.time()
+    with _metrics_lock:
+        _metrics['jobs_failed' if failed else 'jobs_completed'] += 1
+        if not failed:
+            _recent_jobs.append((now, chunk_count))
+        while _recent_jobs and _recent_jobs[0][0] < now - THROUGHPUT_WINDOW:
+            _recent_jobs.popleft()
+
+
+def get_worker_metrics():
+    """Snapshot of queue depth and throughput for this process"""
+    now = time.time()
+    with _metrics_lock:
+        while _recent_jobs and _recent_jobs[0][0] < now - THROUGHPUT_WINDOW:
+            _recent_jobs.popleft()
+        recent_chunks = sum(count for _, count in _recent_jobs)
+        snapshot = dict(_metrics)
+        snapshot['jobs_per_minute'] = round(len(_recent_jobs) * 60 / THROUGHPUT_WINDOW, 2)
+        snapshot['chunks_per_minute'] = round(recent_chunks * 60 / THROUGHPUT_WINDOW, 2)
+    with _in_flight_lock:
+        snapshot['jobs_in_flight'] = len(_in_flight)
+    snapshot['job_slots'] = INGESTION_WORKERS
+    snapshot['embed_max_inflight'] = EMBED_MAX_INFLIGHT
+    return snapshot
+
+
+def _wait_for_rate_slot():
+    """Space batch starts out so EMBED_BATCHES_PER_MINUTE is never exceeded"""
+    global _next_batch_at
+    if EMBED_BATCHES_PER_MINUTE <= 0:
+        return
+    with _rate_lock:
+        now = time.monotonic()
+        start_at = max(now, _next_batch_at)
+        _next_batch_at = start_at + 60.0 / EMBED_BATCHES_PER_MINUTE
+    if start_at > now:
+        time.sleep(start_at - now)
+
+
+def _push_batch(job_id, store, batch_docs, batch_ids, current_batch, total_batches, on_done=None):
+    with _embed_slots:
+        _wait_for_rate_slot()
+        logging.info(f"[job:{job_id}] processing batch {current_batch}/{total_batches} ({len(batch_docs)} chunks)...")
+        add_documents_with_retry(store, batch_docs, batch_ids)
+    _record(batches_completed=1, chunks_embedded=len(batch_docs))
+    logging.info(f"[job:{job_id}] batch {current_batch} complete")
+    if on_done:
+        on_done()
+
+
+def embed_in_batches(job_id, store, docs_to_add, ids_to_add, lease=None, on_batch=None):
+    """Embed/upsert a job's chunks with up to BATCH_CONCURRENCY batches in flight.
+
+    on_batch(completed, total) is called as batches finish, in completion order.
+    """
+    total_batches = (len(docs_to_add) + BATCH_SIZE - 1) // BATCH_SIZE
+    completed = [0]
+    completed_lock = threading.Lock()
+
+    def _on_done():
+        with completed_lock:
+            completed[0] += 1
+            done_count = completed[0]
+        if on_batch:
+            on_batch(done_count, total_batches)
+
+    if _batch_pool is None:
+        # worker pool not started (e.g. a one-off call); push serially
+        for i in range(0, len(docs_to_add), BATCH_SIZE):
+            if lease:
+                lease.check()
+            _push_batch(job_id, store, docs_to_add[i:i+BATCH_SIZE], ids_to_add[i:i+BATCH_SIZE],
+                        (i // BATCH_SIZE) + 1, total_batches, _on_done)
+        return
+    pending = set()
+    try:
+        for i in range(0, len(docs_to_add), BATCH_SIZE):
+            if lease:
+                lease.check()
+            if len(pending) >= BATCH_CONCURRENCY:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(_batch_pool.submit(
+                _push_batch, job_id, store,
+                docs_to_add[i:i+BATCH_SIZE], ids_to_add[i:i+BATCH_SIZE],
+                (i // BATCH_SIZE) + 1, total_batches, _on_done,
+            ))
+        for future in pending:
+            future.result()
+    except Exception:
+        for future in pending:
+            future.cancel()
+        raise
+
+
+class PermanentJobError(RuntimeError):
+    """A failure that retrying the job can't fix, e.g. a PDF without text"""
+
+
 def recover_stuck_jobs():
     """Any job left in processing is set back to pending on startup/restart"""
     from app import databases, db_id, jobs_collection_id
@@ -75,6 +274,27 @@ def recover_stuck_jobs():
         logging.error(f"Failed to recover stuck jobs: {exc}")
 
 
+def load_reclaimable_jobs(limit=3):
+    """Jobs marked processing whose lease expired (their worker died) or that never had one"""
+    from app import databases, db_id, jobs_collection_id
+    try:
+        res = databases.list_documents(
+            db_id, jobs_collection_id,
+            queries=[
+                Query.equal('status', [JOB_PROCESSING, 'running']),
+                Query.order_asc('$updatedAt'),
+                Query.limit(25)
+            ]
+        )
+        expired = [job for job in res.get('documents', []) if is_claimable(job['$id'])]
+        if expired:
+            logging.info(f"Found {len(expired)} processing jobs with expired leases")
+        return expired[:limit]
+    except Exception as exc:
+        logging.error(f"Failed to look for expired job leases: {exc}")
+        return []
+
+
 def load_pending_jobs(limit=3):
     from app import databases, db_id, jobs_collection_id
     try:
@@ -86,13 +306,60 @@ def load_pending_jobs(limit=3):
                 Query.limit(limit)
             ]
         )
+        with _metrics_lock:
+            _metrics['queue_depth'] = res.get('total', 0)
         return res.get('documents', [])
     except Exception as exc:
         logging.error(f"Failed to load pending jobs: {exc}")
         return []
 
 
-def process_job(job):
+def extract_and_chunk(job_id, doc_record, user_id, conversation_id):
+    """Extraction and chunking stages: raw upload -> pages -> chunk rows in the chunks collection"""
+    from app import databases, db_id, docs_collection_id, chunks_collection_id
+    document_id = doc_record['$id']
+    file_name = doc_record.get('fileName') or f"{document_id}.pdf"
+    file_hash = doc_record.get('fileHash')
+
+    # chunk ids are derived from source, so key them on the file name rather than a storage path
+    cached = get_cached_extraction(file_hash, file_name)
+    if cached and cached[1] is not None:
+        logging.info(f"[job:{job_id}] Extraction cache hit for {file_name}")
+        publish_stage(conversation_id, document_id, 'chunking', cached=True)
+        chunks = cached[1]
+    else:
+        if cached:
+            documents = cached[0]
+        else:
+            logging.info(f"[job:{job_id}] Extracting text from {file_name}")
+            publish_stage(conversation_id, document_id, 'extracting')
+            with tempfile.TemporaryDirectory() as tempdir:
+                documents = load_pdf_paths([fetch_upload(document_id, tempdir)], tempdir)
+            for doc in documents:
+                doc.metadata['source'] = file_name
+        publish_stage(conversation_id, document_id, 'chunking')
+        chunks = split_documents(documents)
+        if chunks:
+            put_cached_extraction(file_hash, documents, chunks)
+    if not chunks:
+        raise PermanentJobError(f"{file_name} contained no extractable text")
+    if len(chunks) > MAX_CHUNKS:
+        raise PermanentJobError(f"Too many chunks ({len(chunks)}) - please upload a smaller file")
+
+    chunks_with_ids = calculate_chunk_ids(chunks)
+    records = build_chunk_records(chunks_with_ids, file_hash, user_id, conversation_id, document_id)
+    logging.info(f"[job:{job_id}] Persisting {len(records)} chunks")
+    publish_stage(conversation_id, document_id, 'persisting', chunks=len(records))
+    write_result = get_bulk_writer().create_documents(db_id, chunks_collection_id, records)
+    if not write_result.ok:
+        raise RuntimeError(f"{len(write_result.failed)}/{len(records)} chunk writes failed: {write_result.failed[0][1]}")
+
+    databases.update_document(db_id, docs_collection_id, document_id, {'chunkCount': len(records)})
+    delete_upload(document_id)
+    return records
+
+
+def process_job(job, lease=None):
     from app import databases, db_id, docs_collection_id, chunks_collection_id, jobs_collection_id
     job_id = job['$id']
     user_id = rel_id(job.get('userId'))
@@ -106,9 +373,19 @@ def process_job(job):
             db_id, jobs_collection_id, job_id,
             {'status': JOB_FAILED, 'errorMessage': 'missing documentId'}
         )
+        release_lease(lease)
         return
     
     try:
+        if lease is not None:
+            # the listing may be stale; a job that finished before we claimed it stays finished
+            current = databases.get_document(db_id, jobs_collection_id, job_id)
+            if current.get('status') not in (JOB_PENDING, JOB_PROCESSING, 'running'):
+                logging.info(f"[job:{job_id}] Already {current.get('status')}, skipping")
+                release_lease(lease)
+                return
+            job = current
+
         logging.info(f"Jobs colln id: {jobs_collection_id}")
         logging.info(f"Job id: {job_id}")
         databases.update_document(
@@ -119,6 +396,7 @@ def process_job(job):
             db_id, docs_collection_id, document_id,
             {'status': DOC_PROCESSING}
         )
+        publish_stage(conversation_id, document_id, 'processing')
 
         doc_record = databases.get_document(db_id, docs_collection_id, document_id)
         file_hash = doc_record.get('fileHash')
@@ -136,8 +414,16 @@ def process_job(job):
             queries=[Query.equal('documentId', document_id), Query.limit(500)]
         )
         chunks = chunks_res.get('documents', [])
-        if not chunks:
-            raise RuntimeError("No chunks found for document")
+        expected = doc_record.get('chunkCount', 0)
+        if not chunks or len(chunks) != expected:
+            if chunks:
+                # a previous attempt died while persisting chunks
+                logging.info(f"[job:{job_id}] Found {len(chunks)}/{expected} chunks, re-chunking")
+                for ch in chunks:
+                    databases.delete_document(db_id, chunks_collection_id, ch['$id'])
+            chunks = extract_and_chunk(job_id, doc_record, user_id, conversation_id)
+            if lease:
+                lease.check()
 
         store = get_vector_store()
 
@@ -156,15 +442,15 @@ def process_job(job):
             docs_to_add.append(doc)
             ids_to_add.append(chunk_hash)
 
-        for i in range(0, len(docs_to_add), BATCH_SIZE):
-            batch_docs = docs_to_add[i:i+BATCH_SIZE]
-            batch_ids = ids_to_add[i:i+BATCH_SIZE]
-            current_batch = (i // BATCH_SIZE) + 1
-            total_batches = (len(docs_to_add) + BATCH_SIZE - 1)
-            logging.info(f"[job:{job_id}] processing batch {current_batch}/{total_batches} ({len(batch_docs)} chunks)...")
-            add_documents_with_retry(store, batch_docs, batch_ids)
-            logging.info(f"[job:{job_id}] batch {current_batch} complete")
-
+        publish_stage(conversation_id, document_id, 'embedding', total_batches=(len(docs_to_add) + BATCH_SIZE - 1) // BATCH_SIZE)
+        embed_in_batches(
+            job_id, store, docs_to_add, ids_to_add, lease,
+            on_batch=lambda done, total: publish(conversation_id, {
+                'type': 'batch', 'documentId': document_id, 'current_batch': done, 'total_batches': total,
+            }),
+        )
+        if lease:
+            lease.check()
 
         now_iso = datetime.now().isoformat()
         databases.update_document(
@@ -175,13 +461,43 @@ def process_job(job):
             db_id, jobs_collection_id, job_id,
             {'status': JOB_COMPLETED, 'errorMessage': ''}
         )
+        try:
+            get_lexical_index().add_document(conversation_id, document_id, file_hash, user_id, chunks)
+        except Exception as lex_exc:
+            # the next search fetches documents missing from the lexical index
+            logging.warning(f"[job:{job_id}] Lexical index update failed: {lex_exc}")
         logging.info(f"[job:{job_id}] Ingestion complete, added {len(docs_to_add)} new chunks")
+        _record_job_done(len(docs_to_add))
+        publish_stage(conversation_id, document_id, DOC_COMPLETED, chunks=len(docs_to_add))
+        release_lease(lease)
 
         if user_id:
+            record_ingested(
+                user_id, {**doc_record, 'status': DOC_COMPLETED, 'lastUsedAt': now_iso, 'chunkCount': len(chunks)}
+            )
             enforce_retention_for_user(user_id)
 
+    except LeaseLost as lost:
+        # the new lease holder owns the job's status from here on
+        logging.warning(f"[job:{job_id}] Abandoning job: {lost}")
     except Exception as exc:
         logging.error(f"[job:{job_id}] Failed: {exc}")
+        if lease is not None:
+            try:
+                lease.check()
+            except LeaseLost as lost:
+                # the new lease holder owns the job's status and upload from here on
+                logging.warning(f"[job:{job_id}] Not recording the failure: {lost}")
+                return
+        # jobs are created with attempts=1 and each run adds one, so the count this run started from is its number
+        attempt = max(1, job.get('attempts', 1))
+        if attempt < JOB_MAX_ATTEMPTS and not isinstance(exc, PermanentJobError):
+            _retry_job(job_id, document_id, conversation_id, attempt, exc, lease)
+            return
+        _record_job_done(0, failed=True)
+        publish_stage(conversation_id, document_id, DOC_FAILED, error=str(exc))
+        # out of attempts; uploads of jobs still being retried stay for the retry (prune removes them too)
+        delete_upload(document_id)
         databases.update_document(
             db_id, jobs_collection_id, job_id,
             {'status': JOB_FAILED, 'errorMessage': str(exc)}
@@ -192,4 +508,31 @@ def process_job(job):
                 {'status': DOC_FAILED}
             )
         except Exception as doc_exc:
-            logging.error(f"[job:{job_id}] Could not mark document failed: {doc_exc}")
\ No newline at end of file
+            logging.error(f"[job:{job_id}] Could not mark document failed: {doc_exc}")
+        release_lease(lease)
+
+
+def _retry_job(job_id, document_id, conversation_id, attempt, exc, lease):
+    """Put a job that failed transiently (e.g. a Gemini 429 or an Appwrite blip) back in the queue.
+    The backoff runs while we still hold the lease, so no other worker picks the job up early."""
+    from app import databases, db_id, docs_collection_id, jobs_collection_id
+    delay = JOB_RETRY_DELAY * (2 ** (attempt - 1))
+    logging.warning(f"[job:{job_id}] Attempt {attempt}/{JOB_MAX_ATTEMPTS} failed, retrying in {delay:.0f}s")
+    publish_stage(conversation_id, document_id, 'queued', retry=attempt, error=str(exc))
+    time.sleep(delay)
+    if lease is not None:
+        try:
+            lease.check()
+        except LeaseLost as lost:
+            logging.warning(f"[job:{job_id}] Not re-queueing: {lost}")
+            return
+    try:
+        databases.update_document(
+            db_id, jobs_collection_id, job_id,
+            {'status': JOB_PENDING, 'errorMessage': f"retrying after: {exc}"}
+        )
+        databases.update_document(db_id, docs_collection_id, document_id, {'status': DOC_PENDING})
+    except Exception as requeue_exc:
+        # left in processing; once the lease expires the job is reclaimed like a crashed one
+        logging.error(f"[job:{job_id}] Could not re-queue: {requeue_exc}")
+    release_lease(lease)
@@ -0,0 +1,173 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from appwrite.query import Query
+from appwrite.exception import AppwriteException
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+HEARTBEAT_SECONDS = max(1, LEASE_SECONDS // 3)
+
+# identifies this process as a lease owner
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class LeaseLost(RuntimeError):
+    """Another worker reclaimed the job after our lease expired"""
+
+
+class JobLease:
+    def __init__(self, job_id, generation):
+        self.job_id = job_id
+        self.generation = generation
+        self.doc_id = f"{job_id}_{generation}"
+        # when the lease's expiry was last pushed out; the claim counts as the first push
+        self.renewed_at = time.time()
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        if self.lost.is_set():
+            raise LeaseLost(f"lease on job {self.job_id} was taken over")
+
+    def start_heartbeat(self):
+        if self.generation == 0:
+            # leases disabled, nothing to renew
+            return
+        self._thread = threading.Thread(
+            target=self._heartbeat, name=f"lease-{self.job_id}", daemon=True
+        )
+        self._thread.start()
+
+    def stop_heartbeat(self):
+        self._stop.set()
+
+    def _heartbeat(self):
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            if not renew_lease(self):
+                logger.warning(f"[job:{self.job_id}] Lost lease generation {self.generation}")
+                self.lost.set()
+                return
+
+
+def leases_enabled():
+    from app import leases_collection_id
+    return bool(leases_collection_id)
+
+
+def _latest_lease(job_id):
+    from app import databases, db_id, leases_collection_id
+    res = databases.list_documents(
+        db_id, leases_collection_id,
+        queries=[Query.equal('jobId', job_id), Query.order_desc('generation'), Query.limit(1)]
+    )
+    docs = res.get('documents', [])
+    return docs[0] if docs else None
+
+
+def is_claimable(job_id):
+    """True when nobody holds an unexpired lease on the job"""
+    latest = _latest_lease(job_id)
+    return latest is None or latest.get('expiresAt', 0) <= time.time()
+
+
+def try_claim(job_id):
+    """Claim a job, returning a JobLease or None if someone else holds it.
+
+    Lease documents use the deterministic id <jobId>_<generation>, so creating one is an
+    atomic compare-and-set: of several workers racing for the same generation exactly one
+    create succeeds and the rest get 409. An expired lease is reclaimed by creating the
+    next generation.
+    """
+    from app import databases, db_id, leases_collection_id
+    if not leases_collection_id:
+        return JobLease(job_id, 0)
+
+    latest = _latest_lease(job_id)
+    if latest is not None and latest.get('expiresAt', 0) > time.time():
+        return None
+
+    generation = (latest.get('generation', 0) + 1) if latest else 1
+    lease = JobLease(job_id, generation)
+    try:
+        databases.create_document(
+            db_id, leases_collection_id, lease.doc_id,
+            {
+                'jobId': job_id,
+                'owner': WORKER_ID,
+                'generation': generation,
+                'expiresAt': int(lease.renewed_at) + LEASE_SECONDS,
+            },
+        )
+    except AppwriteException as exc:
+        if exc.code == 409:
+            return None
+        raise
+    if latest is not None:
+        logger.info(f"[job:{job_id}] Reclaimed expired lease from {latest.get('owner')}")
+        _delete_earlier_generations(lease)
+    return lease
+
+
+def _delete_earlier_generations(lease):
+    """Drop the expired leases a reclaim superseded, so takeovers don't pile up lease documents.
+    Their holders notice on their next renewal, which compares against the latest generation."""
+    from app import databases, db_id, leases_collection_id
+    try:
+        res = databases.list_documents(
+            db_id, leases_collection_id,
+            queries=[Query.equal('jobId', lease.job_id), Query.less_than('generation', lease.generation),
+                     Query.select(['$id']), Query.limit(100)]
+        )
+        for doc in res.get('documents', []):
+            try:
+                databases.delete_document(db_id, leases_collection_id, doc['$id'])
+            except AppwriteException as exc:
+                if exc.code != 404:
+                    raise
+    except Exception as exc:
+        logger.warning(f"[job:{lease.job_id}] Could not remove superseded leases: {exc}")
+
+
+def renew_lease(lease):
+    """Push the expiry out; False if a newer generation exists, the lease is gone, or
+    renewals have been failing for long enough that it has already expired"""
+    from app import databases, db_id, leases_collection_id
+    if not leases_collection_id:
+        return True
+    try:
+        latest = _latest_lease(lease.job_id)
+        if latest is None or latest['$id'] != lease.doc_id:
+            return False
+        renewed_at = time.time()
+        databases.update_document(
+            db_id, leases_collection_id, lease.doc_id,
+            {'expiresAt': int(renewed_at) + LEASE_SECONDS}
+        )
+        lease.renewed_at = renewed_at
+        return True
+    except Exception as exc:
+        # a transient error shouldn't drop the job, but once the last good renewal is a full
+        # lease old another worker may already have reclaimed it
+        logger.warning(f"[job:{lease.job_id}] Lease renewal failed: {exc}")
+        return time.time() - lease.renewed_at < LEASE_SECONDS
+
+
+def release_lease(lease):
+    """Remove our lease document once the job reached a final status. Only our own
+    generation: a newer one belongs to the worker that reclaimed the job."""
+    from app import databases, db_id, leases_collection_id
+    if lease is None or lease.generation == 0 or not leases_collection_id:
+        return
+    try:
+        databases.delete_document(db_id, leases_collection_id, lease.doc_id)
+    except AppwriteException as exc:
+        if exc.code != 404:
+            logger.warning(f"[job:{lease.job_id}] Could not release lease: {exc}")
+    except Exception as exc:
+        logger.warning(f"[job:{lease.job_id}] Could not release lease: {exc}")
@@ -0,0 +1,103 @@
+import os
+import logging
+import importlib
+import threading
+
+logger = logging.getLogger(__name__)
+
+SIGNAL_BACKEND = os.getenv("INGESTION_SIGNAL_BACKEND", "file")
+SIGNAL_FILE = os.getenv("INGESTION_SIGNAL_FILE", os.path.join("data", "ingestion.signal"))
+SIGNAL_CHECK_INTERVAL = 0.25
+
+_local_event = threading.Event()
+_backend = None
+_lock = threading.Lock()
+
+
+class NullSignalBackend:
+    """In-process wakeups only"""
+
+    def notify(self):
+        pass
+
+    def token(self):
+        return None
+
+
+class FileSignalBackend:
+    """Cross-process wakeups through the mtime of a shared file.
+
+    Notifiers bump the mtime; waiters compare it against the value they saw before their
+    last poll. A stat every SIGNAL_CHECK_INTERVAL is local and cheap, unlike an Appwrite list.
+    """
+
+    def __init__(self, path=SIGNAL_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def notify(self):
+        with open(self.path, "a"):
+            pass
+        os.utime(self.path)
+
+    def token(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+
+_BACKENDS = {"none": NullSignalBackend, "file": FileSignalBackend}
+
+
+def get_signal_backend():
+    """INGESTION_SIGNAL_BACKEND is 'file', 'none' or 'package.module:Class' with notify()/token()"""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                if SIGNAL_BACKEND in _BACKENDS:
+                    _backend = _BACKENDS[SIGNAL_BACKEND]()
+                else:
+                    module_name, _, class_name = SIGNAL_BACKEND.partition(":")
+                    _backend = getattr(importlib.import_module(module_name), class_name)()
+                logging.info(f"Ingestion signal backend: {type(_backend).__name__}")
+    return _backend
+
+
+def notify_jobs_available():
+    """Wake ingestion workers in this process right away and in other processes via the backend"""
+    _local_event.set()
+    try:
+        get_signal_backend().notify()
+    except Exception as exc:
+        logger.warning(f"Could not signal other workers: {exc}")
+
+
+def begin_poll():
+    """Call before listing jobs; returns the token to pass to wait_for_jobs"""
+    _local_event.clear()
+    try:
+        return get_signal_backend().token()
+    except Exception:
+        return None
+
+
+def wait_for_jobs(token, timeout):
+    """Block until a notification arrives after begin_poll() or timeout passes. True if notified."""
+    backend = get_signal_backend()
+    if isinstance(backend, NullSignalBackend):
+        return _local_event.wait(timeout)
+
+    remaining = timeout
+    while remaining > 0:
+        step = min(SIGNAL_CHECK_INTERVAL, remaining)
+        if _local_event.wait(step):
+            return True
+        try:
+            if backend.token() != token:
+                return True
+        except Exception:
+            pass
+        remaining -= step
+    return False
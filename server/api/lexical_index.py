@@ -0,0 +1,258 @@
+import os
+import re
+import json
+import math
+import hashlib
+import time
+import logging
+import threading
+from collections import Counter, defaultdict
+from appwrite.query import Query
+from langchain_core.documents import Document
+
+from .appwrite_utils import DOC_COMPLETED, rel_id
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", os.path.join("data", "lexical"))
+# how often a search re-checks the owner's completed documents in Appwrite
+LEXICAL_CHECK_SECONDS = int(os.getenv("LEXICAL_CHECK_SECONDS", "30"))
+LEXICAL_FETCH_PAGE = 1000
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# keeps identifiers such as "ab-1234", "v2.1" or "part_no" whole
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART_RE = re.compile(r"[-_./]")
+
+
+def tokenize(text):
+    """Lowercased terms; a compound identifier also yields its parts and its joined form"""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        terms.append(token)
+        parts = _PART_RE.split(token)
+        if len(parts) > 1:
+            terms.extend(parts)
+            terms.append("".join(parts))
+    return terms
+
+
+class _ConversationIndex:
+    """BM25 postings for one conversation's chunks, rebuilt from its JSON file when that changes"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks  # [{"chunk_hash", "text", "document_id", "file_hash", "user_id"}]
+        self.postings = defaultdict(dict)  # term -> {row: term frequency}
+        self.lengths = []
+        for row, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk["text"]))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term][row] = tf
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def search(self, query, k, user_id):
+        """Top-k of the chunks owned by `user_id`"""
+        n = len(self.chunks)
+        if not n:
+            return []
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for row, tf in postings.items():
+                if self.chunks[row]["user_id"] != user_id:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[row] / (self.avg_length or 1))
+                scores[row] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        top = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [(self.chunks[row], score) for row, score in top]
+
+
+class _Loaded:
+    __slots__ = ("mtime", "documents", "index", "checked")
+
+    def __init__(self, mtime, documents, chunks):
+        self.mtime = mtime
+        self.documents = documents  # document id -> {"user_id", "chunks": chunk count}
+        self.index = _ConversationIndex(chunks)
+        self.checked = {}  # user id -> time.time() of the last check against Appwrite
+
+
+class LexicalIndex:
+    """Per-conversation BM25 indexes persisted as JSON under LEXICAL_INDEX_DIR.
+
+    Each file records which documents it holds, with their owner and chunk count. Searches
+    compare that with the owner's completed documents in Appwrite (at most every
+    LEXICAL_CHECK_SECONDS) and fetch or drop only the documents that differ, so an index
+    written on another host, or before a document finished elsewhere, catches up. Chunks are
+    also added directly when a document finishes ingestion in this process. Conversations
+    without ready documents never get a file.
+    """
+
+    def __init__(self, path=LEXICAL_INDEX_DIR, check_seconds=LEXICAL_CHECK_SECONDS):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._loaded = {}  # conversation id -> _Loaded
+        self._lock = threading.Lock()  # guards _loaded only
+        self._conversation_locks = [threading.Lock() for _ in range(64)]
+        os.makedirs(path, exist_ok=True)
+
+    def _lock_for(self, conversation_id):
+        return self._conversation_locks[hash(conversation_id) % len(self._conversation_locks)]
+
+    def _file(self, conversation_id):
+        return os.path.join(self.path, hashlib.sha1(conversation_id.encode()).hexdigest() + ".json")
+
+    def _read(self, conversation_id):
+        """(documents, chunks) from the conversation's file; empty if there is none or it predates owners"""
+        try:
+            with open(self._file(conversation_id)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}, []
+        if not isinstance(data, dict):
+            return {}, []
+        return data["documents"], data["chunks"]
+
+    def _write(self, conversation_id, documents, chunks):
+        path = self._file(conversation_id)
+        if not documents:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        else:
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"documents": documents, "chunks": chunks}, f)
+            os.replace(tmp, path)
+        with self._lock:
+            self._loaded.pop(conversation_id, None)
+
+    def _current(self, conversation_id):
+        """This process's copy of the conversation's file, reloaded if the file changed"""
+        try:
+            mtime = os.stat(self._file(conversation_id)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            loaded = self._loaded.get(conversation_id)
+        if loaded is None or loaded.mtime != mtime:
+            loaded = _Loaded(mtime, *self._read(conversation_id))
+            with self._lock:
+                self._loaded[conversation_id] = loaded
+        return loaded
+
+    def _ready_documents(self, conversation_id, user_id):
+        from app import databases, db_id, docs_collection_id
+        docs = databases.list_documents(
+            db_id, docs_collection_id,
+            queries=[Query.equal("conversationId", conversation_id), Query.equal("userId", user_id),
+                     Query.equal("status", DOC_COMPLETED), Query.select(["$id", "fileHash", "chunkCount"]),
+                     Query.limit(100)]
+        ).get("documents", [])
+        return {doc["$id"]: doc for doc in docs}
+
+    def _fetch_chunks(self, user_id, docs):
+        """Chunk rows of the given document records, paged across all of them at once"""
+        from app import databases, db_id, chunks_collection_id
+        chunks = []
+        by_id = {doc["$id"]: doc for doc in docs}
+        ids = list(by_id)
+        for start in range(0, len(ids), 100):
+            cursor = None
+            while True:
+                queries = [Query.equal("documentId", ids[start:start + 100]), Query.limit(LEXICAL_FETCH_PAGE)]
+                if cursor:
+                    queries.append(Query.cursor_after(cursor))
+                page = databases.list_documents(db_id, chunks_collection_id, queries=queries).get("documents", [])
+                for ch in page:
+                    doc_id = rel_id(ch.get("documentId"))
+                    chunks.append({"chunk_hash": ch["chunkHash"], "text": ch.get("text", ""), "document_id": doc_id,
+                                   "file_hash": by_id.get(doc_id, {}).get("fileHash"), "user_id": user_id})
+                if len(page) < LEXICAL_FETCH_PAGE:
+                    break
+                cursor = page[-1]["$id"]
+        return chunks
+
+    def _catch_up(self, conversation_id, user_id, loaded):
+        """Bring the user's share of the index in line with their completed documents"""
+        ready = self._ready_documents(conversation_id, user_id)
+        mine = {doc_id: doc for doc_id, doc in loaded.documents.items() if doc["user_id"] == user_id}
+        stale = {doc_id for doc_id, doc in mine.items()
+                 if doc_id not in ready or ready[doc_id].get("chunkCount") != doc["chunks"]}
+        missing = [doc for doc_id, doc in ready.items() if doc_id not in mine or doc_id in stale]
+        if not stale and not missing:
+            return loaded
+        chunks = [ch for ch in loaded.index.chunks if ch["document_id"] not in stale]
+        documents = {doc_id: doc for doc_id, doc in loaded.documents.items() if doc_id not in stale}
+        chunks.extend(self._fetch_chunks(user_id, missing))
+        documents.update({doc["$id"]: {"user_id": user_id, "chunks": doc.get("chunkCount", 0)} for doc in missing})
+        self._write(conversation_id, documents, chunks)
+        logger.info(f"Lexical index for conversation {conversation_id}: +{len(missing)} -{len(stale)} documents")
+        return self._current(conversation_id)
+
+    def _index(self, conversation_id, user_id):
+        with self._lock_for(conversation_id):
+            loaded = self._current(conversation_id)
+            if time.time() - loaded.checked.get(user_id, 0) >= self.check_seconds:
+                loaded = self._catch_up(conversation_id, user_id, loaded)
+                loaded.checked[user_id] = time.time()
+            return loaded.index
+
+    def add_document(self, conversation_id, document_id, file_hash, user_id, chunk_records):
+        with self._lock_for(conversation_id):
+            documents, chunks = self._read(conversation_id)
+            chunks = [ch for ch in chunks if ch["document_id"] != document_id]
+            chunks.extend(
+                {"chunk_hash": rec["chunkHash"], "text": rec.get("text", ""), "document_id": document_id,
+                 "file_hash": file_hash, "user_id": user_id}
+                for rec in chunk_records
+            )
+            documents[document_id] = {"user_id": user_id, "chunks": len(chunk_records)}
+            self._write(conversation_id, documents, chunks)
+
+    def remove_document(self, conversation_id, document_id):
+        with self._lock_for(conversation_id):
+            documents, chunks = self._read(conversation_id)
+            if document_id in documents:
+                del documents[document_id]
+                self._write(conversation_id, documents, [ch for ch in chunks if ch["document_id"] != document_id])
+
+    def drop_conversation(self, conversation_id):
+        with self._lock_for(conversation_id):
+            self._write(conversation_id, {}, [])
+
+    def search(self, conversation_id, user_id, query, k):
+        """Top-k of the user's chunks in the conversation, as Documents with the vector store's
+        chunk metadata. `user_id` is the Users document id that owns the chunks."""
+        return [
+            Document(
+                page_content=chunk["text"],
+                metadata={
+                    "chunk_hash": chunk["chunk_hash"],
+                    "file_hash": chunk["file_hash"],
+                    "document_id": chunk["document_id"],
+                    "conversation_id": conversation_id,
+                    "bm25": score,
+                },
+            )
+            for chunk, score in self._index(conversation_id, user_id).search(query, k, user_id)
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_lexical_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LexicalIndex()
+    return _index
@@ -0,0 +1,73 @@
+import os
+import time
+import logging
+import threading
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+logger = logging.getLogger(__name__)
+
+CHAT_MODEL = "gemini-2.5-flash-lite"
+RAG_TEMPERATURE = 0.3
+FALLBACK_TEMPERATURE = 0.7
+
+# point at a local fake Gemini server for tests, e.g. GEMINI_API_ENDPOINT=localhost:8089 GEMINI_TRANSPORT=rest
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT")
+
+_clients = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def _build_client(model, temperature):
+    kwargs = {"model": model, "temperature": temperature}
+    if GEMINI_API_ENDPOINT:
+        kwargs["client_options"] = {"api_endpoint": GEMINI_API_ENDPOINT}
+    if GEMINI_TRANSPORT:
+        kwargs["transport"] = GEMINI_TRANSPORT
+    return ChatGoogleGenerativeAI(**kwargs)
+
+
+def get_chat_model(model=CHAT_MODEL, temperature=RAG_TEMPERATURE):
+    """Shared chat client per (model, temperature). The underlying gRPC/REST channel is
+    created once and reused by every prompt instead of per call."""
+    key = (model, temperature)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _build_client(model, temperature)
+                _clients[key] = client
+                _stats[key] = {"created_at": time.time(), "uses": 0}
+                logging.info(f"Chat model client initialized for {model} (temperature {temperature})")
+    with _lock:
+        _stats[key]["uses"] += 1
+    return client
+
+
+def warm_chat_models():
+    """Build the clients the chat route uses so the first prompt doesn't pay for it"""
+    for temperature in (RAG_TEMPERATURE, FALLBACK_TEMPERATURE):
+        key = (CHAT_MODEL, temperature)
+        if key not in _clients:
+            with _lock:
+                if key not in _clients:
+                    _clients[key] = _build_client(CHAT_MODEL, temperature)
+                    _stats[key] = {"created_at": time.time(), "uses": 0}
+    logging.info("Chat model clients warmed")
+
+
+def get_chat_model_stats():
+    """Per client: how many prompts reused it since it was built"""
+    with _lock:
+        return [
+            {
+                "model": model,
+                "temperature": temperature,
+                "uses": stats["uses"],
+                "reuses": max(0, stats["uses"] - 1),
+                "age_seconds": round(time.time() - stats["created_at"], 1),
+            }
+            for (model, temperature), stats in _stats.items()
+        ]
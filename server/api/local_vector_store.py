@@ -0,0 +1,336 @@
+import os
+import re
+import json
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", os.path.join("data", "vectors"))
+# "none", "int8" (4x smaller scans) or "binary" (32x); candidates are rescored against the float vectors
+LOCAL_VECTOR_QUANTIZATION = os.getenv("LOCAL_VECTOR_QUANTIZATION", "none")
+# how many candidates per requested result the quantized scan hands to float rescoring
+LOCAL_VECTOR_RESCORE_FACTOR = int(os.getenv("LOCAL_VECTOR_RESCORE_FACTOR", "10"))
+
+# partitions are keyed by these metadata fields; searches and deletes that name both touch one partition
+PARTITION_KEYS = ("user_id", "conversation_id")
+
+
+_VERSION_FILE = re.compile(r"^(vectors|codes|scales)-(\d+)\.(f32|bin)$")
+
+
+def _safe_name(value):
+    return hashlib.sha1(str(value).encode()).hexdigest()[:16]
+
+
+def _matches(metadata, search_filter):
+    for key, expected in (search_filter or {}).items():
+        value = metadata.get(key)
+        if isinstance(expected, dict) and "$in" in expected:
+            if value not in expected["$in"]:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors, mode):
+    """(codes, scales) for unit vectors: int8 with a per-row scale, or one sign bit per dimension"""
+    if mode == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    if mode == "binary":
+        return np.packbits(vectors > 0, axis=1), None
+    raise ValueError(f"Unknown quantization {mode!r}")
+
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def approximate_scores(codes, scales, query, mode):
+    """Scores from the quantized codes; only their order matters, the top rows are rescored"""
+    if mode == "int8":
+        return (codes.astype(np.float32) @ query) * scales
+    query_bits = np.packbits(query > 0)
+    return -_POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=1, dtype=np.int32)
+
+
+class _Partition:
+    """One user/conversation: unit vectors in a memory-mapped float32 file plus a JSON manifest.
+
+    Every write produces new vectors-<version>.f32 (and codes/scales files when quantized)
+    and then atomically replaces manifest.json, so readers always see a matching set. Writers
+    hold an exclusive flock on the partition's lock file around read-modify-write, so writers
+    in different processes don't overwrite each other's versions. The previous version's
+    files are kept until the next write, for readers that loaded the old manifest but have
+    not opened its files yet. With quantization, search scans the compact codes and only
+    reads the float rows of the best candidates for rescoring.
+    """
+
+    def __init__(self, path, quantization=None, rescore_factor=10):
+        self.path = path
+        self.manifest_path = os.path.join(path, "manifest.json")
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.version = -1
+        self.mtime = None
+        self.records = []  # [{"id", "text", "metadata"}], row i of vectors
+        self.vectors = None
+        self.codes = None
+        self.scales = None
+        self.mode = None
+
+    def _file(self, kind, version):
+        return os.path.join(self.path, f"{kind}-{version}.{'f32' if kind != 'codes' else 'bin'}")
+
+    @contextmanager
+    def locked(self):
+        """Exclusive across processes; reloads the manifest so the write starts from the latest version"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.mtime = None
+                self.refresh()
+                yield self
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        for attempt in range(3):
+            try:
+                self._load()
+                return
+            except FileNotFoundError:
+                # a writer replaced the manifest and dropped the files we were about to open
+                self.mtime = None
+                if attempt == 2:
+                    raise
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            self.version, self.mtime, self.records = -1, None, []
+            self.vectors = self.codes = self.scales = self.mode = None
+            return
+        if mtime == self.mtime:
+            return
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        self.records = manifest["records"]
+        self.version = manifest["version"]
+        self.mode = manifest.get("quantization")
+        self.mtime = mtime
+        self.vectors = self.codes = self.scales = None
+        n, dim = len(self.records), manifest["dim"]
+        if not n:
+            return
+        self.vectors = np.memmap(self._file("vectors", self.version), dtype=np.float32, mode="r", shape=(n, dim))
+        if self.mode == "int8":
+            self.codes = np.memmap(self._file("codes", self.version), dtype=np.int8, mode="r", shape=(n, dim))
+            self.scales = np.memmap(self._file("scales", self.version), dtype=np.float32, mode="r", shape=(n,))
+        elif self.mode == "binary":
+            self.codes = np.memmap(
+                self._file("codes", self.version), dtype=np.uint8, mode="r", shape=(n, (dim + 7) // 8)
+            )
+
+    @staticmethod
+    def _dump(path, array):
+        out = np.memmap(path, dtype=array.dtype, mode="w+", shape=array.shape)
+        out[:] = array
+        out.flush()
+        del out
+
+    def write(self, records, vectors):
+        """Replace the partition's contents; call inside locked()"""
+        version = self.version + 1
+        previous = self.version
+        dim = int(vectors.shape[1]) if len(records) else 0
+        mode = self.quantization if len(records) else None
+        if len(records):
+            self._dump(self._file("vectors", version), np.ascontiguousarray(vectors, dtype=np.float32))
+            if mode:
+                codes, scales = quantize(np.asarray(vectors, dtype=np.float32), mode)
+                self._dump(self._file("codes", version), codes)
+                if scales is not None:
+                    self._dump(self._file("scales", version), scales)
+        tmp = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": version, "dim": dim, "quantization": mode, "records": records}, f)
+        os.replace(tmp, self.manifest_path)
+        self.mtime = None
+        self.refresh()
+        for name in os.listdir(self.path):
+            match = _VERSION_FILE.match(name)
+            if match and int(match.group(2)) < previous:
+                # open memmaps of old versions stay readable until they are dropped
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+
+    def search(self, query, k, search_filter):
+        if self.vectors is None:
+            return []
+        if self.vectors.shape[1] != query.shape[0]:
+            logger.warning(f"Skipping {self.path}: stored at {self.vectors.shape[1]} dims, query has {query.shape[0]}")
+            return []
+        rows = np.asarray([i for i, rec in enumerate(self.records) if _matches(rec["metadata"], search_filter)])
+        if not len(rows):
+            return []
+        whole = len(rows) == len(self.records)
+        candidates = k * self.rescore_factor
+        if self.codes is not None and len(rows) > candidates:
+            codes = self.codes if whole else self.codes[rows]
+            scales = None if self.scales is None else (self.scales if whole else self.scales[rows])
+            approx = approximate_scores(codes, scales, query, self.mode)
+            rows = rows[np.argpartition(-approx, candidates - 1)[:candidates]]
+            rows.sort()
+            whole = False
+        vectors = self.vectors if whole else self.vectors[rows]
+        scores = vectors @ query
+        top = np.argsort(-scores)[:k]
+        return [(self.records[int(rows[i])], float(scores[i])) for i in top]
+
+
+class LocalVectorStore(VectorStore):
+    """Cosine search over per-conversation NumPy partitions on local disk.
+
+    Exact by default; with LOCAL_VECTOR_QUANTIZATION the scan runs on int8 or binary codes
+    and the best candidates are rescored at full precision.
+
+    Meant for small corpora (a few documents per conversation) and for running without
+    Pinecone. Scores are cosine similarities, like the Pinecone index.
+    """
+
+    def __init__(self, embedding, path=LOCAL_VECTOR_DIR, quantization=LOCAL_VECTOR_QUANTIZATION,
+                 rescore_factor=LOCAL_VECTOR_RESCORE_FACTOR):
+        self._embedding = embedding
+        self.path = path
+        self.quantization = None if quantization in (None, "", "none") else quantization
+        self.rescore_factor = rescore_factor
+        self._partitions = {}
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def _partition_dir(self, metadata):
+        return os.path.join(self.path, *(_safe_name(metadata.get(key)) for key in PARTITION_KEYS))
+
+    def _partition(self, directory):
+        part = self._partitions.get(directory)
+        if part is None:
+            part = self._partitions[directory] = _Partition(directory, self.quantization, self.rescore_factor)
+        part.refresh()
+        return part
+
+    def _candidate_partitions(self, search_filter):
+        search_filter = search_filter or {}
+        if all(isinstance(search_filter.get(key), str) for key in PARTITION_KEYS):
+            directory = self._partition_dir(search_filter)
+            return [self._partition(directory)] if os.path.isdir(directory) else []
+        partitions = []
+        for user_dir in os.listdir(self.path):
+            user_path = os.path.join(self.path, user_dir)
+            if os.path.isdir(user_path):
+                for conv_dir in os.listdir(user_path):
+                    partitions.append(self._partition(os.path.join(user_path, conv_dir)))
+        return partitions
+
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [hashlib.sha256(t.encode()).hexdigest() for t in texts]
+        vectors = _normalize(self._embedding.embed_documents(texts))
+
+        grouped = {}
+        for i, metadata in enumerate(metadatas):
+            grouped.setdefault(self._partition_dir(metadata), []).append(i)
+
+        with self._lock:
+            for directory, rows in grouped.items():
+                with self._partition(directory).locked() as part:
+                    new_ids = {ids[i] for i in rows}
+                    # upsert: a re-pushed id replaces its old row, as in Pinecone
+                    keep = [j for j, rec in enumerate(part.records) if rec["id"] not in new_ids]
+                    records = [part.records[j] for j in keep] + [
+                        {"id": ids[i], "text": texts[i], "metadata": metadatas[i]} for i in rows
+                    ]
+                    old = part.vectors[keep] if part.vectors is not None and keep else np.empty((0, vectors.shape[1]), np.float32)
+                    part.write(records, np.vstack([old, vectors[rows]]))
+        return ids
+
+    def delete(self, ids=None, filter=None, **kwargs):
+        if ids is None and not filter:
+            raise ValueError("delete needs ids or a filter")
+        id_set = set(ids) if ids is not None else None
+        with self._lock:
+            for candidate in self._candidate_partitions(filter):
+                with candidate.locked() as part:
+                    keep = [
+                        j for j, rec in enumerate(part.records)
+                        if not ((id_set is None or rec["id"] in id_set) and _matches(rec["metadata"], filter))
+                    ]
+                    if len(keep) == len(part.records):
+                        continue
+                    if keep:
+                        part.write([part.records[j] for j in keep], np.asarray(part.vectors[keep]))
+                    else:
+                        part.write([], np.empty((0, 0), np.float32))
+        return True
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        query = _normalize(embedding)
+        with self._lock:
+            hits = []
+            for part in self._candidate_partitions(filter):
+                hits.extend(part.search(query, k, filter))
+        hits.sort(key=lambda hit: -hit[1])
+        return [
+            (Document(id=rec["id"], page_content=rec["text"], metadata=dict(rec["metadata"])), score)
+            for rec, score in hits[:k]
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def wipe(self):
+        with self._lock:
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.makedirs(self.path, exist_ok=True)
+            self._partitions.clear()
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, *, ids=None, **kwargs):
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -0,0 +1,100 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from appwrite.query import Query
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_CACHE_MAX_CONVERSATIONS = int(os.getenv("MESSAGE_CACHE_MAX_CONVERSATIONS", "2000"))
+# messages kept per conversation, enough for the history budget to summarize the older ones
+MESSAGE_CACHE_DEPTH = int(os.getenv("MESSAGE_CACHE_DEPTH", "50"))
+
+_conversations = OrderedDict()  # conversation id -> _Conversation
+_lock = threading.Lock()
+
+
+class _Conversation:
+    def __init__(self):
+        self.persisted = OrderedDict()  # message id -> {"type", "content"}, as stored, oldest first
+        self.newest = None  # $createdAt of the newest stored message seen
+        # messages this process queued for saving that haven't shown up in the collection yet
+        self.pending = OrderedDict()
+
+
+def _message(doc):
+    # user messages carry the user's id as senderType
+    return {"type": "bot" if doc.get("senderType") == "bot" else "user", "content": doc.get("content", "")}
+
+
+def _fetch(conversation_id, newest):
+    """Stored messages oldest first: the latest MESSAGE_CACHE_DEPTH, or those created at or
+    after `newest` (ties are deduplicated by id)"""
+    from app import databases, db_id, msg_collection_id
+    queries = [Query.equal("conversationId", conversation_id)]
+    if newest is None:
+        queries += [Query.order_desc("$createdAt"), Query.limit(MESSAGE_CACHE_DEPTH)]
+    else:
+        queries += [Query.greater_than_equal("$createdAt", newest), Query.order_desc("$createdAt"),
+                    Query.limit(MESSAGE_CACHE_DEPTH)]
+    res = databases.list_documents(db_id, msg_collection_id, queries=queries)
+    return list(reversed(res.get("documents", [])))
+
+
+def _entry(conversation_id):
+    with _lock:
+        entry = _conversations.get(conversation_id)
+        if entry is None:
+            entry = _conversations[conversation_id] = _Conversation()
+        _conversations.move_to_end(conversation_id)
+        while len(_conversations) > MESSAGE_CACHE_MAX_CONVERSATIONS:
+            _conversations.popitem(last=False)
+        return entry
+
+
+def get_history(conversation_id, exclude_id=None):
+    """Prior messages of a conversation, oldest first.
+
+    Stored messages are cached per process, and every call merges in the ones stored since
+    (a small query on $createdAt), so turns served by other processes are never missing.
+    Messages this process queued but the write queue hasn't stored yet come last.
+    `exclude_id` leaves out the current turn's own message.
+    """
+    entry = _entry(conversation_id)
+    with _lock:
+        newest = entry.newest
+    docs = _fetch(conversation_id, newest)
+    with _lock:
+        if newest is None or len(docs) >= MESSAGE_CACHE_DEPTH:
+            # a full load, or so much is new that the query only reached back this far
+            entry.persisted.clear()
+        for doc in docs:
+            entry.persisted[doc["$id"]] = _message(doc)
+            if doc["$id"] in entry.pending:
+                # the write queue is FIFO: anything queued before this message is stored or failed
+                while entry.pending.popitem(last=False)[0] != doc["$id"]:
+                    pass
+            if entry.newest is None or doc["$createdAt"] > entry.newest:
+                entry.newest = doc["$createdAt"]
+        while len(entry.persisted) > MESSAGE_CACHE_DEPTH:
+            entry.persisted.popitem(last=False)
+        messages = [
+            message for message_id, message in [*entry.persisted.items(), *entry.pending.items()]
+            if message_id != exclude_id
+        ]
+    return messages[-MESSAGE_CACHE_DEPTH:]
+
+
+def record_message(conversation_id, message_id, message_type, content):
+    """Remember a message the route just queued for saving under `message_id`"""
+    entry = _entry(conversation_id)
+    with _lock:
+        if message_id not in entry.persisted:
+            entry.pending[message_id] = {"type": message_type, "content": content}
+            while len(entry.pending) > MESSAGE_CACHE_DEPTH:
+                entry.pending.popitem(last=False)
+
+
+def forget_messages(conversation_id):
+    with _lock:
+        _conversations.pop(conversation_id, None)
@@ -0,0 +1,43 @@
+import queue
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+_subscribers = defaultdict(set)
+_lock = threading.Lock()
+
+
+def subscribe(conversation_id):
+    """Register a listener for a conversation's ingestion events; returns its queue"""
+    q = queue.Queue(maxsize=1000)
+    with _lock:
+        _subscribers[conversation_id].add(q)
+    return q
+
+
+def unsubscribe(conversation_id, q):
+    with _lock:
+        listeners = _subscribers.get(conversation_id)
+        if listeners is not None:
+            listeners.discard(q)
+            if not listeners:
+                del _subscribers[conversation_id]
+
+
+def publish(conversation_id, event):
+    """Fan an event out to this process's listeners. Never blocks the ingestion worker."""
+    if not conversation_id:
+        return
+    with _lock:
+        listeners = list(_subscribers.get(conversation_id, ()))
+    for q in listeners:
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            logger.warning(f"Dropping progress event for slow listener on {conversation_id}")
+
+
+def publish_stage(conversation_id, document_id, stage, **extra):
+    publish(conversation_id, {"type": "stage", "documentId": document_id, "stage": stage, **extra})
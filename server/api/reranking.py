@@ -0,0 +1,119 @@
+import os
+import logging
+import importlib
+import threading
+import numpy as np
+
+from .lexical_index import tokenize
+from .text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# "mmr" (default), "none" or "package.module:Class" with rerank(query, docs) -> docs
+RERANKER = os.getenv("RERANKER", "mmr")
+# 1.0 ranks on relevance alone, lower values trade relevance for covering more distinct passages
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# prompt budget for retrieved context; about five 800-character chunks
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+
+_reranker = None
+_lock = threading.Lock()
+
+
+def _chunk_vectors(docs):
+    """Unit vectors of candidate chunks from the embedding cache, keyed by chunk hash; no API calls or writes"""
+    from .vector_store import get_embedding_function
+    try:
+        embeddings = get_embedding_function()
+        # read-only: this runs on every chat, and ingestion already keeps these vectors recent
+        found = embeddings.cache.get_many(
+            embeddings.model_name, [doc.metadata["chunk_hash"] for doc in docs if doc.metadata.get("chunk_hash")],
+            touch=False,
+        )
+    except Exception as exc:
+        logger.warning(f"Chunk vectors unavailable for re-ranking: {exc}")
+        return {}
+    vectors = {}
+    for chunk_hash, vector in found.items():
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        vectors[chunk_hash] = v / norm if norm else v
+    return vectors
+
+
+class MMRReranker:
+    """Maximal marginal relevance over the fused candidates.
+
+    Relevance mixes the candidate's fused rank with how many query terms it contains.
+    Redundancy is cosine similarity of cached chunk vectors, or term overlap for a chunk
+    whose vector isn't cached.
+    """
+
+    def __init__(self, lambda_=MMR_LAMBDA):
+        self.lambda_ = lambda_
+
+    def rerank(self, query, docs):
+        if len(docs) < 2:
+            return list(docs)
+        query_terms = set(tokenize(query))
+        terms = [set(tokenize(doc.page_content)) for doc in docs]
+        vectors = _chunk_vectors(docs)
+        keys = [doc.metadata.get("chunk_hash") for doc in docs]
+
+        n = len(docs)
+        relevance = []
+        for rank, doc_terms in enumerate(terms):
+            coverage = len(query_terms & doc_terms) / len(query_terms) if query_terms else 0.0
+            relevance.append(0.5 * (1 - rank / n) + 0.5 * coverage)
+
+        def similarity(i, j):
+            if keys[i] in vectors and keys[j] in vectors:
+                return float(vectors[keys[i]] @ vectors[keys[j]])
+            union = terms[i] | terms[j]
+            return len(terms[i] & terms[j]) / len(union) if union else 0.0
+
+        selected = []
+        remaining = list(range(n))
+        max_sim = [0.0] * n
+        while remaining:
+            best = max(remaining, key=lambda i: self.lambda_ * relevance[i] - (1 - self.lambda_) * max_sim[i])
+            selected.append(best)
+            remaining.remove(best)
+            for i in remaining:
+                max_sim[i] = max(max_sim[i], similarity(i, best))
+        return [docs[i] for i in selected]
+
+
+class NoReranker:
+    def rerank(self, query, docs):
+        return list(docs)
+
+
+_RERANKERS = {"mmr": MMRReranker, "none": NoReranker}
+
+
+def get_reranker():
+    global _reranker
+    if _reranker is None:
+        with _lock:
+            if _reranker is None:
+                if RERANKER in _RERANKERS:
+                    _reranker = _RERANKERS[RERANKER]()
+                else:
+                    module_name, _, class_name = RERANKER.partition(":")
+                    _reranker = getattr(importlib.import_module(module_name), class_name)()
+                logging.info(f"Retrieval re-ranker: {type(_reranker).__name__}")
+    return _reranker
+
+
+def pack_to_budget(docs, budget=CONTEXT_TOKEN_BUDGET):
+    """Best-first chunks that fit the prompt budget; always at least one"""
+    packed = []
+    used = 0
+    for doc in docs:
+        cost = estimate_tokens(doc.page_content)
+        if packed and used + cost > budget:
+            continue
+        packed.append(doc)
+        used += cost
+    return packed
@@ -1,60 +1,233 @@
 import logging
 import os
+import time
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from appwrite.query import Query
+from appwrite.exception import AppwriteException
 
 from .vector_store import get_vector_store
+from .storage import delete_upload
+from .answer_cache import invalidate_answers
+from .lexical_index import get_lexical_index
 from .appwrite_utils import DOC_COMPLETED, DOC_FAILED, rel_id
+from .write_queue import enqueue_write
 
 DOCS_KEEP = int(os.getenv("DOCS_KEEP_PER_USER", "3"))
 DOCS_MAX_AGE_DAYS = int(os.getenv("DOCS_MAX_AGE_DAYS", "10"))
 CHUNK_CAP = int(os.getenv("CHUNK_CAP_PER_USER", "800"))
+# bursts of uploads and finished jobs for one user collapse into a single run after this delay
+RETENTION_DEBOUNCE_SECONDS = float(os.getenv("RETENTION_DEBOUNCE_SECONDS", "2"))
+# ledgers are per process: they follow this process's ingests, prunes and retrieval hits, and are
+# re-read from Appwrite after this long to pick up other processes' changes
+RETENTION_LEDGER_TTL = int(os.getenv("RETENTION_LEDGER_TTL_SECONDS", "300"))
+# retrieval hits refresh a document's lastUsedAt in Appwrite at most this often
+LAST_USED_WRITE_SECONDS = int(os.getenv("LAST_USED_WRITE_SECONDS", "3600"))
+LAST_USED_WRITES_MAX = 10000
+LEDGER_PAGE_SIZE = 100
 
+_ledgers = {}  # users doc id -> _UserLedger
+_ledgers_lock = threading.Lock()
+_scheduled = set()  # users with an enforcement pending
+_scheduled_lock = threading.Lock()
+_last_used_written = OrderedDict()  # doc id -> time.time() of the last lastUsedAt write
+_last_used_lock = threading.Lock()
 
-def enforce_retention_for_user(user_id):
+
+def _recency(doc):
+    """When the document was last used, or created if it never was"""
+    return doc.get('lastUsedAt') or doc.get('$createdAt', '')
+
+
+class _UserLedger:
+    """A user's completed documents, least recently used (or created) first, with a running chunk total"""
+
+    def __init__(self, docs):
+        self.loaded_at = time.time()
+        self.lock = threading.Lock()
+        self.docs = OrderedDict()  # doc id -> doc record, ordered by _recency
+        self.total_chunks = 0
+        self.pruning = set()  # doc ids handed to prune_document and not yet finished
+        for doc in sorted(docs, key=_recency):
+            self.add(doc)
+
+    def add(self, doc):
+        if doc['$id'] in self.docs:
+            self.remove(doc['$id'])
+        recency = _recency(doc)
+        self.docs[doc['$id']] = doc
+        self.total_chunks += doc.get('chunkCount', 0)
+        # documents arrive in roughly recency order; only a late one needs moving back
+        later = []
+        for other_id in reversed(list(self.docs)[:-1]):
+            if _recency(self.docs[other_id]) <= recency:
+                break
+            later.append(other_id)
+        for other_id in reversed(later):
+            self.docs.move_to_end(other_id)
+
+    def touch(self, doc_id, used_iso):
+        doc = self.docs.get(doc_id)
+        if doc is not None:
+            doc['lastUsedAt'] = used_iso
+            self.docs.move_to_end(doc_id)
+
+    def remove(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is not None:
+            self.total_chunks -= doc.get('chunkCount', 0)
+
+    def evictions(self, cutoff_iso):
+        """Docs to prune, least recently used first: beyond the newest DOCS_KEEP, unused since
+        the age limit, or while the chunk total is over CHUNK_CAP. Costs O(evictions).
+
+        Nothing is removed here; prune_document drops a doc once it is actually pruned, so a
+        failed prune is retried by the next run. Docs already being pruned count as gone but
+        aren't returned again."""
+        evicted = []
+        remaining = len(self.docs)
+        total_chunks = self.total_chunks
+        for doc in self.docs.values():
+            if not (remaining > DOCS_KEEP or _recency(doc) < cutoff_iso or total_chunks > CHUNK_CAP):
+                break
+            remaining -= 1
+            total_chunks -= doc.get('chunkCount', 0)
+            if doc['$id'] not in self.pruning:
+                evicted.append(doc)
+        return evicted
+
+
+def _load_ledger(user_id):
+    from app import databases, db_id, docs_collection_id
+    docs = []
+    while True:
+        queries = [Query.equal('userId', user_id), Query.equal('status', DOC_COMPLETED),
+                   Query.limit(LEDGER_PAGE_SIZE)]
+        if docs:
+            queries.append(Query.cursor_after(docs[-1]['$id']))
+        page = databases.list_documents(db_id, docs_collection_id, queries=queries).get('documents', [])
+        docs.extend(page)
+        if len(page) < LEDGER_PAGE_SIZE:
+            return _UserLedger(docs)
+
+
+def _get_ledger(user_id):
+    with _ledgers_lock:
+        ledger = _ledgers.get(user_id)
+    if ledger is not None and time.time() - ledger.loaded_at < RETENTION_LEDGER_TTL:
+        return ledger
+    ledger = _load_ledger(user_id)
+    with _ledgers_lock:
+        _ledgers[user_id] = ledger
+    return ledger
+
+
+def record_ingested(user_id, doc_record):
+    """Add a newly completed document to this process's ledger for the user, if one is loaded"""
+    with _ledgers_lock:
+        ledger = _ledgers.get(user_id)
+    if ledger is not None:
+        with ledger.lock:
+            ledger.add(doc_record)
+
+
+def _write_last_used(doc_id, used_iso):
     from app import databases, db_id, docs_collection_id
     try:
-        docs_res = databases.list_documents(
-            db_id, docs_collection_id,
-            queries=[Query.equal('userId', user_id), Query.equal('status', DOC_COMPLETED),
-                     Query.order_desc('$createdAt'), Query.limit(100)]
-        )
-        docs = docs_res.get('documents', [])
-        if not docs:
-            return
+        databases.update_document(db_id, docs_collection_id, doc_id, {'lastUsedAt': used_iso})
+    except AppwriteException as exc:
+        # pruned or deleted since it was retrieved
+        if exc.code != 404:
+            raise
+
+
+def record_used(user_id, doc_ids):
+    """Mark documents that just answered a prompt as recently used, so retention evicts them last"""
+    used_iso = datetime.now().isoformat()
+    with _ledgers_lock:
+        ledger = _ledgers.get(user_id)
+    if ledger is not None:
+        with ledger.lock:
+            for doc_id in doc_ids:
+                ledger.touch(doc_id, used_iso)
+    now = time.time()
+    due = []
+    with _last_used_lock:
+        for doc_id in doc_ids:
+            if now - _last_used_written.get(doc_id, 0) >= LAST_USED_WRITE_SECONDS:
+                _last_used_written[doc_id] = now
+                _last_used_written.move_to_end(doc_id)
+                due.append(doc_id)
+        while len(_last_used_written) > LAST_USED_WRITES_MAX:
+            _last_used_written.popitem(last=False)
+    # persisted so reloaded ledgers and other processes see the same order
+    for doc_id in due:
+        enqueue_write(doc_id, _write_last_used, doc_id, used_iso)
+
+
+def forget_documents(doc_ids):
+    """Drop documents removed outside prune_document (e.g. a deleted conversation)"""
+    with _ledgers_lock:
+        ledgers = list(_ledgers.values())
+    for ledger in ledgers:
+        with ledger.lock:
+            for doc_id in doc_ids:
+                ledger.remove(doc_id)
 
-        # recent docs are kept
-        keep_ids = {doc['$id'] for doc in docs[:DOCS_KEEP]}
-
-        cutoff = datetime.now() - timedelta(days=DOCS_MAX_AGE_DAYS)
-        cutoff_iso = cutoff.isoformat()
-
-        total_chunks = 0
-        docs_to_prune = []
-        for doc in docs:
-            total_chunks += doc.get('chunkCount', 0)
-            created_ts = doc.get('$createdAt', '')
-            if doc['$id'] not in keep_ids:
-                docs_to_prune.append(doc)
-            elif created_ts < cutoff_iso:
-                docs_to_prune.append(doc)
-
-        # Prune oldest 
-        if total_chunks > CHUNK_CAP:
-            sorted_old = sorted(docs, key=lambda d: d.get('$createdAt', ''))
-            for doc in sorted_old:
-                if total_chunks <= CHUNK_CAP:
-                    break
-                if doc not in docs_to_prune:
-                    docs_to_prune.append(doc)
-                total_chunks -= doc.get('chunkCount', 0)
-
-        for doc in docs_to_prune:
-            prune_document(doc, reason="retention")
+
+def _enforce_now(user_id):
+    with _scheduled_lock:
+        _scheduled.discard(user_id)
+    try:
+        ledger = _get_ledger(user_id)
+        cutoff_iso = (datetime.now() - timedelta(days=DOCS_MAX_AGE_DAYS)).isoformat()
+        with ledger.lock:
+            evicted = ledger.evictions(cutoff_iso)
+            ledger.pruning.update(doc['$id'] for doc in evicted)
+        try:
+            for doc in evicted:
+                prune_document(doc, reason="retention")
+        finally:
+            with ledger.lock:
+                ledger.pruning.difference_update(doc['$id'] for doc in evicted)
     except Exception as exc:
         logging.error(f"Retention enforcement failed for user {user_id}: {exc}")
 
 
+def enforce_retention_for_user(user_id):
+    """Schedule retention for a user. Calls within RETENTION_DEBOUNCE_SECONDS of each other
+    (an upload of several files, a burst of finished jobs) coalesce into one run."""
+    with _scheduled_lock:
+        if user_id in _scheduled:
+            return
+        _scheduled.add(user_id)
+    timer = threading.Timer(RETENTION_DEBOUNCE_SECONDS, _enforce_now, args=(user_id,))
+    timer.daemon = True
+    timer.start()
+
+
+def _vector_filter(doc_record):
+    """Filter for a document's vectors, naming its partition (auth user id and conversation) when known"""
+    from app import databases, db_id, conv_collection_id
+    vector_filter = {'document_id': doc_record['$id']}
+    conv = doc_record.get('conversationId')
+    conversation_id = rel_id(conv)
+    if not conversation_id:
+        return vector_filter
+    vector_filter['conversation_id'] = conversation_id
+    owner = conv.get('userId') if isinstance(conv, dict) else None
+    if owner is None:
+        try:
+            owner = databases.get_document(db_id, conv_collection_id, conversation_id).get('userId')
+        except AppwriteException as exc:
+            if exc.code != 404:
+                raise
+    if owner:
+        vector_filter['user_id'] = rel_id(owner)
+    return vector_filter
+
+
 def prune_document(doc_record, reason="manual"):
     """Delete vectors for a document and mark it pruned in DB"""
     from app import databases, db_id, docs_collection_id, chunks_collection_id
@@ -62,7 +235,7 @@ def prune_document(doc_record, reason="manual"):
     user_id = rel_id(doc_record.get('userId'))
     try:
         store = get_vector_store()
-        store.delete(filter={'document_id': doc_id})        
+        store.delete(filter=_vector_filter(doc_record))
         chunks_res = databases.list_documents(
             db_id, chunks_collection_id,
             queries=[Query.equal('documentId', doc_id), Query.limit(5000)]
@@ -74,6 +247,16 @@ def prune_document(doc_record, reason="manual"):
             db_id, docs_collection_id, doc_id,
             {'status': DOC_FAILED}
         )
+        delete_upload(doc_id)
+        invalidate_answers(file_hash=doc_record.get('fileHash'))
+        conversation_id = rel_id(doc_record.get('conversationId'))
+        if conversation_id:
+            get_lexical_index().remove_document(conversation_id, doc_id)
+        with _ledgers_lock:
+            ledger = _ledgers.get(user_id)
+        if ledger is not None:
+            with ledger.lock:
+                ledger.remove(doc_id)
         logging.info(f"Pruned document {doc_id} for user {user_id} ({reason})")
     except Exception as exc:
         logging.error(f"Failed to prune document {doc_id}: {exc}")
@@ -0,0 +1,92 @@
+import os
+import logging
+
+from .vector_store import get_vector_store
+from .lexical_index import get_lexical_index
+from .reranking import get_reranker, pack_to_budget
+from .retention import record_used
+from .appwrite_utils import get_or_create_user_document_id
+
+logger = logging.getLogger(__name__)
+
+# candidates fetched from each retriever before re-ranking; only the packed ones reach the prompt
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "30"))
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+# standard reciprocal-rank-fusion constant; damps the gap between the first few ranks
+RRF_K = 60
+
+
+def _dense_search(user_prompt, user_id, conversation_id, k):
+    search_filter = {"user_id": user_id, "conversation_id": conversation_id}
+    store = get_vector_store()
+    results = store.similarity_search_with_score(user_prompt, k=k, filter=search_filter)
+    docs = []
+    for doc, score in results:
+        # kept on the chunk so the chat stream can tell weak matches apart
+        doc.metadata["score"] = float(score)
+        docs.append(doc)
+    return docs
+
+
+def reciprocal_rank_fusion(result_lists, k):
+    """Merge ranked lists of chunks by sum of 1 / (RRF_K + rank), keyed by chunk hash"""
+    fused = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = doc.metadata.get("chunk_hash") or doc.page_content
+            fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+            # the dense copy carries the similarity score, keep it when a chunk is in both lists
+            docs.setdefault(key, doc)
+    ranked = sorted(fused, key=lambda key: -fused[key])[:k]
+    return [docs[key] for key in ranked]
+
+
+def _candidates(user_prompt, user_id, conversation_id):
+    try:
+        dense = _dense_search(user_prompt, user_id, conversation_id, RETRIEVAL_CANDIDATES)
+    except Exception as e:
+        logger.error(f"Vector retrieval failed: {e}")
+        dense = []
+    if not HYBRID_RETRIEVAL:
+        return dense
+
+    try:
+        from app import databases, db_id, users_collection_id
+        # lexical chunks are owned by the Users document, like the documents they came from
+        owner = get_or_create_user_document_id(databases, db_id, users_collection_id, user_id)
+        lexical = get_lexical_index().search(conversation_id, owner, user_prompt, RETRIEVAL_CANDIDATES)
+    except Exception as e:
+        logger.error(f"Lexical retrieval failed: {e}")
+        return dense
+    return reciprocal_rank_fusion([dense, lexical], RETRIEVAL_CANDIDATES)
+
+
+def retrieve_context(user_prompt, user_id, conversation_id):
+    """Chunks from the conversation's indexed documents most relevant to the prompt.
+
+    Over-fetches candidates, re-ranks them locally and keeps what fits the context budget,
+    so the prompt stays the same size however many candidates were considered.
+    """
+    candidates = _candidates(user_prompt, user_id, conversation_id)
+    try:
+        ranked = get_reranker().rerank(user_prompt, candidates)
+    except Exception as e:
+        logger.error(f"Re-ranking failed, using fused order: {e}")
+        ranked = candidates
+    packed = pack_to_budget(ranked)
+    _record_hits(user_id, packed)
+    return packed
+
+
+def _record_hits(user_id, docs):
+    doc_ids = {doc.metadata.get("document_id") for doc in docs} - {None}
+    if not doc_ids:
+        return
+    try:
+        from app import databases, db_id, users_collection_id
+        # retention ledgers are keyed by the Users document, like the documents they hold
+        owner = get_or_create_user_document_id(databases, db_id, users_collection_id, user_id)
+        record_used(owner, doc_ids)
+    except Exception as e:
+        logger.warning(f"Recording document use failed: {e}")
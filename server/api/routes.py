@@ -2,24 +2,30 @@ from flask import Blueprint, request, jsonify, Response
 import json
 import logging
 import os
+import queue
 import shutil
+import time
 from datetime import datetime
 from appwrite.id import ID
 from appwrite.query import Query
+from appwrite.exception import AppwriteException
 
 from .auth import auth_required
-from .documents import (
-    load_documents,
-    split_documents,
-    calculate_chunk_ids,
-    prioritize_chunks,
-    compute_sha256_from_stream,
-    build_chunk_records,
-)
-from .vector_store import get_vector_store, reset_vector_store
-from .ai_service import generate_rag_response, generate_fallback_response, save_message_to_db
+from .documents import compute_sha256_from_stream
+from .vector_store import reset_vector_store
+from .ai_service import save_message_to_db
+from .answer_stream import stream_answer
+from .answer_cache import lookup_answer, store_answer, invalidate_answers
 from .user_service import get_user_prompt_limit, create_conversation, update_conversation_timestamp
 from .retention import enforce_retention_for_user, prune_document
+from .storage import save_upload
+from .job_signals import notify_jobs_available
+from .progress import subscribe, unsubscribe, publish_stage
+from .chat_prelude import run_chat_prelude
+from .retrieval import retrieve_context
+from .message_cache import record_message, forget_messages
+from .conversation_deletion import mark_deleted, schedule_deletion, get_deletion_progress
+from .write_queue import enqueue_write
 from .appwrite_utils import (
     get_or_create_user_document_id,
     rel_id,
@@ -34,7 +40,10 @@ logger = logging.getLogger(__name__)
 api = Blueprint("api", __name__)
 
 MAX_FILE_BYTES = int(os.getenv("MAX_FILE_BYTES", str(5 * 1024 * 1024)))  # 5MB default
-MAX_CHUNKS = int(os.getenv("MAX_CHUNKS_PER_DOC", "70"))
+PROGRESS_KEEPALIVE_SECONDS = 5
+PROGRESS_REFRESH_SECONDS = 15
+# each stream holds a worker, so streams are short and the client reconnects until a verdict
+PROGRESS_STREAM_MAX_SECONDS = int(os.getenv("PROGRESS_STREAM_MAX_SECONDS", "60"))
 
 
 def require_admin():
@@ -43,11 +52,28 @@ def require_admin():
     return bool(expected and token == expected)
 
 
+def owned_conversation(user, conversation_id):
+    """(conversation, None) if the user owns it and it isn't being deleted, else (None, error response)"""
+    from app import databases, db_id, conv_collection_id
+
+    try:
+        conv = databases.get_document(db_id, conv_collection_id, conversation_id)
+    except AppwriteException as e:
+        if e.code == 404:
+            return None, (jsonify({"error": "Conversation not found"}), 404)
+        raise
+    if rel_id(conv.get("userId")) != user["$id"]:
+        return None, (jsonify({"error": "Unauthorized"}), 403)
+    if conv.get("deletedAt"):
+        return None, (jsonify({"error": "Conversation not found"}), 404)
+    return conv, None
+
+
 def create_ingestion_job(user_id, document_id, conversation_id, file_hash):
     """Persist ingestion job so worker can resume after restart."""
     from app import databases, db_id, jobs_collection_id
 
-    return databases.create_document(
+    job = databases.create_document(
         db_id,
         jobs_collection_id,
         ID.unique(),
@@ -61,6 +87,8 @@ def create_ingestion_job(user_id, document_id, conversation_id, file_hash):
             "errorMessage": "",
         },
     )
+    notify_jobs_available()
+    return job
 
 
 @api.route("/health", methods=["GET"])
@@ -102,7 +130,8 @@ def get_conversations(user):
             conv_collection_id,
             queries=[Query.equal("userId", user["$id"]), Query.order_desc("$createdAt")],
         )
-        return jsonify(result["documents"])
+        # conversations still being wiped in the background are already gone for the user
+        return jsonify([conv for conv in result["documents"] if not conv.get("deletedAt")])
     except Exception as e:
         logger.error(f"Error fetching conversations: {e}")
         return jsonify({"error": str(e)}), 500
@@ -118,6 +147,8 @@ def get_messages(user, conversation_id):
         convo = databases.get_document(db_id, conv_collection_id, conversation_id)
         if convo["userId"] != user["$id"]:
             return jsonify({"error": "Unauthorized"}), 403
+        if convo.get("deletedAt"):
+            return jsonify({"error": "Conversation not found"}), 404
 
         result = databases.list_documents(
             db_id,
@@ -133,9 +164,9 @@ def get_messages(user, conversation_id):
 @api.route("/conversations/<conversation_id>", methods=["DELETE"])
 @auth_required
 def delete_conversation(user, conversation_id):
-    from app import databases, db_id, conv_collection_id, msg_collection_id, docs_collection_id, chunks_collection_id, jobs_collection_id
-    from .vector_store import get_vector_store
-    
+    """Hide the conversation right away and wipe its data in the background"""
+    from app import databases, db_id, conv_collection_id
+
     try:
         conv = databases.get_document(db_id, conv_collection_id, conversation_id)
         if rel_id(conv.get('userId')) != user['$id']:
@@ -144,40 +175,40 @@ def delete_conversation(user, conversation_id):
     except Exception:
         return jsonify({"error": "Conversation not found"}), 404
 
-    #delete pinecone vectors first
+    invalidate_answers(conversation_id=conversation_id)
+    forget_messages(conversation_id)
+
     try:
-        store = get_vector_store()
-        logger.info(f"Vector store retrieved")
-        store.delete(filter={'conversation_id': conversation_id})
+        if not conv.get('deletedAt'):
+            mark_deleted(conversation_id)
     except Exception as e:
-        logger.warning(f"Failed to delete Pinecone vectors for {conversation_id}: {e}")
+        # without the flag a crash mid-wipe isn't resumed, but the wipe itself still runs
+        logger.warning(f"Could not flag conversation {conversation_id} as deleted: {e}")
+    schedule_deletion(conversation_id)
+    return jsonify({"success": True, "status": "deleting", "conversationId": conversation_id}), 202
 
-    def wipe_collection(collection_id):
-        while True:
-            res = databases.list_documents(
-                db_id, collection_id,
-                queries=[Query.equal('conversationId', conversation_id), Query.limit(100)]
-            )
-            docs = res.get('documents', [])
-            if not docs:
-                break
-            for d in docs:
-                databases.delete_document(db_id, collection_id, d['$id'])
 
-    try:
-        wipe_collection(chunks_collection_id)
-        wipe_collection(jobs_collection_id)
-        wipe_collection(docs_collection_id)
-        wipe_collection(msg_collection_id)
-    except Exception as e:
-        logger.error(f"Failed cleaning child collections for conv {conversation_id}: {e}")
+@api.route("/conversations/<conversation_id>/deletion", methods=["GET"])
+@auth_required
+def conversation_deletion_status(user, conversation_id):
+    """Progress of a background conversation wipe"""
+    from app import databases, db_id, conv_collection_id
 
+    progress = get_deletion_progress(conversation_id)
     try:
-        databases.delete_document(db_id, conv_collection_id, conversation_id)
-        return jsonify({"success": True, "message": "Conversation and all orphans wiped completely"})
-    except Exception as e:
-        logger.error(f"Error deleting conversation: {e}")
+        conv = databases.get_document(db_id, conv_collection_id, conversation_id)
+    except AppwriteException as e:
+        if e.code == 404:
+            # gone: either finished here or in another process
+            return jsonify({"status": "deleted", **(progress or {})})
+        logger.error(f"Error checking conversation {conversation_id}: {e}")
         return jsonify({"error": str(e)}), 500
+    if rel_id(conv.get('userId')) != user['$id']:
+        return jsonify({"error": "Unauthorized"}), 403
+    if progress is None:
+        status = "pending" if conv.get('deletedAt') else "not_deleted"
+        return jsonify({"status": status})
+    return jsonify(progress)
 
 @api.route("/documents/upload", methods=["POST"])
 @auth_required
@@ -188,7 +219,6 @@ def upload_documents(user):
         db_id,
         conv_collection_id,
         docs_collection_id,
-        chunks_collection_id,
         users_collection_id,
     )
 
@@ -221,6 +251,10 @@ def upload_documents(user):
             databases, db_id, conv_collection_id, user["$id"], user_question or "Document Upload"
         )
     else:
+        # also refuses conversations being wiped, whose new documents would be left orphaned
+        _, error = owned_conversation(user, conversation_id)
+        if error:
+            return error
         update_conversation_timestamp(databases, db_id, conv_collection_id, conversation_id)
 
     responses = []
@@ -239,20 +273,6 @@ def upload_documents(user):
             responses.append({"filename": file.filename, "status": "skipped_duplicate"})
             continue
 
-        documents = load_documents([file])
-        chunks = split_documents(documents)
-        if not chunks:
-            return jsonify({"error": f"{file.filename} contained no extractable text"}), 400
-        if len(chunks) > MAX_CHUNKS:
-            return jsonify({"error": f"Too many chunks ({len(chunks)}) - please upload a smaller file"}), 400
-
-        for chunk in chunks:
-            chunk.metadata["user_id"] = user["$id"]
-            chunk.metadata["conversation_id"] = conversation_id
-
-        chunks_with_ids = calculate_chunk_ids(chunks)
-        sorted_chunks = prioritize_chunks(chunks_with_ids, user_question)
-
         now_iso = datetime.now().isoformat()
         doc_record = databases.create_document(
             db_id,
@@ -265,22 +285,21 @@ def upload_documents(user):
                 "fileName": file.filename,
                 "lastUsedAt": now_iso,
                 "status": DOC_PENDING,
-                "chunkCount": len(sorted_chunks),
+                "chunkCount": 0,
             },
         )
 
-        chunk_records = build_chunk_records(
-            sorted_chunks, file_hash, users_doc_id, conversation_id, doc_record["$id"]
-        )
-        for rec in chunk_records:
-            databases.create_document(
-                db_id,
-                chunks_collection_id,
-                ID.unique(),
-                rec,
-            )
+        # extraction, OCR and chunking happen in the ingestion worker
+        try:
+            save_upload(file, doc_record["$id"])
+        except Exception as e:
+            logger.error(f"Failed to store upload {file.filename}: {e}")
+            databases.update_document(db_id, docs_collection_id, doc_record["$id"], {"status": DOC_FAILED})
+            responses.append({"filename": file.filename, "status": "failed"})
+            continue
 
         create_ingestion_job(users_doc_id, doc_record["$id"], conversation_id, file_hash)
+        publish_stage(conversation_id, doc_record["$id"], "queued", fileName=file.filename)
         responses.append({"filename": file.filename, "status": "queued"})
 
     enforce_retention_for_user(users_doc_id)
@@ -297,65 +316,135 @@ def upload_documents(user):
     )
 
 
+def _list_conversation_documents(conversation_id):
+    from app import databases, db_id, docs_collection_id
+
+    docs_res = databases.list_documents(
+        db_id,
+        docs_collection_id,
+        queries=[
+            Query.equal("conversationId", conversation_id),
+            Query.limit(100),
+        ],
+    )
+    return docs_res.get("documents", [])
+
+
+def _ingestion_summary(statuses):
+    """statuses is a list of document status values"""
+    if not statuses:
+        return {"ready": False, "pending": 0, "failed": 0, "total": 0}
+    pending = sum(1 for s in statuses if s in (DOC_PENDING, DOC_PROCESSING))
+    failed = sum(1 for s in statuses if s == DOC_FAILED)
+    ready = pending == 0 and failed == 0 and all(s == DOC_COMPLETED for s in statuses)
+    return {"ready": ready, "pending": pending, "failed": failed, "total": len(statuses)}
+
+
 @api.route("/documents/status", methods=["GET"])
 @auth_required
 def documents_ingestion_status(user):
     """Poll whether documents for a conversation finished background ingestion."""
-    from app import databases, db_id, docs_collection_id
-
     conversation_id = request.args.get("conversationId")
     if not conversation_id:
         return jsonify({"error": "conversationId is required"}), 400
 
     try:
-        docs_res = databases.list_documents(
-            db_id,
-            docs_collection_id,
-            queries=[
-                Query.equal("conversationId", conversation_id),
-                Query.limit(100),
-            ],
-        )
-        docs = docs_res.get("documents", [])
-        if not docs:
-            return jsonify({"ready": False, "pending": 0, "failed": 0, "total": 0}), 200
+        _, error = owned_conversation(user, conversation_id)
+        if error:
+            return error
+        docs = _list_conversation_documents(conversation_id)
+        return jsonify(_ingestion_summary([doc.get("status") for doc in docs])), 200
+    except Exception as e:
+        logger.error(f"Error checking document status: {e}")
+        return jsonify({"error": str(e)}), 500
 
-        statuses = [doc.get("status") for doc in docs]
-        pending = sum(1 for s in statuses if s in (DOC_PENDING, DOC_PROCESSING))
-        failed = sum(1 for s in statuses if s == DOC_FAILED)
-        ready = pending == 0 and failed == 0 and all(s == DOC_COMPLETED for s in statuses)
 
-        return jsonify(
-            {
-                "ready": ready,
-                "pending": pending,
-                "failed": failed,
-                "total": len(docs),
-            }
-        ), 200
+@api.route("/documents/progress", methods=["GET"])
+@auth_required
+def documents_ingestion_progress(user):
+    """Stream ingestion stage and batch events for a conversation as NDJSON until every document settles."""
+    conversation_id = request.args.get("conversationId")
+    if not conversation_id:
+        return jsonify({"error": "conversationId is required"}), 400
+
+    try:
+        _, error = owned_conversation(user, conversation_id)
     except Exception as e:
-        logger.error(f"Error checking document status: {e}")
+        logger.error(f"Error checking conversation for progress stream: {e}")
+        return jsonify({"error": str(e)}), 500
+    if error:
+        return error
+
+    # subscribe before the snapshot so nothing published in between is lost
+    events = subscribe(conversation_id)
+    try:
+        docs = _list_conversation_documents(conversation_id)
+    except Exception as e:
+        unsubscribe(conversation_id, events)
+        logger.error(f"Error loading documents for progress stream: {e}")
         return jsonify({"error": str(e)}), 500
 
+    def generate_progress():
+        statuses = {doc["$id"]: doc.get("status") for doc in docs}
+        started = time.monotonic()
+        last_refresh = started
+        try:
+            yield json.dumps({
+                "type": "snapshot",
+                "documents": [
+                    {"documentId": doc["$id"], "fileName": doc.get("fileName"), "status": doc.get("status")}
+                    for doc in docs
+                ],
+                **_ingestion_summary(list(statuses.values())),
+            }) + "\n"
+
+            expired = False
+            while statuses and any(s in (DOC_PENDING, DOC_PROCESSING) for s in statuses.values()):
+                if time.monotonic() - started > PROGRESS_STREAM_MAX_SECONDS:
+                    expired = True
+                    break
+                try:
+                    event = events.get(timeout=PROGRESS_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    event = None
+
+                if event is not None:
+                    if event.get("type") == "stage" and event.get("stage") in (DOC_COMPLETED, DOC_FAILED):
+                        statuses[event["documentId"]] = event["stage"]
+                    elif event.get("type") == "stage" and event.get("stage") == "queued":
+                        statuses[event["documentId"]] = DOC_PENDING
+                    yield json.dumps(event) + "\n"
+                elif time.monotonic() - last_refresh >= PROGRESS_REFRESH_SECONDS:
+                    # jobs picked up by another process don't publish here, so re-check now and then
+                    last_refresh = time.monotonic()
+                    statuses.update({doc["$id"]: doc.get("status") for doc in _list_conversation_documents(conversation_id)})
+                else:
+                    yield json.dumps({"type": "ping"}) + "\n"
+
+            yield json.dumps({
+                "type": "done", "reconnect": expired, **_ingestion_summary(list(statuses.values()))
+            }) + "\n"
+        except Exception as e:
+            logger.error(f"Progress stream failed for {conversation_id}: {e}")
+            yield json.dumps({"type": "error", "content": str(e)}) + "\n"
+        finally:
+            unsubscribe(conversation_id, events)
+
+    response = Response(generate_progress(), mimetype="application/x-ndjson")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 
 @api.route("/prompt/text-file", methods=["POST"])
 @auth_required
 def process_documents_without_voice(user):
     """Chat route; no ingestion occurs here."""
-    from app import databases, db_id, msg_collection_id, conv_collection_id, user_limits_collection_id, docs_collection_id, users_collection_id
+    from app import databases, db_id, msg_collection_id
 
-    user_id = user["$id"]
     user_prompt = request.form.get("prompt")
     files = request.files.getlist("file")
     conversation_id = request.form.get("conversationId")
-    history_str = request.form.get("history", "[]")
-
-    users_doc_id = get_or_create_user_document_id(databases, db_id, users_collection_id, user_id, user.get("email"))
-
-    try:
-        history = json.loads(history_str)
-    except json.JSONDecodeError:
-        history = []
 
     if files:
         return jsonify({"error": "Uploads must be sent to /api/documents/upload"}), 400
@@ -363,77 +452,50 @@ def process_documents_without_voice(user):
     if not user_prompt:
         return jsonify({"error": "Missing question argument"}), 400
 
-    prompts_remaining, max_prompts = get_user_prompt_limit(
-        databases, db_id, user_limits_collection_id, user_id
-    )
-
-    if prompts_remaining <= 0:
+    prelude = run_chat_prelude(user, user_prompt, conversation_id, retrieve_context)
+    if prelude.error_status == 403:
+        return jsonify({"error": "Unauthorized"}), 403
+    if prelude.error_status:
+        return jsonify({"error": "Conversation not found"}), prelude.error_status
+    if prelude.limit_reached:
         return jsonify(
-            {"error": f"Daily prompt limit of {max_prompts} reached. Please try again tomorrow."}
+            {"error": f"Daily prompt limit of {prelude.max_prompts} reached. Please try again tomorrow."}
         ), 429
 
-    if not conversation_id or conversation_id == "null":
-        conversation_id = create_conversation(databases, db_id, conv_collection_id, user_id, user_prompt)
-    else:
-        update_conversation_timestamp(databases, db_id, conv_collection_id, conversation_id)
-
-    save_message_to_db(databases, db_id, msg_collection_id, conversation_id, "user", user_prompt)
-
-    # Determine whether we have ready documents
-    docs_ready = databases.list_documents(
-        db_id,
-        docs_collection_id,
-        queries=[
-            Query.equal("userId", users_doc_id), 
-            Query.equal("conversationId", conversation_id),
-            Query.equal("status", DOC_COMPLETED),
-            Query.limit(1),
-        ],
-    )
-
-    context_documents = []
-    if docs_ready.get("total", 0) > 0:
-        try:
-            search_filter = {"user_id": user_id, "conversation_id": conversation_id}
-            store = get_vector_store()
-            retriever = store.as_retriever(search_kwargs={"k": 5, "filter": search_filter})
-            docs = retriever.invoke(user_prompt)
-            context_documents = docs if docs else []
-        except Exception as e:
-            logger.error(f"Vector retrieval failed: {e}")
-            context_documents = []
+    conversation_id = prelude.conversation_id
+    prompts_remaining = prelude.prompts_remaining
+    context_documents = prelude.context_documents
+    history = prelude.history
+    cached_events = lookup_answer(user["$id"], prelude.file_hashes, history, prelude.query_vector)
 
     def generate_stream():
         final_answer_for_db = ""
-        rag_response_buffer = ""
 
         try:
-            logger.info("Starting RAG stream...")
-            if context_documents:
-                rag_stream = generate_rag_response(user_prompt, context_documents, history)
-                for chunk in rag_stream:
-                    chunk_content = chunk.content
-                    if chunk_content:
-                        rag_response_buffer += chunk_content
-                        yield json.dumps({"type": "rag_chunk", "content": chunk_content}) + "\n"
+            if cached_events is not None:
+                logger.info("Replaying cached answer...")
+                events = cached_events
             else:
-                rag_response_buffer = "Answer is not available in the context"
-
-            if "Answer is not available in the context" in rag_response_buffer:
-                prefix = "No indexed documents found. Response from Gemini:\n"
-                yield json.dumps({"type": "fallback_start", "content": prefix}) + "\n"
-                fallback_stream = generate_fallback_response(user_prompt, history)
-                fallback_buffer = ""
-                for chunk in fallback_stream:
-                    chunk_content = chunk.content
-                    if chunk_content:
-                        fallback_buffer += chunk_content
-                        yield json.dumps({"type": "fallback_chunk", "content": chunk_content}) + "\n"
-                final_answer_for_db = prefix + fallback_buffer
-            else:
-                final_answer_for_db = rag_response_buffer
-
-            save_message_to_db(databases, db_id, msg_collection_id, conversation_id, "bot", final_answer_for_db)
+                logger.info("Starting RAG stream...")
+                events = stream_answer(user_prompt, context_documents, history)
+            sent = []
+            for event_type, content in events:
+                if event_type == "fallback_start":
+                    final_answer_for_db = content
+                else:
+                    final_answer_for_db += content
+                sent.append((event_type, content))
+                yield json.dumps({"type": event_type, "content": content}) + "\n"
+
+            if cached_events is None:
+                store_answer(user["$id"], conversation_id, prelude.file_hashes, history, prelude.query_vector, sent)
+            bot_message_id = ID.unique()
+            enqueue_write(
+                conversation_id, save_message_to_db, databases, db_id, msg_collection_id, conversation_id, "bot",
+                final_answer_for_db,
+                message_id=bot_message_id,
+            )
+            record_message(conversation_id, bot_message_id, "bot", final_answer_for_db)
 
         except Exception as e:
             logger.error(f"Error during AI stream generation: {e}")
@@ -503,4 +565,22 @@ def admin_rebuild():
         databases.update_document(db_id, docs_collection_id, doc["$id"], {"status": DOC_PENDING})
         jobs_created += 1
 
-    return jsonify({"jobsCreated": jobs_created, "droppedVectors": bool(drop_vectors)})
\ No newline at end of file
+    return jsonify({"jobsCreated": jobs_created, "droppedVectors": bool(drop_vectors)})
+
+
+@api.route("/admin/ingestion-metrics", methods=["GET"])
+def admin_ingestion_metrics():
+    if not require_admin():
+        return jsonify({"error": "Unauthorized"}), 403
+    from .ingestion_worker import get_worker_metrics
+
+    return jsonify(get_worker_metrics())
+
+
+@api.route("/admin/llm-clients", methods=["GET"])
+def admin_llm_clients():
+    if not require_admin():
+        return jsonify({"error": "Unauthorized"}), 403
+    from .llm_clients import get_chat_model_stats
+
+    return jsonify({"clients": get_chat_model_stats()})
@@ -0,0 +1,73 @@
+import os
+import logging
+import tempfile
+from appwrite.exception import AppwriteException
+from appwrite.input_file import InputFile
+from appwrite.services.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join("data", "uploads"))
+UPLOADS_BUCKET_ID = os.getenv("VITE_APPWRITE_UPLOADS_BUCKET_ID")
+
+
+def _local_path(document_id):
+    return os.path.join(UPLOAD_DIR, f"{document_id}.pdf")
+
+
+def save_upload(file, document_id):
+    """Persist the raw upload until the ingestion worker has chunked it.
+
+    Goes to the Appwrite bucket when VITE_APPWRITE_UPLOADS_BUCKET_ID is set (needed when the
+    worker may run on another node), otherwise to UPLOAD_DIR on local disk.
+    """
+    file.stream.seek(0)
+    if UPLOADS_BUCKET_ID:
+        from app import databases
+        Storage(databases.client).create_file(
+            UPLOADS_BUCKET_ID, document_id, InputFile.from_bytes(file.stream.read(), f"{document_id}.pdf")
+        )
+        return
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    # write under a temp name so a half-written file is never picked up
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            file.save(out)
+        os.replace(tmp_path, _local_path(document_id))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def fetch_upload(document_id, dest_dir):
+    """Return a local path to the raw upload, downloading it into dest_dir if it lives in a bucket"""
+    if UPLOADS_BUCKET_ID:
+        from app import databases
+        data = Storage(databases.client).get_file_download(UPLOADS_BUCKET_ID, document_id)
+        path = os.path.join(dest_dir, f"{document_id}.pdf")
+        with open(path, "wb") as out:
+            out.write(data)
+        return path
+
+    path = _local_path(document_id)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Raw upload for document {document_id} not found")
+    return path
+
+
+def delete_upload(document_id):
+    """Best effort removal once the document's chunks are persisted or it is pruned"""
+    try:
+        if UPLOADS_BUCKET_ID:
+            from app import databases
+            Storage(databases.client).delete_file(UPLOADS_BUCKET_ID, document_id)
+        elif os.path.exists(_local_path(document_id)):
+            os.remove(_local_path(document_id))
+    except AppwriteException as exc:
+        if exc.code != 404:
+            logger.warning(f"Could not delete raw upload for document {document_id}: {exc}")
+    except Exception as exc:
+        logger.warning(f"Could not delete raw upload for document {document_id}: {exc}")
@@ -0,0 +1,6 @@
+# rough size of a token for Gemini models on English text; budgets only need to be in the right range
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
@@ -1,46 +1,70 @@
 import os
 import logging
+import importlib
 import threading
 from tenacity import retry, wait_exponential, stop_after_attempt
 from langchain_pinecone import PineconeVectorStore
 from pinecone import Pinecone
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 
+from .embedding_cache import CachedEmbeddings, EmbeddingCache
+
 _vector_store = None
 _embeddings = None
 _lock = threading.Lock()
 
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+# stored/searched width; unset keeps all 3072. The Pinecone index dimension must match.
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "0")) or None
+# "pinecone", "local" (api/local_vector_store.py) or "package.module:Class" taking the embedding function
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+
 
 def get_embedding_function():
     global _embeddings
     if _embeddings is None:
         if not os.getenv("GOOGLE_API_KEY"):
             raise RuntimeError("Missing GOOGLE_API_KEY for embeddings")
-        _embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/gemini-embedding-001"
+        base = GoogleGenerativeAIEmbeddings(
+            model=EMBEDDING_MODEL
         ) #Sends in 3072 dimension output no matter what you give in for output_dimensionality attribute
+        _embeddings = CachedEmbeddings(base, EMBEDDING_MODEL, EmbeddingCache(), dimensions=EMBEDDING_DIM)
         logging.info("Embeddings initialized")
     return _embeddings
 
 
+def _pinecone_store(embeddings):
+    api_key = os.getenv("PINECONE_API_KEY")
+    index_name = os.getenv("PINECONE_INDEX_NAME")
+
+    if not api_key or not index_name:
+        raise ValueError("PINECONE API KEY and PINECONE INDEX NAME must be set in env")
+
+    pc = Pinecone(api_key=api_key)
+    store = PineconeVectorStore(
+        index_name=index_name,
+        embedding=embeddings
+    )
+    logging.info(f"Pinecone initialized for index: {index_name}")
+    return store
+
+
 def get_vector_store():
     global _vector_store
     if _vector_store is None:
         with _lock:
             if _vector_store is None:
-                api_key = os.getenv("PINECONE_API_KEY")
-                index_name = os.getenv("PINECONE_INDEX_NAME")
-                
-                if not api_key or not index_name:
-                    raise ValueError("PINECONE API KEY and PINECONE INDEX NAME must be set in env")
-                
                 embeddings = get_embedding_function()
-                pc = Pinecone(api_key=api_key)
-                _vector_store = PineconeVectorStore(
-                    index_name=index_name, 
-                    embedding=embeddings
-                )
-                logging.info(f"Pinecone initialized for index: {index_name}")
+                if VECTOR_BACKEND == "pinecone":
+                    _vector_store = _pinecone_store(embeddings)
+                elif VECTOR_BACKEND == "local":
+                    from .local_vector_store import LocalVectorStore
+                    _vector_store = LocalVectorStore(embeddings)
+                    logging.info(f"Local vector store initialized at {_vector_store.path}")
+                else:
+                    module_name, _, class_name = VECTOR_BACKEND.partition(":")
+                    _vector_store = getattr(importlib.import_module(module_name), class_name)(embeddings)
+                    logging.info(f"Vector store initialized: {VECTOR_BACKEND}")
     return _vector_store
 
 def log_error(state):
@@ -58,7 +82,10 @@ def add_documents_with_retry(db, batch, ids):
 def reset_vector_store():
     """admin only hook to delete vector index"""
     global _vector_store
-    if _vector_store:
+    if _vector_store and hasattr(_vector_store, "wipe"):
+        _vector_store.wipe()
+        logging.info("Wiped all vectors in the local vector store")
+    elif _vector_store:
         api_key = os.getenv("PINECONE_API_KEY")
         index_name = os.getenv("PINECONE_INDEX_NAME")
         pc = Pinecone(api_key=api_key)
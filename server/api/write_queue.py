@@ -0,0 +1,84 @@
+import os
+import queue
+import atexit
+import zlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WRITE_RETRIES = 2
+# how long a stopping worker waits for queued writes (e.g. chat messages) before exiting
+WRITE_DRAIN_SECONDS = 10
+WRITE_QUEUE_WORKERS = int(os.getenv("WRITE_QUEUE_WORKERS", "4"))
+# per worker; a full queue makes callers wait up to WRITE_ENQUEUE_TIMEOUT, then write inline
+WRITE_QUEUE_MAX = int(os.getenv("WRITE_QUEUE_MAX", "1000"))
+WRITE_ENQUEUE_TIMEOUT = float(os.getenv("WRITE_ENQUEUE_TIMEOUT_SECONDS", "2"))
+
+_queues = []
+_lock = threading.Lock()
+
+
+def _write(fn, args, kwargs):
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            fn(*args, **kwargs)
+            return
+        except Exception as exc:
+            if attempt == WRITE_RETRIES:
+                logger.error(f"Deferred write {fn.__name__} failed: {exc}")
+            else:
+                time.sleep(0.5 * (attempt + 1))
+
+
+def _run(writes):
+    while True:
+        fn, args, kwargs = writes.get()
+        try:
+            _write(fn, args, kwargs)
+        finally:
+            writes.task_done()
+
+
+def _start():
+    with _lock:
+        if not _queues:
+            for i in range(max(1, WRITE_QUEUE_WORKERS)):
+                writes = queue.Queue(maxsize=WRITE_QUEUE_MAX)
+                threading.Thread(target=_run, args=(writes,), name=f"write-queue-{i}", daemon=True).start()
+                _queues.append(writes)
+            atexit.register(drain_writes)
+
+
+def enqueue_write(key, fn, *args, **kwargs):
+    """Run a non-critical write off the request path. Writes with the same key (a conversation
+    id) go to the same worker and run in FIFO order, so a conversation's messages are stored in
+    the order they were enqueued; a slow write only holds up the keys sharing its worker."""
+    if not _queues:
+        _start()
+    writes = _queues[zlib.crc32(str(key).encode()) % len(_queues)]
+    try:
+        writes.put((fn, args, kwargs), timeout=WRITE_ENQUEUE_TIMEOUT)
+    except queue.Full:
+        # Appwrite is falling behind; slow this request down instead of queueing without bound
+        logger.warning(f"Write queue full, running {fn.__name__} inline")
+        _write(fn, args, kwargs)
+
+
+def _unfinished():
+    return sum(writes.unfinished_tasks for writes in _queues)
+
+
+def drain_writes(timeout=WRITE_DRAIN_SECONDS):
+    """Wait for queued writes to finish; runs at interpreter exit so a restarting worker
+    doesn't drop the messages it accepted"""
+    deadline = time.monotonic() + timeout
+    while _unfinished() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if _unfinished():
+        logger.error(f"Exiting with {_unfinished()} deferred writes not done")
+
+
+def pending_writes():
+    return sum(writes.qsize() for writes in _queues)
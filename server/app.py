@@ -44,12 +44,13 @@ def create_app():
     app.chunks_collection_id = os.getenv("VITE_APPWRITE_CHUNKS_COLL_ID")
     app.jobs_collection_id = os.getenv("VITE_APPWRITE_INGESTION_JOBS_COLL_ID")
     app.users_collection_id = os.getenv("VITE_APPWRITE_USERS_COLL_ID")
+    app.leases_collection_id = os.getenv("VITE_APPWRITE_JOB_LEASES_COLL_ID")
 
     from api.routes import api
     app.register_blueprint(api, url_prefix='/api')
 
     global databases, db_id, conv_collection_id, msg_collection_id, user_limits_collection_id
-    global docs_collection_id, chunks_collection_id, jobs_collection_id, users_collection_id
+    global docs_collection_id, chunks_collection_id, jobs_collection_id, users_collection_id, leases_collection_id
     databases = app.databases
     db_id = app.db_id
     conv_collection_id = app.conv_collection_id
@@ -59,6 +60,7 @@ def create_app():
     chunks_collection_id = app.chunks_collection_id
     jobs_collection_id = app.jobs_collection_id
     users_collection_id = app.users_collection_id
+    leases_collection_id = app.leases_collection_id
 
     #Eager initialize this so that user doesn't have to wait after his first request in chat
     try:
@@ -67,6 +69,12 @@ def create_app():
     except Exception as init_err:
         logging.error(f"Failed to eager-load vector store: {init_err}")
 
+    try:
+        from api.llm_clients import warm_chat_models
+        warm_chat_models()
+    except Exception as llm_err:
+        logging.error(f"Failed to warm chat model clients: {llm_err}")
+
     try:
         from api.ingestion_worker import start_worker_once
         start_worker_once(app)
@@ -74,6 +82,12 @@ def create_app():
     except Exception as worker_err:
         logging.error(f"Ingestion worker failed to start: {worker_err}")
 
+    try:
+        from api.conversation_deletion import resume_pending_deletions
+        resume_pending_deletions()
+    except Exception as deletion_err:
+        logging.error(f"Could not resume conversation deletions: {deletion_err}")
+
     logging.info("Health endpoint ready at /api/health")
     return app
 
@@ -0,0 +1,82 @@
+"""Compare the old one-create-per-chunk loop with BulkDocumentWriter against a fake Appwrite.
+
+    python benchmarks/bench_bulk_writer.py --chunks 70 --latency-ms 50
+    python benchmarks/bench_bulk_writer.py --chunks 70 --latency-ms 50 --reject-bulk
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from appwrite.client import Client
+from appwrite.id import ID
+from appwrite.services.databases import Databases
+
+from api.bulk_writer import BulkDocumentWriter
+from benchmarks.fake_appwrite import FakeAppwriteServer
+
+
+def make_records(n):
+    return [
+        {
+            "chunkId": f"bench.pdf:{i // 4}:{i % 4}",
+            "documentId": "doc",
+            "conversationId": "conv",
+            "userId": "user",
+            "fileHash": "0" * 64,
+            "chunkHash": f"{i:064x}",
+            "text": "lorem ipsum " * 60,
+        }
+        for i in range(n)
+    ]
+
+
+def make_databases(endpoint):
+    client = Client()
+    client.set_endpoint(endpoint)
+    client.set_project("bench")
+    client.set_key("bench")
+    return Databases(client)
+
+
+def run_serial(endpoint, records):
+    databases = make_databases(endpoint)
+    for rec in records:
+        databases.create_document("db", "chunks", ID.unique(), rec)
+
+
+def run_bulk(endpoint, records, workers, batch_size):
+    writer = BulkDocumentWriter(make_databases(endpoint), max_workers=workers, batch_size=batch_size)
+    result = writer.create_documents("db", "chunks", records)
+    if not result.ok:
+        raise RuntimeError(f"{len(result.failed)} writes failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=70)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--reject-bulk", action="store_true", help="simulate a collection with relationship attributes")
+    args = parser.parse_args()
+
+    records = make_records(args.chunks)
+    for name, fn in (
+        ("serial create_document", lambda ep: run_serial(ep, records)),
+        ("BulkDocumentWriter", lambda ep: run_bulk(ep, records, args.workers, args.batch_size)),
+    ):
+        server = FakeAppwriteServer(latency_ms=args.latency_ms, reject_bulk=args.reject_bulk).start()
+        try:
+            start = time.perf_counter()
+            fn(server.endpoint)
+            elapsed = time.perf_counter() - start
+        finally:
+            server.stop()
+        print(f"{name:<24} {args.chunks} chunks  {server.requests:>4} requests  {elapsed * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Time-to-first-token prelude: the old sequential chat route calls vs run_chat_prelude.
+
+Every Appwrite call and the retrieval step are stubs that sleep for a configurable latency,
+so the numbers show how the call graph, not the network, shapes latency.
+
+    python benchmarks/bench_chat_prelude.py --appwrite-ms 80 --retrieval-ms 250
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import types
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# the answer cache would embed the prompt for real; keep the comparison to the Appwrite calls
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+
+
+class StubDatabases:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def _wait(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def list_documents(self, db_id, collection_id, queries=None):
+        self._wait()
+        if collection_id == "user_limits":
+            return {"total": 1, "documents": [{"$id": "limit", "promptCount": 0, "lastResetDate": date.today().isoformat()}]}
+        if collection_id == "users":
+            return {"total": 1, "documents": [{"$id": "users-doc"}]}
+        if collection_id == "messages":
+            return {"total": 0, "documents": []}
+        return {"total": 1, "documents": [{"$id": "doc", "status": "completed", "fileHash": "0" * 64}]}
+
+    def create_document(self, db_id, collection_id, document_id, data, permissions=None):
+        self._wait()
+        return {"$id": document_id, **data}
+
+    def update_document(self, db_id, collection_id, document_id, data=None, permissions=None):
+        self._wait()
+        return {"$id": document_id}
+
+    def get_document(self, db_id, collection_id, document_id, queries=None):
+        self._wait()
+        return {"$id": document_id, "userId": "auth-user"}
+
+
+def install_fake_app(databases):
+    fake = types.ModuleType("app")
+    fake.databases = databases
+    fake.db_id = "db"
+    fake.msg_collection_id = "messages"
+    fake.conv_collection_id = "conversations"
+    fake.user_limits_collection_id = "user_limits"
+    fake.docs_collection_id = "documents"
+    fake.users_collection_id = "users"
+    sys.modules["app"] = fake
+
+
+def make_retrieve(latency):
+    def retrieve(user_prompt, user_id, conversation_id):
+        time.sleep(latency)
+        return ["chunk"] * 5
+    return retrieve
+
+
+def sequential_prelude(databases, user, prompt, conversation_id, retrieve):
+    """The call order the chat route used before the concurrent prelude"""
+    from appwrite.query import Query
+    from api.ai_service import save_message_to_db
+    from api.user_service import get_user_prompt_limit, update_conversation_timestamp
+
+    users = databases.list_documents("db", "users", queries=[Query.equal("userId", user["$id"]), Query.limit(1)])
+    users_doc_id = users["documents"][0]["$id"]
+    get_user_prompt_limit(databases, "db", "user_limits", user["$id"])
+    update_conversation_timestamp(databases, "db", "conversations", conversation_id)
+    save_message_to_db(databases, "db", "messages", conversation_id, "user", prompt)
+    ready = databases.list_documents("db", "documents", queries=[Query.equal("userId", users_doc_id), Query.limit(1)])
+    return retrieve(prompt, user["$id"], conversation_id) if ready["total"] else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--appwrite-ms", type=float, default=80)
+    parser.add_argument("--retrieval-ms", type=float, default=250)
+    parser.add_argument("--requests", type=int, default=10)
+    args = parser.parse_args()
+
+    databases = StubDatabases(args.appwrite_ms / 1000.0)
+    install_fake_app(databases)
+    from api.chat_prelude import run_chat_prelude
+    from api.write_queue import pending_writes
+
+    retrieve = make_retrieve(args.retrieval_ms / 1000.0)
+    user = {"$id": "auth-user", "email": "bench@example.com"}
+
+    for name, fn in (
+        ("sequential", lambda: sequential_prelude(databases, user, "question?", "conv", retrieve)),
+        ("concurrent prelude", lambda: run_chat_prelude(user, "question?", "conv", retrieve)),
+    ):
+        timings = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{name:<20} p50 {statistics.median(timings):8.1f} ms   max {max(timings):8.1f} ms")
+        while pending_writes():
+            time.sleep(0.05)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Compare the old serial wipe_collection loop with BulkDocumentWriter.delete_documents against a fake Appwrite.
+
+    python benchmarks/bench_conversation_delete.py --chunks 300 --latency-ms 20
+    python benchmarks/bench_conversation_delete.py --chunks 300 --latency-ms 20 --reject-bulk
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from appwrite.client import Client
+from appwrite.query import Query
+from appwrite.services.databases import Databases
+
+from api.bulk_writer import BulkDocumentWriter
+from benchmarks.fake_appwrite import FakeAppwriteServer
+
+COLLECTIONS = ("chunks", "jobs", "documents", "messages")
+
+
+def seed(server, chunks):
+    counts = {"chunks": chunks, "jobs": 3, "documents": 3, "messages": 40}
+    for collection_id, n in counts.items():
+        for i in range(n):
+            server.documents[(collection_id, f"{collection_id}-{i}")] = {"conversationId": "conv"}
+    server.documents[("chunks", "other")] = {"conversationId": "other"}
+
+
+def make_databases(endpoint):
+    client = Client()
+    client.set_endpoint(endpoint)
+    client.set_project("bench")
+    client.set_key("bench")
+    return Databases(client)
+
+
+def run_serial(endpoint):
+    databases = make_databases(endpoint)
+    for collection_id in COLLECTIONS:
+        while True:
+            res = databases.list_documents("db", collection_id, queries=[Query.equal("conversationId", "conv"), Query.limit(100)])
+            docs = res.get("documents", [])
+            if not docs:
+                break
+            for d in docs:
+                databases.delete_document("db", collection_id, d["$id"])
+
+
+def run_bulk(endpoint, workers, batch_size):
+    writer = BulkDocumentWriter(make_databases(endpoint), max_workers=workers, batch_size=batch_size)
+    for collection_id in COLLECTIONS:
+        writer.delete_documents("db", collection_id, [Query.equal("conversationId", "conv")])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--reject-bulk", action="store_true", help="simulate collections with relationship attributes")
+    args = parser.parse_args()
+
+    for name, fn in (
+        ("serial wipe_collection", run_serial),
+        ("delete_documents", lambda ep: run_bulk(ep, args.workers, args.batch_size)),
+    ):
+        server = FakeAppwriteServer(latency_ms=args.latency_ms, reject_bulk=args.reject_bulk).start()
+        seed(server, args.chunks)
+        try:
+            start = time.perf_counter()
+            fn(server.endpoint)
+            elapsed = time.perf_counter() - start
+        finally:
+            server.stop()
+        left = sum(1 for coll, _ in server.documents if coll in COLLECTIONS) - 1
+        print(f"{name:<24} {server.requests:>4} requests  {elapsed * 1000:8.1f} ms  {left} left")
+
+
+if __name__ == "__main__":
+    main()
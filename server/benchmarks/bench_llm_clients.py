@@ -0,0 +1,62 @@
+"""Compare building ChatGoogleGenerativeAI per prompt with the shared client registry, against a fake Gemini.
+
+    python benchmarks/bench_llm_clients.py --prompts 30 --latency-ms 20
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_gemini import FakeGeminiServer
+
+
+def stream_all(model, prompt):
+    return "".join(chunk.content for chunk in model.stream(prompt))
+
+
+def run_per_prompt(prompts):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from api.llm_clients import GEMINI_API_ENDPOINT, GEMINI_TRANSPORT
+    for _ in range(prompts):
+        model = ChatGoogleGenerativeAI(
+            model="gemini-2.5-flash-lite", temperature=0.3,
+            client_options={"api_endpoint": GEMINI_API_ENDPOINT}, transport=GEMINI_TRANSPORT,
+        )
+        stream_all(model, "ping")
+
+
+def run_registry(prompts):
+    from api.llm_clients import get_chat_model
+    for _ in range(prompts):
+        stream_all(get_chat_model(), "ping")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    for name, fn in (("client per prompt", run_per_prompt), ("shared client", run_registry)):
+        server = FakeGeminiServer(latency_ms=args.latency_ms).start()
+        # llm_clients reads its endpoint at import time, so set it before the first import
+        os.environ.setdefault("GOOGLE_API_KEY", "bench")
+        os.environ["GEMINI_API_ENDPOINT"] = server.endpoint
+        os.environ["GEMINI_TRANSPORT"] = "rest"
+        sys.modules.pop("api.llm_clients", None)
+        try:
+            start = time.perf_counter()
+            fn(args.prompts)
+            elapsed = time.perf_counter() - start
+        finally:
+            server.stop()
+        print(f"{name:<18} {args.prompts} prompts  {server.connections:>3} connections  {elapsed * 1000:8.1f} ms")
+
+    from api.llm_clients import get_chat_model_stats
+    print(get_chat_model_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Recall and size of truncated / quantized local vector storage against the full-width float baseline.
+
+By default the corpus is synthetic: clustered vectors whose variance decays across
+dimensions, like Matryoshka-trained embeddings. Point --from-cache at the embedding
+cache to measure on real gemini-embedding-001 vectors instead.
+
+    python benchmarks/bench_vector_quantization.py --chunks 2000 --queries 200
+    python benchmarks/bench_vector_quantization.py --from-cache data/embedding_cache.sqlite3
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from array import array
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.local_vector_store import _Partition, _normalize
+
+FULL_DIM = 3072
+
+
+def synthetic_corpus(n, rng, clusters=40):
+    decay = (np.arange(FULL_DIM) + 1.0) ** -0.5
+    centers = rng.standard_normal((clusters, FULL_DIM)) * decay
+    members = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, FULL_DIM)) * decay
+    return members.astype(np.float32)
+
+
+def cached_corpus(path, limit):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT vec FROM embeddings LIMIT ?", (limit,)).fetchall()
+    return np.array([array("f", blob).tolist() for (blob,) in rows], dtype=np.float32)
+
+
+def make_queries(corpus, count, rng):
+    # paraphrase-like queries: a corpus vector plus noise of similar size to the cluster spread
+    picks = corpus[rng.integers(0, len(corpus), count)]
+    return picks + 0.5 * rng.standard_normal(picks.shape).astype(np.float32) * np.abs(picks).mean(axis=1, keepdims=True)
+
+
+def truncate(vectors, dim):
+    return _normalize(vectors[:, :dim])
+
+
+def top_k(partition, queries, k):
+    return [{rec["id"] for rec, _ in partition.search(q, k, None)} for q in queries]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dims", default="3072,1536,768,256")
+    parser.add_argument("--rescore-factor", type=int, default=10)
+    parser.add_argument("--from-cache", help="embedding cache SQLite file to read real vectors from")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    corpus = cached_corpus(args.from_cache, args.chunks) if args.from_cache else synthetic_corpus(args.chunks, rng)
+    queries = make_queries(corpus, args.queries, rng)
+    records = [{"id": str(i), "text": "", "metadata": {}} for i in range(len(corpus))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = _Partition(os.path.join(tmp, "baseline"))
+        with baseline.locked():
+            baseline.write(records, _normalize(corpus))
+        truth = top_k(baseline, _normalize(queries), args.k)
+
+        print(f"{len(corpus)} vectors, {len(queries)} queries, recall@{args.k} vs float32 x {corpus.shape[1]}")
+        print(f"{'dims':>5} {'format':<7} {'scan B/vec':>10} {'smaller':>7} {'recall':>7} {'ms/query':>9}")
+        for dim in (int(d) for d in args.dims.split(",")):
+            dim = min(dim, corpus.shape[1])
+            vectors = truncate(corpus, dim)
+            q = truncate(queries, dim)
+            for mode in (None, "int8", "binary"):
+                part = _Partition(os.path.join(tmp, f"{dim}-{mode}"), mode, args.rescore_factor)
+                with part.locked():
+                    part.write(records, vectors)
+                start = time.perf_counter()
+                found = top_k(part, q, args.k)
+                elapsed = (time.perf_counter() - start) / len(q)
+                recall = sum(len(a & b) for a, b in zip(found, truth)) / (args.k * len(truth))
+                scanned = {None: dim * 4, "int8": dim + 4, "binary": (dim + 7) // 8}[mode]
+                print(
+                    f"{dim:>5} {mode or 'float32':<7} {scanned:>10} {FULL_DIM * 4 / scanned:>6.1f}x "
+                    f"{recall:>7.3f} {elapsed * 1000:>9.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
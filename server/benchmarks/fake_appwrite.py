@@ -0,0 +1,219 @@
+"""Minimal in-memory stand-in for the Appwrite databases REST API (create, get, list, update, delete), with injectable latency."""
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DOCUMENTS_PATH = re.compile(r"^/v1/databases/([^/]+)/collections/([^/]+)/documents/?$")
+DOCUMENT_PATH = re.compile(r"^/v1/databases/([^/]+)/collections/([^/]+)/documents/([^/]+)$")
+
+
+class FakeAppwriteServer:
+    def __init__(self, latency_ms=50, reject_bulk=False, host="127.0.0.1", port=0):
+        self.latency = latency_ms / 1000.0
+        self.reject_bulk = reject_bulk
+        self.documents = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _store(self, collection_id, doc_id, data):
+        with self._lock:
+            key = (collection_id, doc_id)
+            if key in self.documents:
+                return False
+            now = datetime.now(timezone.utc).isoformat()
+            self.documents[key] = {"$createdAt": now, "$updatedAt": now, **data}
+            return True
+
+    def _get(self, collection_id, doc_id):
+        with self._lock:
+            data = self.documents.get((collection_id, doc_id))
+            return None if data is None else {"$id": doc_id, **data}
+
+    def _update(self, collection_id, doc_id, data):
+        with self._lock:
+            stored = self.documents.get((collection_id, doc_id))
+            if stored is None:
+                return None
+            stored.update(data, **{"$updatedAt": datetime.now(timezone.utc).isoformat()})
+            return {"$id": doc_id, **stored}
+
+    def _matching(self, collection_id, queries):
+        """(total, documents) in a collection matching Appwrite JSON queries. Supports equal,
+        notEqual, lessThan, greaterThan(Equal), isNull, isNotNull, orderAsc/orderDesc,
+        cursorAfter and limit; select is ignored. Unordered results keep insertion order."""
+        limit = None
+        cursor = None
+        order = []
+        tests = []
+        for raw in queries:
+            query = json.loads(raw) if isinstance(raw, str) else raw
+            method, attr, values = query["method"], query.get("attribute"), query.get("values") or []
+            if method == "equal":
+                tests.append(lambda d, a=attr, v=values: d.get(a) in v)
+            elif method == "notEqual":
+                tests.append(lambda d, a=attr, v=values: d.get(a) not in v)
+            elif method == "lessThan":
+                tests.append(lambda d, a=attr, v=values[0]: d.get(a) is not None and d.get(a) < v)
+            elif method == "greaterThan":
+                tests.append(lambda d, a=attr, v=values[0]: d.get(a) is not None and d.get(a) > v)
+            elif method == "greaterThanEqual":
+                tests.append(lambda d, a=attr, v=values[0]: d.get(a) is not None and d.get(a) >= v)
+            elif method == "isNull":
+                tests.append(lambda d, a=attr: d.get(a) is None)
+            elif method == "isNotNull":
+                tests.append(lambda d, a=attr: d.get(a) is not None)
+            elif method in ("orderAsc", "orderDesc"):
+                order.append((attr, method == "orderDesc"))
+            elif method == "cursorAfter":
+                cursor = values[0]
+            elif method == "limit":
+                limit = values[0]
+        with self._lock:
+            docs = [
+                {"$id": doc_id, **data} for (coll, doc_id), data in self.documents.items()
+                if coll == collection_id and all(test({"$id": doc_id, **data}) for test in tests)
+            ]
+        for attr, descending in reversed(order):
+            docs.sort(key=lambda d: (d.get(attr) is None, d.get(attr)), reverse=descending)
+        total = len(docs)
+        if cursor is not None:
+            ids = [d["$id"] for d in docs]
+            docs = docs[ids.index(cursor) + 1:] if cursor in ids else []
+        return total, docs[:limit] if limit is not None else docs
+
+    def _delete(self, collection_id, doc_id):
+        with self._lock:
+            return self.documents.pop((collection_id, doc_id), None) is not None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _begin(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                with fake._lock:
+                    fake.requests += 1
+                time.sleep(fake.latency)
+                return json.loads(raw or b"{}")
+
+            def do_GET(self):
+                self._begin()
+                url = urlsplit(self.path)
+                single = DOCUMENT_PATH.match(url.path)
+                if single:
+                    _, collection_id, doc_id = single.groups()
+                    doc = fake._get(collection_id, doc_id)
+                    if doc is None:
+                        return self._reply(404, {"message": "Document not found", "code": 404})
+                    return self._reply(200, doc)
+                match = DOCUMENTS_PATH.match(url.path)
+                if not match:
+                    return self._reply(404, {"message": "Route not found", "code": 404})
+                _, collection_id = match.groups()
+                # the SDK sends queries[0], queries[1], ...; plain requests sends queries[]
+                params = parse_qs(url.query)
+                queries = [q for key, values in params.items() if key.startswith("queries[") for q in values]
+                total, docs = fake._matching(collection_id, queries)
+                return self._reply(200, {"total": total, "documents": docs})
+
+            def do_PATCH(self):
+                body = self._begin()
+                single = DOCUMENT_PATH.match(self.path)
+                if not single:
+                    return self._reply(404, {"message": "Route not found", "code": 404})
+                _, collection_id, doc_id = single.groups()
+                doc = fake._update(collection_id, doc_id, body.get("data") or {})
+                if doc is None:
+                    return self._reply(404, {"message": "Document not found", "code": 404})
+                return self._reply(200, doc)
+
+            def do_DELETE(self):
+                body = self._begin()
+                single = DOCUMENT_PATH.match(self.path)
+                if single:
+                    _, collection_id, doc_id = single.groups()
+                    if not fake._delete(collection_id, doc_id):
+                        return self._reply(404, {"message": "Document not found", "code": 404})
+                    self.send_response(204)
+                    self.send_header("Content-Type", "text/plain")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                match = DOCUMENTS_PATH.match(self.path)
+                if not match:
+                    return self._reply(404, {"message": "Route not found", "code": 404})
+                if fake.reject_bulk:
+                    return self._reply(400, {"message": "Bulk operations are not supported for collections with relationship attributes", "code": 400})
+                _, collection_id = match.groups()
+                _, docs = fake._matching(collection_id, body.get("queries", []))
+                for doc in docs:
+                    fake._delete(collection_id, doc["$id"])
+                return self._reply(200, {"total": len(docs), "documents": docs})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b"{}"
+                with fake._lock:
+                    fake.requests += 1
+                time.sleep(fake.latency)
+
+                match = DOCUMENTS_PATH.match(self.path)
+                if not match:
+                    return self._reply(404, {"message": "Route not found", "code": 404})
+                _, collection_id = match.groups()
+                body = json.loads(raw or b"{}")
+
+                if "documents" in body:
+                    if fake.reject_bulk:
+                        return self._reply(400, {"message": "Bulk operations are not supported for collections with relationship attributes", "code": 400})
+                    created = []
+                    for doc in body["documents"]:
+                        doc = dict(doc)
+                        doc_id = doc.pop("$id", None) or uuid.uuid4().hex[:20]
+                        fake._store(collection_id, doc_id, doc)
+                        created.append({"$id": doc_id, **doc})
+                    return self._reply(201, {"total": len(created), "documents": created})
+
+                doc_id = body.get("documentId") or uuid.uuid4().hex[:20]
+                data = body.get("data", {})
+                if not fake._store(collection_id, doc_id, data):
+                    return self._reply(409, {"message": "Document with the requested ID already exists.", "code": 409})
+                return self._reply(201, {"$id": doc_id, **data})
+
+        return Handler
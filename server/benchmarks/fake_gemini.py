@@ -0,0 +1,70 @@
+"""Minimal stand-in for the Gemini REST streamGenerateContent endpoint, counting TCP connections."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGeminiServer:
+    def __init__(self, latency_ms=20, reply="Hello from the fake model.", host="127.0.0.1", port=0):
+        self.latency = latency_ms / 1000.0
+        self.reply = reply
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _chunks(self):
+        words = self.reply.split(" ")
+        for i, word in enumerate(words):
+            text = word if i == 0 else " " + word
+            yield {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}],
+                "usageMetadata": {"promptTokenCount": 1, "candidatesTokenCount": 1, "totalTokenCount": 2},
+            }
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                with fake._lock:
+                    fake.requests += 1
+                time.sleep(fake.latency)
+                # the REST transport streams a single JSON array of responses
+                payload = json.dumps(list(fake._chunks())).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
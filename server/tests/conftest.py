@@ -0,0 +1,41 @@
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from appwrite.client import Client
+from appwrite.services.databases import Databases
+
+from benchmarks.fake_appwrite import FakeAppwriteServer
+
+
+@pytest.fixture
+def appwrite(monkeypatch):
+    """A fake Appwrite server, wired up as the `app` module the api package imports its clients from.
+
+    Importing the real app.py would start the vector store, LLM warmup and ingestion worker."""
+    server = FakeAppwriteServer(latency_ms=0)
+    server.start()
+    client = Client()
+    client.set_endpoint(server.endpoint)
+    client.set_project("test")
+    client.set_key("test")
+    app = types.ModuleType("app")
+    app.databases = Databases(client)
+    app.db_id = "db"
+    app.conv_collection_id = "conversations"
+    app.msg_collection_id = "messages"
+    app.docs_collection_id = "documents"
+    app.chunks_collection_id = "chunks"
+    app.jobs_collection_id = "jobs"
+    app.users_collection_id = "users"
+    app.user_limits_collection_id = "user_limits"
+    app.leases_collection_id = "leases"
+    monkeypatch.setitem(sys.modules, "app", app)
+    try:
+        yield server
+    finally:
+        server.stop()
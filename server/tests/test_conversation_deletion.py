@@ -0,0 +1,90 @@
+import pytest
+from appwrite.query import Query
+
+from api import bulk_writer, conversation_deletion, retention
+from api.conversation_deletion import _delete_conversation, _list_all, get_deletion_progress
+
+
+class _VectorStore:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, filter=None, **kwargs):
+        self.deleted.append(filter)
+
+
+class _LexicalIndex:
+    def __init__(self):
+        self.dropped = []
+
+    def drop_conversation(self, conversation_id):
+        self.dropped.append(conversation_id)
+
+
+@pytest.fixture
+def stores(appwrite, monkeypatch):
+    vector_store, lexical_index, uploads = _VectorStore(), _LexicalIndex(), []
+    monkeypatch.setattr("api.vector_store.get_vector_store", lambda: vector_store)
+    monkeypatch.setattr("api.lexical_index.get_lexical_index", lambda: lexical_index)
+    monkeypatch.setattr(conversation_deletion, "delete_upload", uploads.append)
+    monkeypatch.setattr(conversation_deletion, "_progress", {})
+    monkeypatch.setattr(bulk_writer, "_writer", None)
+    monkeypatch.setattr(retention, "_ledgers", {})
+    return vector_store, lexical_index, uploads
+
+
+def _seed(server, conversation_id, counts):
+    for collection_id, n in counts.items():
+        for i in range(n):
+            server.documents[(collection_id, f"{conversation_id}-{collection_id}-{i}")] = {"conversationId": conversation_id}
+
+
+def test_list_all_pages_past_the_limit(appwrite):
+    _seed(appwrite, "conv-1", {"chunks": 250})
+    _seed(appwrite, "conv-2", {"chunks": 5})
+
+    docs = _list_all("chunks", [Query.equal("conversationId", "conv-1")])
+    assert len(docs) == 250
+    assert len({doc["$id"] for doc in docs}) == 250
+
+
+def test_list_all_exact_page(appwrite):
+    _seed(appwrite, "conv-1", {"chunks": conversation_deletion.PAGE_SIZE})
+    assert len(_list_all("chunks", [Query.equal("conversationId", "conv-1")])) == conversation_deletion.PAGE_SIZE
+
+
+def test_delete_conversation_wipes_everything(appwrite, stores):
+    vector_store, lexical_index, uploads = stores
+    appwrite.documents[("conversations", "conv-1")] = {"userId": "auth-1", "deletedAt": "2026-01-01"}
+    appwrite.documents[("conversations", "conv-2")] = {"userId": "auth-1"}
+    _seed(appwrite, "conv-1", {"chunks": 250, "jobs": 3, "documents": 120, "messages": 40})
+    _seed(appwrite, "conv-2", {"chunks": 5, "documents": 1})
+
+    _delete_conversation("conv-1")
+
+    assert get_deletion_progress("conv-1")["status"] == "deleted"
+    left = {coll for (coll, _), data in appwrite.documents.items() if data.get("conversationId") == "conv-1"}
+    assert left == set()
+    assert ("conversations", "conv-1") not in appwrite.documents
+    # the other conversation is untouched
+    assert len([key for key, data in appwrite.documents.items() if data.get("conversationId") == "conv-2"]) == 6
+    assert ("conversations", "conv-2") in appwrite.documents
+    assert vector_store.deleted == [{"conversation_id": "conv-1", "user_id": "auth-1"}]
+    assert lexical_index.dropped == ["conv-1"]
+    assert sorted(uploads) == sorted(f"conv-1-documents-{i}" for i in range(120))
+    # the lease is released once the wipe is done
+    assert [key for key in appwrite.documents if key[0] == "leases"] == []
+
+
+def test_delete_conversation_skips_when_leased_elsewhere(appwrite, stores):
+    from api.job_leases import try_claim
+    appwrite.documents[("conversations", "conv-1")] = {"userId": "auth-1", "deletedAt": "2026-01-01"}
+    _seed(appwrite, "conv-1", {"messages": 3})
+    other = try_claim("del-conv-1")
+
+    _delete_conversation("conv-1")
+
+    progress = get_deletion_progress("conv-1")
+    assert (progress["status"], progress["stage"]) == ("deleting", "elsewhere")
+    assert ("messages", "conv-1-messages-0") in appwrite.documents
+    assert ("leases", other.doc_id) in appwrite.documents
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from api import job_leases
+from api.job_leases import LeaseLost, try_claim, renew_lease, release_lease
+
+
+def _leases(server, job_id):
+    return {doc_id: data for (coll, doc_id), data in server.documents.items()
+            if coll == "leases" and data["jobId"] == job_id}
+
+
+def _expire(server, doc_id):
+    server.documents[("leases", doc_id)]["expiresAt"] = int(time.time()) - 1
+
+
+def test_racing_workers_get_one_claim(appwrite):
+    start = threading.Barrier(8)
+    claims = []
+
+    def claim():
+        start.wait()
+        claims.append(try_claim("job-1"))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    won = [lease for lease in claims if lease is not None]
+    assert len(won) == 1
+    assert won[0].generation == 1
+    assert list(_leases(appwrite, "job-1")) == ["job-1_1"]
+
+
+def test_held_lease_blocks_claims(appwrite):
+    assert try_claim("job-1") is not None
+    assert try_claim("job-1") is None
+
+
+def test_reclaim_supersedes_expired_lease(appwrite):
+    first = try_claim("job-1")
+    _expire(appwrite, first.doc_id)
+
+    second = try_claim("job-1")
+    assert second.generation == 2
+    # the superseded lease document is removed, and its holder finds out on renewal
+    assert list(_leases(appwrite, "job-1")) == ["job-1_2"]
+    assert renew_lease(first) is False
+    assert renew_lease(second) is True
+
+
+def test_release_leaves_newer_generation(appwrite):
+    first = try_claim("job-1")
+    _expire(appwrite, first.doc_id)
+    second = try_claim("job-1")
+
+    release_lease(first)
+    assert list(_leases(appwrite, "job-1")) == ["job-1_2"]
+    release_lease(second)
+    assert _leases(appwrite, "job-1") == {}
+    assert try_claim("job-1").generation == 1
+
+
+def test_leases_disabled(appwrite, monkeypatch):
+    import app
+    monkeypatch.setattr(app, "leases_collection_id", "")
+    lease = try_claim("job-1")
+    assert lease.generation == 0
+    assert renew_lease(lease) is True
+    assert _leases(appwrite, "job-1") == {}
+
+
+def test_heartbeat_pushes_expiry(appwrite, monkeypatch):
+    monkeypatch.setattr(job_leases, "LEASE_SECONDS", 30)
+    monkeypatch.setattr(job_leases, "HEARTBEAT_SECONDS", 0.05)
+    lease = try_claim("job-1")
+    appwrite.documents[("leases", lease.doc_id)]["expiresAt"] = 0
+    lease.start_heartbeat()
+    try:
+        deadline = time.time() + 5
+        while appwrite.documents[("leases", lease.doc_id)]["expiresAt"] == 0 and time.time() < deadline:
+            time.sleep(0.02)
+    finally:
+        lease.stop_heartbeat()
+    assert appwrite.documents[("leases", lease.doc_id)]["expiresAt"] > time.time()
+    assert not lease.lost.is_set()
+    lease.check()
+
+
+def test_heartbeat_flags_lost_lease(appwrite, monkeypatch):
+    monkeypatch.setattr(job_leases, "HEARTBEAT_SECONDS", 0.05)
+    lease = try_claim("job-1")
+    _expire(appwrite, lease.doc_id)
+    try_claim("job-1")
+    lease.start_heartbeat()
+    try:
+        assert lease.lost.wait(5)
+    finally:
+        lease.stop_heartbeat()
+    with pytest.raises(LeaseLost):
+        lease.check()
+
+
+def test_renewal_errors_tolerated_until_lease_runs_out(appwrite, monkeypatch):
+    lease = try_claim("job-1")
+    monkeypatch.setattr(job_leases, "_latest_lease", lambda job_id: 1 / 0)
+    assert renew_lease(lease) is True
+    lease.renewed_at -= job_leases.LEASE_SECONDS
+    assert renew_lease(lease) is False
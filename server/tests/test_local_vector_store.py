@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from api import local_vector_store
+from api.local_vector_store import LocalVectorStore
+
+DIM = 8
+
+
+class _Embedding:
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return np.random.default_rng(abs(hash(text)) % 2**32).standard_normal(DIM).tolist()
+
+
+def _add(path, quantization, worker, count):
+    store = LocalVectorStore(_Embedding(), path=path, quantization=quantization)
+    for i in range(count):
+        store.add_texts([f"w{worker}-{i}"], [{"user_id": "u1", "conversation_id": "c1", "document_id": f"d{worker}"}])
+
+
+@pytest.mark.parametrize("quantization", ["none", "int8"])
+def test_concurrent_writers_keep_every_row(tmp_path, quantization):
+    path = str(tmp_path)
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_add, args=(path, quantization, w, 10)) for w in range(4)]
+    for proc in workers:
+        proc.start()
+    for proc in workers:
+        proc.join(60)
+        assert proc.exitcode == 0
+
+    store = LocalVectorStore(_Embedding(), path=path, quantization=quantization)
+    hits = store.similarity_search("w0-0", k=100, filter={"user_id": "u1", "conversation_id": "c1"})
+    assert sorted(doc.page_content for doc in hits) == sorted(f"w{w}-{i}" for w in range(4) for i in range(10))
+
+    # 40 writes, and only the current and previous versions' files are left behind
+    partition = store._partition_dir({"user_id": "u1", "conversation_id": "c1"})
+    versions = {int(m.group(2)) for m in map(local_vector_store._VERSION_FILE.match, os.listdir(partition)) if m}
+    assert versions == {38, 39}
+
+
+def test_delete_with_owner_and_conversation_touches_one_partition(tmp_path, monkeypatch):
+    store = LocalVectorStore(_Embedding(), path=str(tmp_path))
+    for conv in ("c1", "c2"):
+        for user in ("u1", "u2"):
+            store.add_texts([f"{user}-{conv}"], [{"user_id": user, "conversation_id": conv, "document_id": "d"}])
+
+    locked = []
+    original = local_vector_store._Partition.locked
+
+    def spy(part):
+        locked.append(part.path)
+        return original(part)
+
+    monkeypatch.setattr(local_vector_store._Partition, "locked", spy)
+    store.delete(filter={"user_id": "u1", "conversation_id": "c1"})
+
+    assert locked == [store._partition_dir({"user_id": "u1", "conversation_id": "c1"})]
+    left = store.similarity_search("x", k=10)
+    assert sorted(doc.page_content for doc in left) == ["u1-c2", "u2-c1", "u2-c2"]
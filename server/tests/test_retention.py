@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
+import pytest
+
+from api import retention
+from api.appwrite_utils import DOC_COMPLETED, DOC_FAILED
+
+
+class _VectorStore:
+    def __init__(self):
+        self.deleted = []
+        self.down = False
+
+    def delete(self, filter=None, **kwargs):
+        if self.down:
+            raise RuntimeError("vector store down")
+        self.deleted.append(filter)
+
+
+class _LexicalIndex:
+    def remove_document(self, conversation_id, doc_id):
+        pass
+
+
+@pytest.fixture
+def store(appwrite, monkeypatch):
+    vector_store = _VectorStore()
+    monkeypatch.setattr(retention, "_ledgers", {})
+    monkeypatch.setattr(retention, "_last_used_written", OrderedDict())
+    monkeypatch.setattr(retention, "get_vector_store", lambda: vector_store)
+    monkeypatch.setattr(retention, "get_lexical_index", _LexicalIndex)
+    monkeypatch.setattr(retention, "delete_upload", lambda doc_id: None)
+    monkeypatch.setattr(retention, "invalidate_answers", lambda **kwargs: None)
+    # run deferred writes inline so the test can see them
+    monkeypatch.setattr(retention, "enqueue_write", lambda key, fn, *args: fn(*args))
+    monkeypatch.setattr(retention, "DOCS_KEEP", 3)
+    monkeypatch.setattr(retention, "CHUNK_CAP", 800)
+    monkeypatch.setattr(retention, "DOCS_MAX_AGE_DAYS", 10)
+    appwrite.documents[("conversations", "conv-1")] = {"userId": "auth-1"}
+    return vector_store
+
+
+def _days_ago(days):
+    return (datetime.now() - timedelta(days=days)).isoformat()
+
+
+def _seed(server, doc_id, days_ago, chunks=10, user="user-1", status=DOC_COMPLETED):
+    server.documents[("documents", doc_id)] = {
+        "userId": user, "conversationId": "conv-1", "status": status,
+        "chunkCount": chunks, "$createdAt": _days_ago(days_ago),
+    }
+
+
+def _status(server, doc_id):
+    return server.documents[("documents", doc_id)]["status"]
+
+
+def test_ledger_orders_by_last_use(appwrite, store):
+    for i in range(5):
+        _seed(appwrite, f"doc-{i}", days_ago=5 - i)
+    ledger = retention._get_ledger("user-1")
+    assert list(ledger.docs) == ["doc-0", "doc-1", "doc-2", "doc-3", "doc-4"]
+
+    retention.record_used("user-1", ["doc-0"])
+    assert list(ledger.docs) == ["doc-1", "doc-2", "doc-3", "doc-4", "doc-0"]
+    assert [doc["$id"] for doc in ledger.evictions(_days_ago(10))] == ["doc-1", "doc-2"]
+    # persisted, so a reloaded ledger keeps the order
+    assert appwrite.documents[("documents", "doc-0")]["lastUsedAt"]
+    assert list(retention._load_ledger("user-1").docs)[-1] == "doc-0"
+
+
+def test_last_used_writes_are_throttled(appwrite, store):
+    _seed(appwrite, "doc-0", days_ago=1)
+    retention.record_used("user-1", ["doc-0"])
+    first = appwrite.documents[("documents", "doc-0")]["lastUsedAt"]
+    retention.record_used("user-1", ["doc-0"])
+    assert appwrite.documents[("documents", "doc-0")]["lastUsedAt"] == first
+
+
+def test_evictions_skip_docs_being_pruned(appwrite, store):
+    for i in range(5):
+        _seed(appwrite, f"doc-{i}", days_ago=5 - i)
+    ledger = retention._get_ledger("user-1")
+    ledger.pruning.add("doc-0")
+
+    evicted = ledger.evictions(_days_ago(10))
+    # doc-0 still counts toward the keep limit as gone, so only doc-1 is added
+    assert [doc["$id"] for doc in evicted] == ["doc-1"]
+    assert len(ledger.docs) == 5
+
+
+def test_eviction_rules(appwrite, store):
+    _seed(appwrite, "old", days_ago=20)
+    _seed(appwrite, "big", days_ago=3, chunks=900)
+    _seed(appwrite, "new", days_ago=1)
+    ledger = retention._get_ledger("user-1")
+    assert [doc["$id"] for doc in ledger.evictions(_days_ago(10))] == ["old", "big"]
+
+
+def test_enforcement_prunes_and_forgets(appwrite, store):
+    for i in range(5):
+        _seed(appwrite, f"doc-{i}", days_ago=5 - i)
+    appwrite.documents[("chunks", "chunk-0")] = {"documentId": "doc-0"}
+
+    retention._enforce_now("user-1")
+
+    assert [_status(appwrite, f"doc-{i}") for i in range(5)] == [DOC_FAILED] * 2 + [DOC_COMPLETED] * 3
+    assert ("chunks", "chunk-0") not in appwrite.documents
+    ledger = retention._get_ledger("user-1")
+    assert list(ledger.docs) == ["doc-2", "doc-3", "doc-4"]
+    assert ledger.total_chunks == 30
+    assert ledger.pruning == set()
+    # a single partition: the document's conversation and its owner's auth id
+    assert store.deleted[0] == {"document_id": "doc-0", "conversation_id": "conv-1", "user_id": "auth-1"}
+
+
+def test_failed_prune_is_retried(appwrite, store):
+    for i in range(4):
+        _seed(appwrite, f"doc-{i}", days_ago=4 - i)
+
+    store.down = True
+    retention._enforce_now("user-1")
+    ledger = retention._get_ledger("user-1")
+    assert _status(appwrite, "doc-0") == DOC_COMPLETED
+    assert "doc-0" in ledger.docs
+    assert ledger.pruning == set()
+
+    store.down = False
+    retention._enforce_now("user-1")
+    assert _status(appwrite, "doc-0") == DOC_FAILED
+    assert "doc-0" not in ledger.docs
+
+
+def test_ledger_loads_every_page(appwrite, store):
+    for i in range(250):
+        _seed(appwrite, f"doc-{i:03}", days_ago=1, chunks=1)
+    _seed(appwrite, "other-user", days_ago=1, user="user-2")
+    _seed(appwrite, "failed", days_ago=1, status=DOC_FAILED)
+
+    ledger = retention._load_ledger("user-1")
+    assert len(ledger.docs) == 250
+    assert ledger.total_chunks == 250